@@ -1,23 +1,98 @@
 """
 FastAPI backend pentru endpoint-ul ANAF cu CORS corect configurat
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from datetime import datetime
-import requests
-import re
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+import asyncio
+import httpx
+import json
+import math
 import logging
-from typing import Optional
+import os
+import tempfile
+import time
+from typing import List, Optional, Union
+
+from anaf_breaker import CircuitBreaker, CircuitOpenError
+from anaf_cif import clean_cif
+from anaf_cache import EXPIRED, FRESH, STALE, AsyncBackgroundRefresher, CachePolicy, build_cache
+from anaf_batching import ANAF_BATCH_SIZE, AsyncLookupCoalescer, find_company, index_anaf_found
+from anaf_jobs import ANAF_JOB_MAX_CUIS, AsyncJobRunner, JobInputError, build_job_store, iter_results_csv, job_entries, parse_job_csv
+from anaf_mapper import company_response_json, map_anaf_company
+from anaf_periods import build_timeline, spread_days, stable_interval
+from anaf_prewarm import AsyncCachePrewarmer, PopularitySketch
+from anaf_ratelimit import RateLimitExceeded, build_bucket
+from anaf_registry import build_registry
+from anaf_retry import RETRY_STATUSES, RetryPolicy
+from anaf_singleflight import AsyncSingleFlight, clean_lookup_date, normalize_lookup_key
+from anaf_timeouts import DeadlineExceeded, LatencyTracker, call_hedged_async, parse_deadline, remaining, wait_until
+from anaf_warmup import ANAF_WARM_CONNECTIONS, AsyncConnectionWarmer
 
 # Configurare logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ANAF_URL = os.environ.get("ANAF_URL", "https://webservicesp.anaf.ro/api/PlatitorTvaRest/v9/tva")
+ANAF_BATCH_MAX_CUIS = int(os.environ.get("ANAF_BATCH_MAX_CUIS", 1000))
+ANAF_TIMELINE_MAX_DATES = int(os.environ.get("ANAF_TIMELINE_MAX_DATES", 1000))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ANAF_CONNECT_TIMEOUT = float(os.environ.get("ANAF_CONNECT_TIMEOUT", 3))
+ANAF_READ_TIMEOUT = float(os.environ.get("ANAF_READ_TIMEOUT", 10))
+ANAF_POOL_MAX_CONNECTIONS = int(os.environ.get("ANAF_POOL_MAX_CONNECTIONS", 50))
+ANAF_POOL_MAX_KEEPALIVE = int(os.environ.get("ANAF_POOL_MAX_KEEPALIVE", 20))
+ANAF_KEEPALIVE_EXPIRY = float(os.environ.get("ANAF_KEEPALIVE_EXPIRY", 60))
+ANAF_COALESCE_WINDOW_MS = float(os.environ.get("ANAF_COALESCE_WINDOW_MS", 25))
+ANAF_COALESCE_MAX_BATCH = int(os.environ.get("ANAF_COALESCE_MAX_BATCH", ANAF_BATCH_SIZE))
+ANAF_CACHE_MAXSIZE = int(os.environ.get("ANAF_CACHE_MAXSIZE", 10000))
+ANAF_CACHE_TTL_SECONDS = float(os.environ.get("ANAF_CACHE_TTL_SECONDS", 3600))
+ANAF_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get("ANAF_CACHE_NEGATIVE_TTL_SECONDS", 300))
+ANAF_CACHE_STALE_SECONDS = float(os.environ.get("ANAF_CACHE_STALE_SECONDS", 3600))
+ANAF_CACHE_STALE_IF_ERROR_SECONDS = float(os.environ.get("ANAF_CACHE_STALE_IF_ERROR_SECONDS", 86400))
+ANAF_SHARED_CACHE_PATH = os.environ.get("ANAF_SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "normalro_anaf_cache.sqlite3"))
+ANAF_RATE_LIMIT_PATH = os.environ.get("ANAF_RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), "normalro_anaf_ratelimit.sqlite3"))
+ANAF_REGISTRY_PATH = os.environ.get("ANAF_REGISTRY_PATH", "")
+ANAF_JOBS_PATH = os.environ.get("ANAF_JOBS_PATH", os.path.join(tempfile.gettempdir(), "normalro_anaf_jobs.sqlite3"))
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un singur client HTTP per worker: pool de conexiuni keep-alive și sesiuni TLS refolosite către ANAF
+    app.state.anaf_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(ANAF_READ_TIMEOUT, connect=ANAF_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=ANAF_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=ANAF_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=ANAF_KEEPALIVE_EXPIRY,
+        ),
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        },
+    )
+    # DNS rezolvat și conexiuni deschise înainte de primele căutări, ca să nu plătească ele handshake-ul TLS
+    await anaf_warmer.start(timeout=ANAF_CONNECT_TIMEOUT * 2)
+    # Runner-ul job-urilor în masă; preia și job-urile rămase neterminate la repornire
+    if anaf_job_runner is not None:
+        anaf_job_runner.start()
+    anaf_prewarmer.start()
+    yield
+    await anaf_warmer.stop()
+    await anaf_prewarmer.stop()
+    if anaf_job_runner is not None:
+        await anaf_job_runner.stop()
+    await app.state.anaf_client.aclose()
+
+
 app = FastAPI(
     title="NormalRO ANAF API",
     description="API pentru verificare date companii în ANAF",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS - permite cereri de pe www.normal.ro
@@ -30,7 +105,7 @@ app.add_middleware(
     ],
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept-Language"],
+    allow_headers=["Content-Type", "Authorization", "Accept-Language", "X-Deadline-Ms"],
     max_age=3600,
 )
 
@@ -38,6 +113,22 @@ app.add_middleware(
 class ANAFRequest(BaseModel):
     cui: str
     date: Optional[str] = None
+    vat: bool = True
+
+
+class ANAFBatchItem(BaseModel):
+    cui: str
+    date: Optional[str] = None
+
+
+class ANAFBatchRequest(BaseModel):
+    cuis: List[Union[str, ANAFBatchItem]]
+    date: Optional[str] = None
+
+
+class ANAFTimelineRequest(BaseModel):
+    cui: str
+    dates: List[str]
 
 
 class ANAFResponse(BaseModel):
@@ -46,12 +137,272 @@ class ANAFResponse(BaseModel):
     error: Optional[str] = None
 
 
+async def _open_anaf_connection(origin: str):
+    # HEAD către rădăcina serverului: deschide conexiunea (DNS, TCP, TLS) fără să consume din limita API-ului
+    await app.state.anaf_client.head(origin, timeout=ANAF_CONNECT_TIMEOUT)
+
+
+def _anaf_retryable(exc: Exception) -> bool:
+    """Conexiune refuzată sau resetată (inclusiv timeout la conectare) și 502/503/504; nu și timeout-ul de citire"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError))
+
+
+async def _post_anaf(entries: list, deadline: float = None) -> dict:
+    # Erorile trecătoare se reîncearcă, cu backoff și în limita bugetului de reîncercări
+    return await anaf_retries.call_async(lambda: _post_anaf_once(entries, deadline), deadline)
+
+
+async def _post_anaf_once(entries: list, deadline: float = None) -> dict:
+    # Cât timp ANAF e căzut, circuit breaker-ul respinge imediat apelul (CircuitOpenError);
+    # termenul depășit al clientului nu e o eroare a ANAF
+    with anaf_breaker.guard(ignore=(DeadlineExceeded,)):
+        # Timeout-ul urmează latența recentă a ANAF, fără să treacă de termenul clientului
+        read_timeout = anaf_latency.timeout(deadline)
+        timeout = httpx.Timeout(read_timeout, connect=min(ANAF_CONNECT_TIMEOUT, read_timeout))
+        
+        async def attempt():
+            started = time.monotonic()
+            anaf_warmer.touch()
+            try:
+                anaf_response = await app.state.anaf_client.post(ANAF_URL, json=entries, timeout=timeout)
+            except httpx.TimeoutException:
+                remaining(deadline)
+                # Timeout-ul ANAF (nu termenul clientului) intră în percentile, ca timeout-ul să poată crește
+                anaf_latency.record_timeout(read_timeout)
+                raise
+            anaf_latency.record(time.monotonic() - started)
+            if anaf_response.status_code != 200:
+                raise httpx.HTTPStatusError(
+                    f"ANAF status {anaf_response.status_code}", request=anaf_response.request, response=anaf_response
+                )
+            return anaf_response.json()
+        
+        # Un apel mai lent decât p95 primește o dublură, dacă limitatorul are un slot liber imediat
+        return await call_hedged_async(attempt, anaf_latency, anaf_limiter.try_reserve_async, deadline)
+
+
+async def fetch_anaf(entries: list, deadline: float = None) -> dict:
+    """Un singur apel ANAF pentru cel mult ANAF_BATCH_SIZE intrări {"cui", "data"}, în ritmul permis de ANAF"""
+    anaf_breaker.check()
+    # Așteaptă slotul rezervat în găleată; RateLimitExceeded dacă coada e deja plină. Un slot care ar veni
+    # după termenul clientului nu e rezervat deloc
+    wait = await anaf_limiter.reserve_async(max_wait=remaining(deadline))
+    if wait is None:
+        raise DeadlineExceeded()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return await _post_anaf(entries, deadline)
+
+
+def _anaf_error_code(exc: Exception) -> str:
+    if isinstance(exc, CircuitOpenError):
+        return "anaf_circuit_open"
+    if isinstance(exc, RateLimitExceeded):
+        return "anaf_rate_limited"
+    if isinstance(exc, DeadlineExceeded):
+        return "anaf_deadline_exceeded"
+    if isinstance(exc, httpx.HTTPStatusError):
+        return "anaf_service_error"
+    if isinstance(exc, httpx.TimeoutException):
+        return "anaf_timeout"
+    if isinstance(exc, httpx.HTTPError):
+        return "anaf_connection_error"
+    return "server_error"
+
+
+def _batch_result(key: tuple, company_data, stale: bool = False) -> dict:
+    cui, day = key
+    if company_data:
+        result = {"cui": cui, "date": day, "status": "found", "data": company_data.to_dict()}
+    else:
+        result = {"cui": cui, "date": day, "status": "notFound", "error": "cui_not_found"}
+    if stale:
+        result["stale"] = True
+    return result
+
+
+def _validated_key(raw_cui, day: str) -> tuple:
+    try:
+        return normalize_lookup_key(clean_cif(raw_cui), day), None
+    except ValueError as e:
+        return None, str(e)
+
+
+async def _resolve_anaf_chunk(chunk: list, expired: dict = None, deadline: float = None) -> dict:
+    """Un apel ANAF pentru până la ANAF_BATCH_SIZE chei; la eroare se folosesc datele expirate, dacă există"""
+    resolved = {}
+    try:
+        index = index_anaf_found(await fetch_anaf([{"cui": int(cui), "data": day} for cui, day in chunk], deadline))
+    except Exception as e:
+        logger.error(f"ANAF batch error: {str(e)}")
+        error = _anaf_error_code(e)
+        for key in chunk:
+            if expired and key in expired:
+                anaf_cache.stale_on_error += 1
+                resolved[key] = _batch_result(key, expired[key], stale=True)
+            else:
+                resolved[key] = {"cui": key[0], "date": key[1], "status": "error", "error": error}
+        return resolved
+    for key in chunk:
+        company = find_company(index, *key)
+        company_data = map_anaf_company(company, key[0]) if company else None
+        anaf_cache.set_behind(key, company_data, interval=stable_interval(company, key[1]) if company else None)
+        resolved[key] = _batch_result(key, company_data)
+    return resolved
+
+
+async def iter_anaf_batch(entries: list, deadline: float = None):
+    """
+    Generează (poziție, rezultat) pentru perechi (cui, dată) pe măsură ce sunt disponibile:
+    întâi cele invalide și cele din cache, apoi câte un lot de ANAF_BATCH_SIZE, în ordinea răspunsurilor ANAF
+    """
+    positions, missing, expired = {}, [], {}
+    for position, (raw_cui, day) in enumerate(entries):
+        # CUI-urile invalide (format, lungime, cifră de control) nu ajung la ANAF
+        key, error = _validated_key(raw_cui, day)
+        if key:
+            anaf_prewarmer.record(key[0])
+            positions.setdefault(key, []).append(position)
+        else:
+            yield position, {"cui": str(raw_cui).strip(), "date": day, "status": "invalid", "error": error}
+    cached_keys = await anaf_cache.lookup_many_async(list(positions))
+    for key, key_positions in positions.items():
+        state, cached = cached_keys[key]
+        if state == FRESH:
+            result = _batch_result(key, cached)
+        elif state == STALE:
+            anaf_refresher.schedule(key)
+            result = _batch_result(key, cached, stale=True)
+        else:
+            if state == EXPIRED:
+                expired[key] = cached
+            missing.append(key)
+            continue
+        for position in key_positions:
+            yield position, result
+    
+    # Același CUI cerut la mai multe date: primul lot pleacă singur, iar intervalele din răspunsul lui
+    # pot acoperi celelalte date, fără alte apeluri
+    if len(missing) > ANAF_BATCH_SIZE and len({key[0] for key in missing}) < len(missing):
+        resolved = await _resolve_anaf_chunk(missing[:ANAF_BATCH_SIZE], expired, deadline)
+        for key, result in resolved.items():
+            for position in positions[key]:
+                yield position, result
+        found = {key[0] for key, result in resolved.items() if result["status"] == "found"}
+        rest = []
+        covered = await anaf_cache.lookup_many_async([key for key in missing[ANAF_BATCH_SIZE:] if key[0] in found])
+        for key in missing[ANAF_BATCH_SIZE:]:
+            if key in covered:
+                state, cached = covered[key]
+                if state == FRESH:
+                    for position in positions[key]:
+                        yield position, _batch_result(key, cached)
+                    continue
+            rest.append(key)
+        missing = rest
+    
+    # Loturile de câte ANAF_BATCH_SIZE sunt trimise concurent pe pool-ul de conexiuni
+    tasks = [
+        asyncio.ensure_future(_resolve_anaf_chunk(missing[start:start + ANAF_BATCH_SIZE], expired, deadline))
+        for start in range(0, len(missing), ANAF_BATCH_SIZE)
+    ]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            for key, result in (await completed).items():
+                for position in positions[key]:
+                    yield position, result
+    finally:
+        # Clientul s-a deconectat în timpul streaming-ului: loturile rămase nu mai sunt așteptate
+        for task in tasks:
+            task.cancel()
+
+
+async def lookup_anaf_batch(entries: list, deadline: float = None) -> list:
+    """Ca iter_anaf_batch, dar așteaptă toate loturile; rezultatele păstrează ordinea intrărilor"""
+    results = [None] * len(entries)
+    async for position, result in iter_anaf_batch(entries, deadline):
+        results[position] = result
+    return results
+
+
+async def _fetch_company(key: tuple):
+    company = await anaf_coalescer.lookup(*key)
+    company_data = map_anaf_company(company, key[0]) if company else None
+    anaf_cache.set_behind(key, company_data, interval=stable_interval(company, key[1]) if company else None)
+    return company_data
+
+
+async def _refresh_company(key: tuple):
+    return await anaf_flights.do(key, lambda: _fetch_company(key))
+
+
+async def lookup_company(cui: str, search_date: str, deadline: float = None) -> tuple:
+    """
+    Întoarce (date companie sau None dacă ANAF nu o găsește, stale). Intrările vechi din cache se servesc
+    imediat și se reîmprospătează în fundal; dacă ANAF cade, se servește ultima valoare cunoscută.
+    O dată care nu e YYYY-MM-DD e ValueError("invalid_date"), înainte de cache, coalescer și single-flight.
+    """
+    key = normalize_lookup_key(cui, search_date)
+    anaf_prewarmer.record(key[0])
+    state, company_data = await anaf_cache.lookup_async(key)
+    if state == FRESH:
+        return company_data, False
+    if state == STALE:
+        anaf_refresher.schedule(key)
+        return company_data, True
+    try:
+        # Apel către API-ul ANAF (deduplicat și grupat cu alte căutări concurente)
+        # Peste termenul clientului nu mai așteptăm; apelul comun continuă și completează cache-ul
+        return await wait_until(_refresh_company(key), deadline), False
+    except (httpx.HTTPError, CircuitOpenError, RateLimitExceeded, DeadlineExceeded) as e:
+        if state != EXPIRED:
+            raise
+        logger.warning(f"ANAF unavailable, serving stale data for {key}: {str(e)}")
+        anaf_cache.stale_on_error += 1
+        return company_data, True
+
+
+# Oprește temporar apelurile către ANAF când acesta răspunde cu erori sau foarte lent
+anaf_breaker = CircuitBreaker()
+# Ritmul apelurilor către ANAF (găleată comună worker-ilor, printr-un fișier SQLite)
+anaf_limiter = build_bucket(ANAF_RATE_LIMIT_PATH)
+# Latența recentă a ANAF: din ea se derivă timeout-ul de citire și momentul dublării unui apel lent
+anaf_latency = LatencyTracker(ANAF_READ_TIMEOUT)
+# Conexiunile către ANAF sunt deschise la pornirea worker-ului și ținute calde între valurile de trafic
+anaf_warmer = AsyncConnectionWarmer(ANAF_URL, _open_anaf_connection, connections=min(ANAF_WARM_CONNECTIONS, ANAF_POOL_MAX_KEEPALIVE))
+# Reîncercările erorilor trecătoare: cel mult ~10% apeluri în plus, fiecare cu slotul ei la limitator
+anaf_retries = RetryPolicy(_anaf_retryable, limiter=anaf_limiter, breaker=anaf_breaker)
+# Rezultatele mapate (inclusiv "notFound") sunt păstrate în cache pe (cui, dată): în proces și,
+# printr-un fișier SQLite, comun tuturor worker-ilor de pe mașină
+anaf_cache = build_cache(
+    ANAF_CACHE_MAXSIZE,
+    CachePolicy(ANAF_CACHE_TTL_SECONDS, ANAF_CACHE_NEGATIVE_TTL_SECONDS, ANAF_CACHE_STALE_SECONDS, ANAF_CACHE_STALE_IF_ERROR_SECONDS),
+    ANAF_SHARED_CACHE_PATH
+)
+anaf_refresher = AsyncBackgroundRefresher(_refresh_company)
+# Cele mai căutate CUI-uri sunt numărate aproximativ; intrările lor de azi se reîmprospătează
+# în fundal, în loturi pline de câte 100, înainte să expire
+anaf_prewarmer = AsyncCachePrewarmer(PopularitySketch(), anaf_cache, _resolve_anaf_chunk)
+# Căutările individuale concurente sunt grupate într-un singur apel ANAF; cât un lot își așteaptă
+# rândul la limitator, se umple cu căutările care sosesc între timp
+anaf_coalescer = AsyncLookupCoalescer(_post_anaf, window_ms=ANAF_COALESCE_WINDOW_MS, max_batch=ANAF_COALESCE_MAX_BATCH, limiter=anaf_limiter)
+# Căutările identice aflate în curs (același cui și aceeași dată) împart un singur apel
+anaf_flights = AsyncSingleFlight()
+# Registrul local al firmelor (din datele deschise), consultat înaintea ANAF când nu se cere starea TVA
+anaf_registry = build_registry(ANAF_REGISTRY_PATH)
+# Job-urile de verificare în masă: salvate în SQLite și procesate în fundal, în loturi de 100 CUI-uri
+anaf_jobs = build_job_store(ANAF_JOBS_PATH)
+anaf_job_runner = AsyncJobRunner(anaf_jobs, lookup_anaf_batch) if anaf_jobs is not None else None
+
+
 @app.get("/")
 async def root():
     return {
         "message": "NormalRO ANAF API",
         "version": "1.0.0",
-        "endpoints": ["/api/anaf/company"]
+        "endpoints": ["/api/anaf/company", "/api/anaf/company/timeline", "/api/anaf/companies", "/api/anaf/jobs", "/api/companies/suggest", "/api/companies/search"]
     }
 
 
@@ -61,89 +412,67 @@ async def health_check():
 
 
 @app.post("/api/anaf/company")
-async def anaf_company_search(request: ANAFRequest):
+async def anaf_company_search(request: ANAFRequest, x_deadline_ms: Optional[str] = Header(None)):
     """
     Proxy pentru API ANAF - căutare date companie după CUI
     
     Request body:
     {
-        "cui": "12345678",
-        "date": "2024-01-01"  // optional
+        "cui": "37024165",
+        "date": "2024-01-01",  // optional
+        "vat": false  // optional; fără starea TVA răspunde din registrul local, dacă firma există acolo
     }
+    
+    Antetul X-Deadline-Ms limitează cât așteaptă răspunsul (504 anaf_deadline_exceeded după termen).
     """
     cui = request.cui
-    search_date = request.date or datetime.now().strftime("%Y-%m-%d")
     
     if not cui:
         raise HTTPException(status_code=400, detail="cui_required")
     
-    # Curăță CUI-ul (elimină RO, spații, caractere non-numerice)
-    clean_cui = re.sub(r'[^0-9]', '', str(cui))
+    # Validează CUI-ul local (prefix RO, lungime, cifră de control) înainte de apelul ANAF
+    try:
+        clean_cui = clean_cif(cui)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # La fel data: una neinterpretabilă nu ajunge în lotul comun ANAF și nici în cheile cache-ului
+    try:
+        search_date = clean_lookup_date(request.date) if request.date else datetime.now().strftime("%Y-%m-%d")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    if not clean_cui:
-        raise HTTPException(status_code=400, detail="invalid_cui")
+    if not request.vat and anaf_registry is not None:
+        company_data = anaf_registry.get(clean_cui)
+        if company_data:
+            return {"success": True, "data": company_data, "source": "registry"}
     
     try:
-        # Apel către API-ul ANAF (URL corect: /api/PlatitorTvaRest/)
-        anaf_url = "https://webservicesp.anaf.ro/api/PlatitorTvaRest/v9/tva"
-        anaf_response = requests.post(
-            anaf_url,
-            json=[{"cui": int(clean_cui), "data": search_date}],
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            timeout=10
-        )
-        
-        if anaf_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="anaf_service_error")
-        
-        anaf_data = anaf_response.json()
+        company_data, stale = await lookup_company(clean_cui, search_date, parse_deadline(x_deadline_ms))
         
-        # Verifică dacă compania a fost găsită
-        if anaf_data.get("found") and len(anaf_data["found"]) > 0:
-            company = anaf_data["found"][0]
-            date_generale = company.get("date_generale", {})
-            adresa_sediu = company.get("adresa_sediu_social", {})
-            
-            # Construiește adresa completă
-            adresa_parts = []
-            if adresa_sediu.get("sdenumire_Strada"):
-                adresa_parts.append(adresa_sediu["sdenumire_Strada"])
-            if adresa_sediu.get("snumar_Strada"):
-                adresa_parts.append(f"Nr. {adresa_sediu['snumar_Strada']}")
-            if adresa_sediu.get("sdenumire_Localitate"):
-                adresa_parts.append(adresa_sediu["sdenumire_Localitate"])
-            if adresa_sediu.get("sdenumire_Judet"):
-                adresa_parts.append(adresa_sediu["sdenumire_Judet"])
-            
-            adresa_completa = ", ".join(adresa_parts) if adresa_parts else date_generale.get("adresa", "")
-            
-            return {
-                "success": True,
-                "data": {
-                    "cui": date_generale.get("cui", clean_cui),
-                    "denumire": date_generale.get("denumire", ""),
-                    "nrRegCom": date_generale.get("nrRegCom", ""),
-                    "adresa": adresa_completa,
-                    "oras": adresa_sediu.get("sdenumire_Localitate", ""),
-                    "judet": adresa_sediu.get("sdenumire_Judet", ""),
-                    "telefon": date_generale.get("telefon", ""),
-                    "codPostal": date_generale.get("codPostal", ""),
-                    "platitorTVA": company.get("inregistrare_scop_Tva", {}).get("scpTVA", False)
-                }
-            }
-        else:
-            return {
-                "success": False,
-                "error": "CUI nu a fost găsit în ANAF"
-            }
+        # Verifică dacă compania a fost găsită; JSON-ul firmei din cache e serializat o singură dată
+        if company_data:
+            return Response(company_response_json(company_data, stale), media_type="application/json")
+        result = {
+            "success": False,
+            "error": "CUI nu a fost găsit în ANAF"
+        }
+        # Date servite din cache fără confirmare recentă de la ANAF
+        if stale:
+            result["stale"] = True
+        return result
             
-    except requests.Timeout:
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail="anaf_circuit_open", headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail="anaf_rate_limited", headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except httpx.HTTPStatusError:
+        raise HTTPException(status_code=500, detail="anaf_service_error")
+    except httpx.TimeoutException:
         logger.error("ANAF API timeout")
         raise HTTPException(status_code=504, detail="anaf_timeout")
-    except requests.RequestException as e:
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="anaf_deadline_exceeded")
+    except httpx.HTTPError as e:
         logger.error(f"ANAF API connection error: {str(e)}")
         raise HTTPException(status_code=500, detail="anaf_connection_error")
     except Exception as e:
@@ -151,6 +480,224 @@ async def anaf_company_search(request: ANAFRequest):
         raise HTTPException(status_code=500, detail=f"server_error: {str(e)}")
 
 
+@app.post("/api/anaf/company/timeline")
+async def anaf_company_timeline(request: ANAFTimelineRequest, x_deadline_ms: Optional[str] = Header(None)):
+    """
+    Starea TVA a unui CUI la mai multe date (de ex. datele facturilor), în cât mai puține apeluri ANAF
+    
+    Request body:
+    {
+        "cui": "RO14399840",
+        "dates": ["2024-01-15", "2024-02-03", "2024-03-28"]
+    }
+    """
+    if not request.cui:
+        raise HTTPException(status_code=400, detail="cui_required")
+    try:
+        clean_cui = clean_cif(request.cui)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not request.dates:
+        raise HTTPException(status_code=400, detail="dates_required")
+    try:
+        days = {date.fromisoformat(day.strip()).isoformat() for day in request.dates}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid_date")
+    if len(days) > ANAF_TIMELINE_MAX_DATES:
+        raise HTTPException(status_code=400, detail="too_many_dates")
+    
+    # Aceeași firmă la date diferite: până la 100 de date într-un apel ANAF
+    entries = [(clean_cui, day) for day in spread_days(days, ANAF_BATCH_SIZE)]
+    company, timeline = build_timeline(await lookup_anaf_batch(entries, parse_deadline(x_deadline_ms)))
+    return {"success": True, "cui": clean_cui, "data": company, "timeline": timeline}
+
+
+def _accept_match(accept: str, media_type: str) -> tuple:
+    """(q, specificitate) a intervalului cel mai specific din Accept care acoperă `media_type`; (0, -1) dacă niciunul"""
+    main_type = media_type.split("/")[0]
+    best = (-1, 0.0)
+    for item in accept.split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        value = value.lower()
+        if value == media_type:
+            specificity = 2
+        elif value == f"{main_type}/*":
+            specificity = 1
+        elif value == "*/*":
+            specificity = 0
+        else:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(number), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        if specificity > best[0]:
+            best = (specificity, quality)
+    return (best[1], best[0]) if best[0] >= 0 else (0.0, -1)
+
+
+def _wants_ndjson(accept: Optional[str]) -> bool:
+    """Ca best_match din Flask: câștigă tipul cu q-ul mai mare, apoi cel cerut mai specific; q=0 îl refuză, la egalitate rămâne JSON"""
+    ndjson = _accept_match(accept or "", NDJSON_MEDIA_TYPE)
+    return ndjson[0] > 0 and ndjson > _accept_match(accept or "", "application/json")
+
+
+def _ndjson(item) -> str:
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+@app.post("/api/anaf/companies")
+async def anaf_companies_search(
+    request: ANAFBatchRequest, accept: Optional[str] = Header(None), x_deadline_ms: Optional[str] = Header(None)
+):
+    """
+    Proxy pentru API ANAF - căutare în lot, grupată în apeluri de câte 100 CUI-uri
+    
+    Request body:
+    {
+        "cuis": ["37024165", {"cui": "RO14399840", "date": "2024-01-01"}],
+        "date": "2024-01-01"  // optional, implicit pentru toate intrările
+    }
+    
+    Cu Accept: application/x-ndjson răspunsul e transmis câte un rezultat pe linie (cu "index",
+    poziția din cerere) imediat ce lotul lui ANAF a răspuns; ultima linie e {"summary": ...}.
+    Loturile rămase după termenul din X-Deadline-Ms primesc status "error" (anaf_deadline_exceeded).
+    """
+    if not request.cuis:
+        raise HTTPException(status_code=400, detail="cuis_required")
+    if len(request.cuis) > ANAF_BATCH_MAX_CUIS:
+        raise HTTPException(status_code=400, detail="too_many_cuis")
+    
+    try:
+        default_date = clean_lookup_date(request.date) if request.date else datetime.now().strftime("%Y-%m-%d")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    entries = []
+    for item in request.cuis:
+        raw_cui, item_date = (item.cui, item.date) if isinstance(item, ANAFBatchItem) else (item, None)
+        entries.append((raw_cui, item_date or default_date))
+    
+    deadline = parse_deadline(x_deadline_ms)
+    if _wants_ndjson(accept):
+        return StreamingResponse(_stream_anaf_batch(entries, deadline), media_type=NDJSON_MEDIA_TYPE)
+    results = await lookup_anaf_batch(entries, deadline)
+    summary = {"total": len(results), "found": 0, "notFound": 0, "invalid": 0, "error": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return {"success": True, "results": results, "summary": summary}
+
+
+async def _stream_anaf_batch(entries: list, deadline: float = None):
+    summary = {"total": len(entries), "found": 0, "notFound": 0, "invalid": 0, "error": 0}
+    async for position, result in iter_anaf_batch(entries, deadline):
+        summary[result["status"]] += 1
+        yield _ndjson({"index": position, **result})
+    yield _ndjson({"summary": summary})
+
+
+@app.post("/api/anaf/jobs", status_code=202)
+async def anaf_job_create(request: Request, date: Optional[str] = None):
+    """
+    Job de verificare în masă; răspunde imediat cu jobId, progresul se citește din /api/anaf/jobs/{jobId}
+    
+    Corpul este fie JSON (ca la /api/anaf/companies), fie un CSV (Content-Type: text/csv)
+    cu o coloană cui și, opțional, date.
+    """
+    if anaf_jobs is None:
+        raise HTTPException(status_code=503, detail="jobs_unavailable")
+    default_date = date or datetime.now().strftime("%Y-%m-%d")
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith(("text/csv", "text/plain")):
+            entries = parse_job_csv((await request.body()).decode("utf-8-sig", errors="replace"))
+        else:
+            batch = ANAFBatchRequest.model_validate(await request.json())
+            default_date = batch.date or default_date
+            entries = [(item.cui, item.date) if isinstance(item, ANAFBatchItem) else (item, None) for item in batch.cuis]
+        entries = job_entries(entries, default_date)
+    except JobInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (ValueError, ValidationError):
+        raise HTTPException(status_code=400, detail="invalid_request")
+    if not entries:
+        raise HTTPException(status_code=400, detail="cuis_required")
+    if len(entries) > ANAF_JOB_MAX_CUIS:
+        raise HTTPException(status_code=400, detail="too_many_cuis")
+    # Scrierea în SQLite poate aștepta lock-ul fișierului: rulează pe un thread, nu pe bucla de evenimente
+    job_id = await asyncio.to_thread(anaf_jobs.create, entries)
+    anaf_job_runner.wake()
+    return JSONResponse({"success": True, **await asyncio.to_thread(anaf_jobs.get, job_id)}, status_code=202, headers={"Location": f"/api/anaf/jobs/{job_id}"})
+
+
+async def _existing_job(job_id: str) -> dict:
+    if anaf_jobs is None:
+        raise HTTPException(status_code=503, detail="jobs_unavailable")
+    job = await asyncio.to_thread(anaf_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job_not_found")
+    return job
+
+
+@app.get("/api/anaf/jobs/{job_id}")
+async def anaf_job_status(job_id: str):
+    return {"success": True, **await _existing_job(job_id)}
+
+
+@app.get("/api/anaf/jobs/{job_id}/results")
+async def anaf_job_results(job_id: str, offset: int = 0, limit: int = 100, accept: Optional[str] = Header(None)):
+    await _existing_job(job_id)
+    offset, limit = max(offset, 0), max(1, min(limit, 1000))
+    if _wants_ndjson(accept):
+        # Rezultatele procesate de la offset, fără limită, citite din SQLite pe măsură ce sunt trimise
+        return StreamingResponse(map(_ndjson, anaf_jobs.iter_results(job_id, offset=offset)), media_type=NDJSON_MEDIA_TYPE)
+    results = await asyncio.to_thread(anaf_jobs.results, job_id, offset, limit)
+    return {"success": True, "jobId": job_id, "offset": offset, "limit": limit, "results": results}
+
+
+@app.get("/api/anaf/jobs/{job_id}/results.csv")
+async def anaf_job_results_csv(job_id: str):
+    await _existing_job(job_id)
+    # Iteratorul sincron (citiri SQLite) e parcurs de Starlette pe un thread, nu pe bucla de evenimente
+    return StreamingResponse(
+        iter_results_csv(anaf_jobs.iter_results(job_id)),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="anaf-{job_id}.csv"'},
+    )
+
+
+@app.get("/api/companies/suggest")
+async def companies_suggest(q: str = "", limit: int = 10):
+    """Autocompletare după denumire, din registrul local (fără apel ANAF)"""
+    query = q.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="query_required")
+    results = anaf_registry.suggest(query, max(1, min(limit, 50))) if anaf_registry is not None else None
+    if results is None:
+        raise HTTPException(status_code=503, detail="registry_unavailable")
+    return {"success": True, "query": query, "results": results}
+
+
+@app.get("/api/companies/search")
+async def companies_search(q: str = "", limit: int = 10):
+    """Căutare tolerantă la greșeli de tastare după denumire, din registrul local"""
+    query = q.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="query_required")
+    results = anaf_registry.search(query, max(1, min(limit, 50))) if anaf_registry is not None else None
+    if results is None:
+        raise HTTPException(status_code=503, detail="registry_unavailable")
+    return {"success": True, "query": query, "results": results}
+
+
+@app.get("/api/anaf/status")
+async def anaf_status():
+    return {"breaker": anaf_breaker.stats(), "rateLimit": anaf_limiter.stats(), "latency": anaf_latency.stats(), "retries": anaf_retries.stats(), "warmup": anaf_warmer.stats(), "cache": anaf_cache.stats(), "coalescer": anaf_coalescer.stats(), "singleFlight": anaf_flights.stats(), "refresher": anaf_refresher.stats(), "prewarm": anaf_prewarmer.stats(), "registry": anaf_registry.stats() if anaf_registry else None, "jobs": anaf_job_runner.stats() if anaf_job_runner else None}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
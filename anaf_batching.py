@@ -0,0 +1,278 @@
+"""
+Grupare (micro-batching) a căutărilor ANAF individuale.
+
+Căutările după un singur CUI care sosesc într-o fereastră scurtă de timp sunt
+trimise împreună, într-un singur apel ANAF cu mai multe intrări; fiecare
+apelant primește apoi doar compania lui din "found" (sau None dacă e în
+"notFound"). `LookupCoalescer` e pentru aplicația Flask (thread-uri),
+`AsyncLookupCoalescer` pentru FastAPI (asyncio).
+
+Cu un `limiter` (vezi anaf_ratelimit), fiecare lot își rezervă un slot la
+închiderea ferestrei; cât așteaptă slotul, lotul continuă să primească CUI-uri
+până la `max_batch`, așa că sub presiunea limitei apelurile pleacă pline.
+"""
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from anaf_ratelimit import RateLimitExceeded
+
+ANAF_BATCH_SIZE = 100
+
+
+def index_anaf_found(anaf_data: dict) -> dict:
+    # ANAF întoarce "found" fără ordine garantată; indexăm după (cui, data) și, ca rezervă pentru o dată
+    # scrisă altfel decât în cerere, doar după cui. Rezerva rămâne numai pentru un CUI cu un singur răspuns
+    # care nu apare și în "notFound": altfel o dată negăsită ar primi înregistrarea altei date
+    index = {}
+    ambiguous = {str(cui) for cui in anaf_data.get("notFound") or []}
+    for company in anaf_data.get("found") or []:
+        date_generale = company.get("date_generale", {})
+        company_cui = str(date_generale.get("cui", ""))
+        index[(company_cui, date_generale.get("data"))] = company
+        if (company_cui, None) in index:
+            ambiguous.add(company_cui)
+        index[(company_cui, None)] = company
+    for company_cui in ambiguous:
+        index.pop((company_cui, None), None)
+    return index
+
+
+def find_company(index: dict, cui: str, day: str):
+    return index.get((cui, day)) or index.get((cui, None))
+
+
+def _batch_entries(items: dict) -> list:
+    return [{"cui": int(cui), "data": day} for cui, day in items]
+
+
+class _Batch:
+    __slots__ = ("items", "reserved")
+
+    def __init__(self):
+        self.items = {}
+        self.reserved = False
+
+
+class LookupCoalescer:
+    """Coalescer pentru apelanți pe thread-uri; `fetch_batch` face un apel ANAF blocant"""
+
+    def __init__(self, fetch_batch, window_ms: float = 25, max_batch: int = ANAF_BATCH_SIZE, limiter=None):
+        self._fetch_batch = fetch_batch
+        self._window = window_ms / 1000
+        self._max_batch = max(1, min(max_batch, ANAF_BATCH_SIZE))
+        self._limiter = limiter
+        self._lock = threading.Lock()
+        self._open = _Batch()
+        self._sealed = deque()
+        self._timer = None
+        self.lookups = 0
+        self.upstream_calls = 0
+
+    def lookup(self, cui: str, day: str):
+        """Întoarce compania brută din răspunsul ANAF sau None; excepțiile upstream se propagă"""
+        future = Future()
+        wait = None
+        with self._lock:
+            self.lookups += 1
+            batch = self._open
+            batch.items.setdefault((cui, day), []).append(future)
+            if self._window <= 0 or len(batch.items) >= self._max_batch:
+                wait = self._seal()
+            elif self._timer is None and not batch.reserved:
+                self._timer = threading.Timer(self._window, self._on_window)
+                self._timer.daemon = True
+                self._timer.start()
+        self._schedule(wait)
+        return future.result()
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "upstreamCalls": self.upstream_calls,
+            "pending": len(self._open.items) + sum(len(batch.items) for batch in self._sealed),
+            "queuedBatches": len(self._sealed),
+        }
+
+    # _seal și _reserve se apelează doar cu self._lock luat
+    def _seal(self):
+        """Închide lotul deschis (sub lock); întoarce așteptarea pentru slotul lui sau None"""
+        batch, self._open = self._open, _Batch()
+        self._cancel_timer()
+        wait = None if batch.reserved else self._reserve(batch)
+        if batch.reserved:
+            self._sealed.append(batch)
+        return wait
+
+    def _reserve(self, batch: _Batch):
+        """Rezervă un slot pentru lot (sub lock); dacă coada e plină, lotul eșuează cu RateLimitExceeded"""
+        try:
+            wait = self._limiter.reserve() if self._limiter is not None else 0.0
+        except RateLimitExceeded as exc:
+            for futures in batch.items.values():
+                for future in futures:
+                    future.set_exception(exc)
+            return None
+        batch.reserved = True
+        return wait
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self, wait):
+        if wait is None:
+            return
+        if wait <= 0:
+            self._fire()
+        else:
+            timer = threading.Timer(wait, self._fire)
+            timer.daemon = True
+            timer.start()
+
+    def _on_window(self):
+        with self._lock:
+            self._timer = None
+            batch = self._open
+            if not batch.items or batch.reserved:
+                return
+            wait = self._reserve(batch)
+            if wait is None:
+                self._open = _Batch()
+        self._schedule(wait)
+
+    def _fire(self):
+        # Fiecare slot rezervat pornește cel mai vechi lot rezervat
+        with self._lock:
+            if self._sealed:
+                batch = self._sealed.popleft()
+            else:
+                batch, self._open = self._open, _Batch()
+                self._cancel_timer()
+        if batch.items:
+            self._run(batch.items)
+
+    def _run(self, items: dict):
+        self.upstream_calls += 1
+        try:
+            index = index_anaf_found(self._fetch_batch(_batch_entries(items)))
+        except BaseException as exc:
+            for futures in items.values():
+                for future in futures:
+                    future.set_exception(exc)
+            return
+        for (cui, day), futures in items.items():
+            company = find_company(index, cui, day)
+            for future in futures:
+                future.set_result(company)
+
+
+class AsyncLookupCoalescer:
+    """Coalescer pentru FastAPI; `fetch_batch` este o corutină care face apelul ANAF"""
+
+    def __init__(self, fetch_batch, window_ms: float = 25, max_batch: int = ANAF_BATCH_SIZE, limiter=None):
+        self._fetch_batch = fetch_batch
+        self._window = window_ms / 1000
+        self._max_batch = max(1, min(max_batch, ANAF_BATCH_SIZE))
+        self._limiter = limiter
+        self._open = _Batch()
+        self._sealed = deque()
+        self._handle = None
+        self._tasks = set()
+        self.lookups = 0
+        self.upstream_calls = 0
+
+    async def lookup(self, cui: str, day: str):
+        """Întoarce compania brută din răspunsul ANAF sau None; excepțiile upstream se propagă"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.lookups += 1
+        batch = self._open
+        batch.items.setdefault((cui, day), []).append(future)
+        if self._window <= 0 or len(batch.items) >= self._max_batch:
+            self._seal()
+        elif self._handle is None and not batch.reserved:
+            self._handle = loop.call_later(self._window, self._on_window)
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "upstreamCalls": self.upstream_calls,
+            "pending": len(self._open.items) + sum(len(batch.items) for batch in self._sealed),
+            "queuedBatches": len(self._sealed),
+        }
+
+    def _seal(self):
+        batch, self._open = self._open, _Batch()
+        self._cancel_handle()
+        self._sealed.append(batch)
+        if not batch.reserved:
+            self._reserve(batch)
+
+    def _reserve(self, batch: _Batch):
+        # Slotul se cere pe un task: în fișierul SQLite comun rezervarea poate aștepta lock-ul, iar
+        # lotul rămas deschis primește CUI-uri în continuare
+        batch.reserved = True
+        self._spawn(self._acquire(batch))
+
+    async def _acquire(self, batch: _Batch):
+        try:
+            wait = await self._limiter.reserve_async() if self._limiter is not None else 0.0
+        except RateLimitExceeded as exc:
+            self._detach(batch)
+            for futures in batch.items.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._fire(batch)
+
+    def _detach(self, batch: _Batch):
+        if batch is self._open:
+            self._open = _Batch()
+            self._cancel_handle()
+        else:
+            self._sealed.remove(batch)
+
+    def _cancel_handle(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _on_window(self):
+        self._handle = None
+        batch = self._open
+        if batch.items and not batch.reserved:
+            self._reserve(batch)
+
+    def _fire(self, batch: _Batch):
+        # Lotul pleacă la slotul lui; dacă era încă deschis, următoarele CUI-uri intră într-unul nou
+        self._detach(batch)
+        if batch.items:
+            self._spawn(self._run(batch.items))
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: dict):
+        self.upstream_calls += 1
+        try:
+            index = index_anaf_found(await self._fetch_batch(_batch_entries(items)))
+        except Exception as exc:
+            for futures in items.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        for (cui, day), futures in items.items():
+            company = find_company(index, cui, day)
+            for future in futures:
+                if not future.done():
+                    future.set_result(company)
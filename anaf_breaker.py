@@ -0,0 +1,184 @@
+"""
+Circuit breaker pentru apelurile către ANAF.
+
+CLOSED: apelurile trec, iar rezultatele lor intră într-o fereastră glisantă.
+Dacă proporția de erori sau de apeluri lente depășește pragul, breaker-ul
+trece în OPEN: apelurile eșuează imediat cu `CircuitOpenError` (aplicațiile
+servesc atunci din cache, dacă pot). După `open_seconds` se trece în
+HALF_OPEN și se lasă un număr mic de apeluri de probă; dacă reușesc,
+breaker-ul se închide, altfel se redeschide cu o pauză dublată (până la
+`max_open_seconds`).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+ANAF_BREAKER_WINDOW_SECONDS = float(os.environ.get("ANAF_BREAKER_WINDOW_SECONDS", 30))
+ANAF_BREAKER_MIN_CALLS = int(os.environ.get("ANAF_BREAKER_MIN_CALLS", 10))
+ANAF_BREAKER_FAILURE_RATE = float(os.environ.get("ANAF_BREAKER_FAILURE_RATE", 0.5))
+ANAF_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get("ANAF_BREAKER_SLOW_CALL_SECONDS", 5))
+ANAF_BREAKER_SLOW_CALL_RATE = float(os.environ.get("ANAF_BREAKER_SLOW_CALL_RATE", 0.8))
+ANAF_BREAKER_OPEN_SECONDS = float(os.environ.get("ANAF_BREAKER_OPEN_SECONDS", 15))
+ANAF_BREAKER_MAX_OPEN_SECONDS = float(os.environ.get("ANAF_BREAKER_MAX_OPEN_SECONDS", 120))
+ANAF_BREAKER_HALF_OPEN_CALLS = int(os.environ.get("ANAF_BREAKER_HALF_OPEN_CALLS", 1))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("anaf_circuit_open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window_seconds: float = ANAF_BREAKER_WINDOW_SECONDS,
+        min_calls: int = ANAF_BREAKER_MIN_CALLS,
+        failure_rate: float = ANAF_BREAKER_FAILURE_RATE,
+        slow_call_seconds: float = ANAF_BREAKER_SLOW_CALL_SECONDS,
+        slow_call_rate: float = ANAF_BREAKER_SLOW_CALL_RATE,
+        open_seconds: float = ANAF_BREAKER_OPEN_SECONDS,
+        max_open_seconds: float = ANAF_BREAKER_MAX_OPEN_SECONDS,
+        half_open_calls: int = ANAF_BREAKER_HALF_OPEN_CALLS,
+        clock=time.monotonic,
+    ):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._open_for = open_seconds
+        self._probes = 0
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def before_call(self):
+        """Ridică CircuitOpenError dacă apelul nu are voie să plece spre ANAF"""
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == OPEN or (state == HALF_OPEN and self._probes >= self.half_open_calls):
+                self.rejected += 1
+                raise CircuitOpenError(retry_after=max(self._opened_at + self._open_for - now, 1.0))
+            if state == HALF_OPEN:
+                self._probes += 1
+
+    def check(self):
+        """Ridică CircuitOpenError dacă breaker-ul e deschis, fără să consume un apel de probă"""
+        with self._lock:
+            now = self._clock()
+            if self._current_state(now) == OPEN:
+                raise CircuitOpenError(retry_after=max(self._opened_at + self._open_for - now, 1.0))
+
+    def record(self, success: bool, duration: float):
+        with self._lock:
+            now = self._clock()
+            slow = duration >= self.slow_call_seconds
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if success and not slow:
+                    self._close()
+                else:
+                    self._trip(now, backoff=True)
+                return
+            if self._state == OPEN:
+                # Un apel pornit înainte de deschidere; nu schimbă starea
+                return
+            self._calls.append((now, not success, slow))
+            self._failures += not success
+            self._slow += slow
+            self._expire(now)
+            total = len(self._calls)
+            if total >= self.min_calls and (
+                self._failures / total >= self.failure_rate or self._slow / total >= self.slow_call_rate
+            ):
+                self._trip(now, backoff=False)
+
+    def release(self):
+        """Renunță la un apel pornit cu before_call() fără să-i înregistreze rezultatul"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+
+    @contextmanager
+    def guard(self, ignore: tuple = ()):
+        """
+        `with breaker.guard(): ...` - verifică starea și înregistrează rezultatul și durata apelului;
+        excepțiile din `ignore` (de ex. termenul clientului depășit) nu spun nimic despre ANAF, la fel ca
+        anularea apelului (asyncio.CancelledError când clientul se deconectează, GeneratorExit)
+        """
+        self.before_call()
+        started = self._clock()
+        try:
+            yield
+        except ignore:
+            self.release()
+            raise
+        except Exception:
+            self.record(False, self._clock() - started)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record(True, self._clock() - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            self._expire(now)
+            total = len(self._calls)
+            return {
+                "state": state,
+                "calls": total,
+                "failureRate": round(self._failures / total, 4) if total else 0.0,
+                "slowCallRate": round(self._slow / total, 4) if total else 0.0,
+                "retryAfter": round(max(self._opened_at + self._open_for - now, 0.0), 1) if state == OPEN else 0.0,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now >= self._opened_at + self._open_for:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def _expire(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _trip(self, now: float, backoff: bool):
+        self._open_for = min(self._open_for * 2, self.max_open_seconds) if backoff else self.open_seconds
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self._failures = self._slow = 0
+        self.trips += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._open_for = self.open_seconds
+        self._calls.clear()
+        self._failures = self._slow = 0
@@ -0,0 +1,464 @@
+"""
+Cache pentru rezultatele căutărilor ANAF.
+
+Cheia este (cui, dată) normalizată, valoarea este înregistrarea `Company`
+deja mapată (vezi anaf_mapper) sau None pentru "notFound" (cache negativ, cu TTL mai scurt).
+`TTLCache` e cache-ul din proces (LRU, evacuare la `maxsize`), `SQLiteCache`
+e un cache comun tuturor worker-ilor de pe aceeași mașină, iar `TieredCache`
+le combină: L1 în proces, L2 în fișierul SQLite.
+
+O intrare trece prin trei stări: proaspătă (se servește direct), veche dar
+servibilă (se servește imediat și se reîmprospătează în fundal) și expirată
+(se cere din nou la ANAF; dacă ANAF nu răspunde, se servește totuși ultima
+valoare cunoscută, marcată ca veche).
+
+În FastAPI, `lookup_async` / `lookup_many_async` citesc fișierul SQLite pe un thread (un hit
+proaspăt în L1 rămâne pe bucla de evenimente), iar `set_behind` actualizează
+L1 imediat și scrie în L2 în fundal, pe un singur thread, în ordinea scrierilor.
+
+Pentru o firmă găsită se ține și intervalul de date în care răspunsul ANAF
+rămâne același (vezi anaf_periods): o căutare pentru altă dată din interval
+primește înregistrarea deja salvată, fără apel la ANAF.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from anaf_mapper import Company
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+FRESH, STALE, EXPIRED = "fresh", "stale", "expired"
+
+
+class CachePolicy:
+    """Calculează momentele (fresh_until, stale_until, keep_until) pentru o valoare nouă"""
+
+    def __init__(self, ttl: float = 3600, negative_ttl: float = 300, stale_ttl: float = 3600, stale_if_error_ttl: float = 86400):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.stale_if_error_ttl = stale_if_error_ttl
+
+    def entry(self, value, ttl: float = None, now: float = None) -> tuple:
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+        fresh_until = (time.time() if now is None else now) + ttl
+        return fresh_until, fresh_until + self.stale_ttl, fresh_until + max(self.stale_ttl, self.stale_if_error_ttl), value
+
+
+def entry_state(entry: tuple, now: float) -> str:
+    if now < entry[0]:
+        return FRESH
+    if now < entry[1]:
+        return STALE
+    return EXPIRED
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 10000, clock=time.time):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_entry(self, key):
+        """Întoarce (fresh_until, stale_until, keep_until, valoare) sau None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put_entry(self, key, entry: tuple):
+        if self.maxsize <= 0 or entry[2] <= self._clock():
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "evictions": self.evictions, "expirations": self.expirations}
+
+
+class IntervalIndex:
+    """Pentru fiecare CUI, intervalele [start, end] (date ISO) acoperite de înregistrarea salvată pe (cui, day)"""
+
+    def __init__(self, maxsize: int = 10000, per_cui: int = 8):
+        self.maxsize = maxsize
+        self.per_cui = per_cui
+        self._lock = threading.Lock()
+        self._intervals = OrderedDict()
+
+    def add(self, key, interval: tuple):
+        cui, day = key
+        start, end = interval
+        with self._lock:
+            # Intervalele incluse în cel nou nu mai sunt necesare
+            intervals = [item for item in self._intervals.get(cui, ()) if item[2] != day and not (start <= item[0] and item[1] <= end)]
+            intervals.append((start, end, day))
+            self._intervals[cui] = intervals[-self.per_cui:]
+            self._intervals.move_to_end(cui)
+            while len(self._intervals) > self.maxsize:
+                self._intervals.popitem(last=False)
+
+    def find(self, key):
+        """Cheia (cui, day) a unei înregistrări care acoperă data din `key`, sau None"""
+        cui, day = key
+        with self._lock:
+            for start, end, covering_day in reversed(self._intervals.get(cui, ())):
+                if start <= day <= end:
+                    return cui, covering_day
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._intervals.clear()
+
+
+class SQLiteCache:
+    """Cache comun între procese, într-un fișier SQLite în mod WAL; expirarea folosește ceasul de perete"""
+
+    SCHEMA_VERSION = 3
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # O conexiune per thread; după fork (gunicorn --preload) worker-ul își deschide una proprie
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                self._migrate(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # E doar un cache: la schimbarea schemei tabela veche se aruncă
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS anaf_cache")
+                conn.execute("DROP TABLE IF EXISTS anaf_cache_intervals")
+                conn.execute(
+                    "CREATE TABLE anaf_cache ("
+                    "cui TEXT NOT NULL, day TEXT NOT NULL, fresh_until REAL NOT NULL, stale_until REAL NOT NULL, "
+                    "keep_until REAL NOT NULL, value BLOB, PRIMARY KEY (cui, day)) WITHOUT ROWID"
+                )
+                conn.execute(
+                    "CREATE TABLE anaf_cache_intervals ("
+                    "cui TEXT NOT NULL, day TEXT NOT NULL, start_day TEXT NOT NULL, end_day TEXT NOT NULL, "
+                    "PRIMARY KEY (cui, day)) WITHOUT ROWID"
+                )
+                conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_entry(self, key):
+        """Întoarce (fresh_until, stale_until, keep_until, valoare) sau None; erorile SQLite sunt tratate ca miss"""
+        try:
+            row = self._connect().execute(
+                "SELECT fresh_until, stale_until, keep_until, value FROM anaf_cache WHERE cui = ? AND day = ?", key
+            ).fetchone()
+        except sqlite3.Error as exc:
+            self.errors += 1
+            logger.warning(f"ANAF shared cache read failed: {exc}")
+            return None
+        if row is None or row[2] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], row[1], row[2], (Company.from_dict(json.loads(row[3])) if row[3] is not None else None)
+
+    def put_entry(self, key, entry: tuple, interval: tuple = None):
+        fresh_until, stale_until, keep_until, value = entry
+        blob = value.to_json().encode("utf-8") if value is not None else None
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO anaf_cache (cui, day, fresh_until, stale_until, keep_until, value) VALUES (?, ?, ?, ?, ?, ?)",
+                (key[0], key[1], fresh_until, stale_until, keep_until, blob),
+            )
+            if interval is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO anaf_cache_intervals (cui, day, start_day, end_day) VALUES (?, ?, ?, ?)",
+                    (key[0], key[1], *interval),
+                )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM anaf_cache WHERE keep_until <= ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM anaf_cache_intervals WHERE NOT EXISTS "
+                    "(SELECT 1 FROM anaf_cache WHERE anaf_cache.cui = anaf_cache_intervals.cui AND anaf_cache.day = anaf_cache_intervals.day)"
+                )
+        except sqlite3.Error as exc:
+            self.errors += 1
+            logger.warning(f"ANAF shared cache write failed: {exc}")
+
+    def find_interval(self, key):
+        """Cheia (cui, day) a unei înregistrări comune care acoperă data din `key`, sau None"""
+        try:
+            row = self._connect().execute(
+                "SELECT day FROM anaf_cache_intervals WHERE cui = ? AND start_day <= ? AND end_day >= ? ORDER BY end_day DESC LIMIT 1",
+                (key[0], key[1], key[1]),
+            ).fetchone()
+        except sqlite3.Error as exc:
+            self.errors += 1
+            logger.warning(f"ANAF shared cache read failed: {exc}")
+            return None
+        return (key[0], row[0]) if row else None
+
+    def clear(self):
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM anaf_cache")
+            conn.execute("DELETE FROM anaf_cache_intervals")
+        except sqlite3.Error as exc:
+            self.errors += 1
+            logger.warning(f"ANAF shared cache clear failed: {exc}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TieredCache:
+    """L1 în proces în fața unui L2 comun; un hit mai proaspăt în L2 reîncarcă L1"""
+
+    def __init__(self, policy: CachePolicy, local: TTLCache, shared: SQLiteCache = None):
+        self.policy = policy
+        self.local = local
+        self.shared = shared
+        self.intervals = IntervalIndex(maxsize=local.maxsize)
+        self.hits = 0
+        self.stale_hits = 0
+        self.interval_hits = 0
+        self.misses = 0
+        self.stale_on_error = 0
+        self._writer = None
+
+    def _entry(self, key, now: float):
+        entry = self.local.get_entry(key)
+        if (entry is None or now >= entry[0]) and self.shared is not None:
+            shared_entry = self.shared.get_entry(key)
+            if shared_entry is not None and (entry is None or shared_entry[0] > entry[0]):
+                entry = shared_entry
+                self.local.put_entry(key, entry)
+        return entry
+
+    def _covering_key(self, key):
+        covering = self.intervals.find(key)
+        if covering is None and self.shared is not None:
+            covering = self.shared.find_interval(key)
+        return covering if covering != key else None
+
+    def lookup(self, key) -> tuple:
+        """Întoarce (stare, valoare); starea e FRESH, STALE, EXPIRED sau MISSING"""
+        now = time.time()
+        entry = self._entry(key, now)
+        if entry is None:
+            # O dată din intervalul stabil al unei înregistrări salvate primește aceeași înregistrare
+            covering = self._covering_key(key)
+            if covering is not None:
+                entry = self._entry(covering, now)
+                if entry is not None:
+                    self.interval_hits += 1
+        if entry is None:
+            self.misses += 1
+            return MISSING, None
+        state = entry_state(entry, now)
+        if state == FRESH:
+            self.hits += 1
+        elif state == STALE:
+            self.stale_hits += 1
+        else:
+            self.misses += 1
+        return state, entry[3]
+
+    async def lookup_async(self, key) -> tuple:
+        """Ca `lookup`; citirea din L2 (care poate aștepta lock-ul fișierului) nu blochează bucla de evenimente"""
+        return (await self.lookup_many_async([key]))[key]
+
+    async def lookup_many_async(self, keys: list) -> dict:
+        """{cheie: (stare, valoare)}; hiturile proaspete din L1 rămân pe buclă, restul se citesc pe un singur thread"""
+        if self.shared is None:
+            return {key: self.lookup(key) for key in keys}
+        now, results, rest = time.time(), {}, []
+        for key in keys:
+            entry = self.local.get_entry(key)
+            if entry is not None and now < entry[0]:
+                results[key] = self.lookup(key)
+            else:
+                rest.append(key)
+        if rest:
+            results.update(await asyncio.to_thread(lambda: {key: self.lookup(key) for key in rest}))
+        return results
+
+    def fresh_for(self, key) -> float:
+        """Câte secunde mai e proaspătă intrarea (0 dacă lipsește); nu contează ca hit sau miss"""
+        entry = self._entry(key, time.time())
+        return max(entry[0] - time.time(), 0.0) if entry is not None else 0.0
+
+    def get(self, key):
+        """Valoarea proaspătă din cache (poate fi None pentru "notFound") sau MISSING"""
+        state, value = self.lookup(key)
+        return value if state == FRESH else MISSING
+
+    def set(self, key, value, ttl: float = None, interval: tuple = None):
+        """`interval` (prima zi, ultima zi) sunt datele pentru care `value` e valabilă la fel ca pentru key[1]"""
+        entry = self._set_local(key, value, ttl, interval)
+        if self.shared is not None:
+            self.shared.put_entry(key, entry, interval)
+
+    def set_behind(self, key, value, ttl: float = None, interval: tuple = None):
+        """Ca `set`, dar scrierea în L2 e pusă în coada unui thread dedicat, fără să fie așteptată"""
+        entry = self._set_local(key, value, ttl, interval)
+        if self.shared is not None:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anaf-cache-write")
+            self._writer.submit(self.shared.put_entry, key, entry, interval)
+
+    def _set_local(self, key, value, ttl: float, interval: tuple) -> tuple:
+        entry = self.policy.entry(value, ttl=ttl)
+        self.local.put_entry(key, entry)
+        if interval is not None:
+            self.intervals.add(key, interval)
+        return entry
+
+    def clear(self):
+        self.local.clear()
+        self.intervals.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        stats = {
+            **self.local.stats(),
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "intervalHits": self.interval_hits,
+            "misses": self.misses,
+            "staleOnError": self.stale_on_error,
+            "hitRate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+class BackgroundRefresher:
+    """Reîmprospătează în fundal (pe un pool mic de thread-uri) intrările vechi; o cheie e programată o singură dată"""
+
+    def __init__(self, refresh, max_workers: int = 2):
+        self._refresh = refresh
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="anaf-refresh")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.refreshes = 0
+        self.failures = 0
+
+    def schedule(self, key) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key)
+        return True
+
+    def _run(self, key):
+        try:
+            self._refresh(key)
+            self.refreshes += 1
+        except Exception as exc:
+            self.failures += 1
+            logger.warning(f"ANAF background refresh failed for {key}: {exc}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "refreshes": self.refreshes, "failures": self.failures}
+
+
+class AsyncBackgroundRefresher:
+    """Varianta asyncio: `refresh` este o funcție care întoarce o corutină"""
+
+    def __init__(self, refresh):
+        self._refresh = refresh
+        self._pending = {}
+        self.refreshes = 0
+        self.failures = 0
+
+    def schedule(self, key) -> bool:
+        if key in self._pending:
+            return False
+        self._pending[key] = asyncio.ensure_future(self._run(key))
+        return True
+
+    async def _run(self, key):
+        try:
+            await self._refresh(key)
+            self.refreshes += 1
+        except Exception as exc:
+            self.failures += 1
+            logger.warning(f"ANAF background refresh failed for {key}: {exc}")
+        finally:
+            self._pending.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "refreshes": self.refreshes, "failures": self.failures}
+
+
+def build_cache(maxsize: int, policy: CachePolicy, shared_path: str = None) -> TieredCache:
+    """Cache-ul pe două niveluri; dacă fișierul SQLite nu poate fi deschis rămâne doar L1"""
+    shared = None
+    if shared_path:
+        try:
+            shared = SQLiteCache(shared_path)
+        except sqlite3.Error as exc:
+            logger.warning(f"ANAF shared cache disabled ({shared_path}): {exc}")
+    return TieredCache(policy, TTLCache(maxsize=maxsize), shared)
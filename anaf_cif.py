@@ -0,0 +1,38 @@
+"""
+Validarea locală a codurilor fiscale (CIF/CUI) românești.
+
+Cifra de control se calculează cu cheia 753217532: CIF-ul fără cifra de
+control se completează cu zerouri în stânga până la 9 cifre, fiecare cifră se
+înmulțește cu ponderea corespunzătoare, suma se înmulțește cu 10, iar restul
+împărțirii la 11 este cifra de control (10 devine 0). Un cod invalid e respins
+înainte de orice apel către ANAF.
+"""
+
+CIF_WEIGHTS = (7, 5, 3, 2, 1, 7, 5, 3, 2)
+CIF_MIN_LENGTH, CIF_MAX_LENGTH = 2, 10
+CIF_ERRORS = ("invalid_cif_format", "invalid_cif_length", "invalid_cif_checksum")
+
+
+def compute_cif_control_digit(digits: str) -> str:
+    total = sum(int(digit) * weight for digit, weight in zip(digits.rjust(9, "0"), CIF_WEIGHTS))
+    return str(total * 10 % 11 % 10)
+
+
+def parse_cif(value) -> dict:
+    """Acceptă prefixul RO și spații; ridică ValueError cu unul din codurile din CIF_ERRORS"""
+    candidate = str(value).strip().upper()
+    vat_prefix = candidate.startswith("RO")
+    if vat_prefix:
+        candidate = candidate[2:]
+    candidate = "".join(candidate.split())
+    if not candidate.isascii() or not candidate.isdigit(): raise ValueError("invalid_cif_format")
+    candidate = candidate.lstrip("0")
+    if not CIF_MIN_LENGTH <= len(candidate) <= CIF_MAX_LENGTH: raise ValueError("invalid_cif_length")
+    control_digit = compute_cif_control_digit(candidate[:-1])
+    if control_digit != candidate[-1]: raise ValueError("invalid_cif_checksum")
+    return {"cif": candidate, "details": {"vatPrefix": vat_prefix, "controlDigit": control_digit}}
+
+
+def clean_cif(value) -> str:
+    """CIF-ul validat, doar cifre (fără RO și fără zerouri în față)"""
+    return parse_cif(value)["cif"]
@@ -0,0 +1,444 @@
+"""
+Verificări ANAF în masă, ca job-uri procesate în fundal.
+
+Un job (listă JSON sau fișier CSV cu CUI-uri) e salvat într-un fișier SQLite
+împreună cu toate intrările lui, apoi e preluat de un runner din unul din
+worker-i. Runner-ul trimite intrările în loturi de câte ANAF_BATCH_SIZE prin
+aceeași funcție ca endpoint-ul /api/anaf/companies (cache, limitare de ritm,
+circuit breaker) și salvează rezultatele după fiecare lot. Un job rămas
+"running" fără semn de viață (worker oprit sau repornit) e preluat din nou de
+la primul CUI neprocesat.
+
+`JobRunner` rulează pe un thread (Flask), `AsyncJobRunner` ca task asyncio (FastAPI).
+"""
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from anaf_batching import ANAF_BATCH_SIZE
+from anaf_singleflight import clean_lookup_date
+
+logger = logging.getLogger(__name__)
+
+ANAF_JOB_MAX_CUIS = int(os.environ.get("ANAF_JOB_MAX_CUIS", 50000))
+ANAF_JOB_MAX_ATTEMPTS = int(os.environ.get("ANAF_JOB_MAX_ATTEMPTS", 3))
+ANAF_JOB_RETRY_SECONDS = float(os.environ.get("ANAF_JOB_RETRY_SECONDS", 15))
+ANAF_JOB_RETENTION_SECONDS = float(os.environ.get("ANAF_JOB_RETENTION_SECONDS", 7 * 86400))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+RESULT_STATUSES = ("found", "notFound", "invalid", "error")
+CSV_COLUMNS = ("cui", "date", "status", "denumire", "nrRegCom", "adresa", "judet", "platitorTVA", "stale", "error")
+CUI_HEADERS = {"cui", "cif", "cod_fiscal", "cod fiscal", "cod_unic_inregistrare"}
+DATE_HEADERS = {"date", "data"}
+
+
+class JobInputError(ValueError):
+    pass
+
+
+def parse_job_csv(text: str) -> list:
+    """Intrări (cui, dată sau None) dintr-un CSV cu antet (coloană cui/cif, opțional date) sau doar cu CUI-uri pe fiecare rând"""
+    sample = text[:64 * 1024]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t^")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    cui_column = next((position for position, name in enumerate(header) if name in CUI_HEADERS), None)
+    if cui_column is None:
+        if len(header) > 1:
+            raise JobInputError("csv_cui_column_missing")
+        return [(row[0].strip(), None) for row in rows]
+    date_column = next((position for position, name in enumerate(header) if name in DATE_HEADERS), None)
+    return [
+        (
+            row[cui_column].strip() if cui_column < len(row) else "",
+            row[date_column].strip() or None if date_column is not None and date_column < len(row) else None,
+        )
+        for row in rows[1:]
+    ]
+
+
+def job_entries(entries: list, default_date: str) -> list:
+    """Intrările (cui, dată ISO) ale unui job nou; fără dată se folosește `default_date`, iar o dată care nu e YYYY-MM-DD e JobInputError"""
+    try:
+        return [(cui, clean_lookup_date(day or default_date)) for cui, day in entries]
+    except ValueError:
+        raise JobInputError("invalid_date")
+
+
+def _csv_row(result: dict) -> list:
+    data = result.get("data") or {}
+    vat = data.get("platitorTVA")
+    return [
+        result["cui"], result["date"], result["status"], data.get("denumire", ""), data.get("nrRegCom", ""),
+        data.get("adresa", ""), data.get("judet", ""), "" if vat is None else str(vat).lower(),
+        "true" if result.get("stale") else "", result.get("error", ""),
+    ]
+
+
+def iter_results_csv(results, rows_per_chunk: int = 500):
+    """Generează CSV-ul rezultatelor în bucăți de text, pentru un răspuns HTTP transmis pe măsură ce e citit"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for count, result in enumerate(results, 1):
+        writer.writerow(_csv_row(result))
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class JobStore:
+    """Job-urile și intrările lor într-un fișier SQLite comun worker-ilor de pe mașină"""
+
+    STALE_AFTER_SECONDS = 60
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS anaf_jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, processed INTEGER NOT NULL DEFAULT 0, "
+                "found INTEGER NOT NULL DEFAULT 0, not_found INTEGER NOT NULL DEFAULT 0, invalid INTEGER NOT NULL DEFAULT 0, "
+                "error INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "finished_at REAL, heartbeat REAL, message TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS anaf_job_items ("
+                "job_id TEXT NOT NULL, position INTEGER NOT NULL, cui TEXT NOT NULL, day TEXT NOT NULL, "
+                "status TEXT, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, PRIMARY KEY (job_id, position)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS anaf_jobs_status ON anaf_jobs (status, heartbeat)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def create(self, entries: list) -> str:
+        """Salvează un job nou cu intrările (cui, dată) și întoarce id-ul lui"""
+        job_id, now = uuid.uuid4().hex, time.time()
+
+        def insert(conn):
+            conn.execute(
+                "INSERT INTO anaf_jobs (id, status, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, len(entries), now, now),
+            )
+            conn.executemany(
+                "INSERT INTO anaf_job_items (job_id, position, cui, day) VALUES (?, ?, ?, ?)",
+                ((job_id, position, str(cui), day) for position, (cui, day) in enumerate(entries)),
+            )
+
+        self._transaction(insert)
+        return job_id
+
+    def claim(self):
+        """Preia atomic cel mai vechi job în așteptare (sau rămas fără runner); întoarce id-ul sau None"""
+        def take(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT id FROM anaf_jobs WHERE status = ? OR (status = ? AND heartbeat < ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now - self.STALE_AFTER_SECONDS),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE anaf_jobs SET status = ?, heartbeat = ?, updated_at = ? WHERE id = ?", (RUNNING, now, now, row[0]))
+            return row[0]
+
+        return self._transaction(take)
+
+    def pending(self, job_id: str, after: int, limit: int) -> list:
+        """Intrările neprocesate de după poziția `after`, în ordine"""
+        return self._connect().execute(
+            "SELECT position, cui, day, attempts FROM anaf_job_items "
+            "WHERE job_id = ? AND position > ? AND status IS NULL ORDER BY position LIMIT ?",
+            (job_id, after, limit),
+        ).fetchall()
+
+    def save(self, job_id: str, items: list, results: list, max_attempts: int = ANAF_JOB_MAX_ATTEMPTS) -> int:
+        """Salvează rezultatele unui lot; erorile ANAF rămân de reîncercat până la `max_attempts`. Întoarce câte s-au amânat"""
+        final, retried, counts = [], [], dict.fromkeys(RESULT_STATUSES, 0)
+        for (position, _, _, attempts), result in zip(items, results):
+            if result["status"] == "error" and attempts + 1 < max_attempts:
+                retried.append((job_id, position))
+                continue
+            counts[result["status"]] += 1
+            final.append((result["status"], json.dumps(result, separators=(",", ":"), ensure_ascii=False), job_id, position))
+
+        def update(conn):
+            now = time.time()
+            conn.executemany("UPDATE anaf_job_items SET status = ?, result = ?, attempts = attempts + 1 WHERE job_id = ? AND position = ?", final)
+            conn.executemany("UPDATE anaf_job_items SET attempts = attempts + 1 WHERE job_id = ? AND position = ?", retried)
+            conn.execute(
+                "UPDATE anaf_jobs SET processed = processed + ?, found = found + ?, not_found = not_found + ?, "
+                "invalid = invalid + ?, error = error + ?, heartbeat = ?, updated_at = ? WHERE id = ?",
+                (len(final), counts["found"], counts["notFound"], counts["invalid"], counts["error"], now, now, job_id),
+            )
+
+        self._transaction(update)
+        return len(retried)
+
+    def heartbeat(self, job_id: str):
+        self._connect().execute("UPDATE anaf_jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, status: str = DONE, message: str = None):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE anaf_jobs SET status = ?, message = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+            (status, message, now, now, job_id),
+        )
+
+    def get(self, job_id: str):
+        row = self._connect().execute(
+            "SELECT id, status, total, processed, found, not_found, invalid, error, created_at, updated_at, finished_at, message "
+            "FROM anaf_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "jobId": row[0],
+            "status": row[1],
+            "total": row[2],
+            "processed": row[3],
+            "progress": round(row[3] / row[2], 4) if row[2] else 1.0,
+            "summary": {"found": row[4], "notFound": row[5], "invalid": row[6], "error": row[7]},
+            "createdAt": row[8],
+            "updatedAt": row[9],
+            "finishedAt": row[10],
+        }
+        if row[11]:
+            job["message"] = row[11]
+        return job
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> list:
+        """Rezultatele procesate, în ordinea intrărilor"""
+        rows = self._connect().execute(
+            "SELECT result FROM anaf_job_items WHERE job_id = ? AND status IS NOT NULL ORDER BY position LIMIT ? OFFSET ?",
+            (job_id, limit, offset),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def iter_results(self, job_id: str, page_size: int = 1000, offset: int = 0):
+        while True:
+            page = self.results(job_id, offset, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def prune(self, older_than: float):
+        def delete(conn):
+            expired = [row[0] for row in conn.execute("SELECT id FROM anaf_jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, older_than))]
+            for job_id in expired:
+                conn.execute("DELETE FROM anaf_job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM anaf_jobs WHERE id = ?", (job_id,))
+            return len(expired)
+
+        return self._transaction(delete)
+
+    def stats(self) -> dict:
+        counts = dict(self._connect().execute("SELECT status, COUNT(*) FROM anaf_jobs GROUP BY status").fetchall())
+        return {"path": self.path, **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}}
+
+
+class JobRunner:
+    """Un thread per proces care preia job-uri din JobStore; `process` primește o listă (cui, dată) și întoarce rezultatele"""
+
+    def __init__(self, store: JobStore, process, chunk_size: int = ANAF_BATCH_SIZE, poll_seconds: float = 2.0):
+        self.store = store
+        self._process = process
+        self._chunk_size = chunk_size
+        self._poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._pruned_at = 0.0
+        self.jobs = 0
+        self.batches = 0
+
+    def start(self):
+        """Pornește thread-ul o dată în fiecare proces, la prima cerere a worker-ului (thread-urile nu supraviețuiesc unui fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, name="anaf-jobs", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                job_id = self.store.claim()
+                if job_id is None:
+                    self._prune()
+            except sqlite3.Error as exc:
+                logger.warning(f"ANAF job store unavailable: {exc}")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self._poll_seconds)
+                self._wake.clear()
+                continue
+            try:
+                self._run(job_id)
+            except Exception as exc:
+                logger.error(f"ANAF job {job_id} failed: {exc}", exc_info=True)
+                with contextlib.suppress(sqlite3.Error):
+                    self.store.finish(job_id, FAILED, str(exc))
+
+    def _run(self, job_id: str):
+        self.jobs += 1
+        # Intrările amânate sunt reluate după ce se termină trecerea curentă prin job
+        after = -1
+        while True:
+            items = self.store.pending(job_id, after, self._chunk_size)
+            if not items:
+                if after < 0:
+                    self.store.finish(job_id)
+                    return
+                after = -1
+                continue
+            after = items[-1][0]
+            results = self._process([(cui, day) for _, cui, day, _ in items])
+            self.batches += 1
+            if self.store.save(job_id, items, results):
+                # ANAF a refuzat sau a căzut: intrările se reîncearcă după o pauză
+                time.sleep(ANAF_JOB_RETRY_SECONDS)
+                self.store.heartbeat(job_id)
+
+    def _prune(self):
+        if time.time() - self._pruned_at >= 3600:
+            self._pruned_at = time.time()
+            self.store.prune(time.time() - ANAF_JOB_RETENTION_SECONDS)
+
+    def stats(self) -> dict:
+        return {**self.store.stats(), "jobs": self.jobs, "batches": self.batches}
+
+
+class AsyncJobRunner:
+    """
+    Varianta asyncio: `process` este o corutină; pornit și oprit din lifespan.
+    Apelurile SQLite (care pot aștepta lock-ul fișierului) rulează pe thread-uri, nu pe bucla de evenimente
+    """
+
+    def __init__(self, store: JobStore, process, chunk_size: int = ANAF_BATCH_SIZE, poll_seconds: float = 2.0):
+        self.store = store
+        self._process = process
+        self._chunk_size = chunk_size
+        self._poll_seconds = poll_seconds
+        self._wake = None
+        self._task = None
+        self._pruned_at = 0.0
+        self.jobs = 0
+        self.batches = 0
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                job_id = await asyncio.to_thread(self.store.claim)
+                if job_id is None:
+                    await asyncio.to_thread(self._prune)
+            except sqlite3.Error as exc:
+                logger.warning(f"ANAF job store unavailable: {exc}")
+                job_id = None
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self._poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            try:
+                await self._run(job_id)
+            except Exception as exc:
+                logger.error(f"ANAF job {job_id} failed: {exc}", exc_info=True)
+                with contextlib.suppress(sqlite3.Error):
+                    await asyncio.to_thread(self.store.finish, job_id, FAILED, str(exc))
+
+    async def _run(self, job_id: str):
+        self.jobs += 1
+        after = -1
+        while True:
+            items = await asyncio.to_thread(self.store.pending, job_id, after, self._chunk_size)
+            if not items:
+                if after < 0:
+                    await asyncio.to_thread(self.store.finish, job_id)
+                    return
+                after = -1
+                continue
+            after = items[-1][0]
+            results = await self._process([(cui, day) for _, cui, day, _ in items])
+            self.batches += 1
+            if await asyncio.to_thread(self.store.save, job_id, items, results):
+                await asyncio.sleep(ANAF_JOB_RETRY_SECONDS)
+                await asyncio.to_thread(self.store.heartbeat, job_id)
+
+    def _prune(self):
+        if time.time() - self._pruned_at >= 3600:
+            self._pruned_at = time.time()
+            self.store.prune(time.time() - ANAF_JOB_RETENTION_SECONDS)
+
+    def stats(self) -> dict:
+        return {**self.store.stats(), "jobs": self.jobs, "batches": self.batches}
+
+
+def build_job_store(path: str):
+    """Depozitul de job-uri sau None dacă fișierul SQLite nu poate fi deschis"""
+    if not path:
+        return None
+    try:
+        return JobStore(path)
+    except sqlite3.Error as exc:
+        logger.warning(f"ANAF job store disabled ({path}): {exc}")
+        return None
@@ -0,0 +1,85 @@
+"""
+Maparea unei firme din răspunsul ANAF v9 în înregistrarea folosită de ambele aplicații.
+
+`Company` are `__slots__` în loc de dict, iar județul și localitatea (aceleași
+câteva sute de valori pentru toate firmele) sunt internate, așa că intrările
+din cache ocupă mult mai puțină memorie. Înregistrarea nu se modifică după
+creare; JSON-ul ei se calculează o singură dată și e refolosit pentru fiecare
+răspuns servit din cache și pentru cache-ul comun (vezi bench_mapper.py).
+"""
+import json
+from sys import intern
+
+COMPANY_FIELDS = ("cui", "denumire", "nrRegCom", "adresa", "oras", "judet", "telefon", "codPostal", "platitorTVA")
+
+_EMPTY = {}
+
+
+class Company:
+    __slots__ = COMPANY_FIELDS + ("_json",)
+
+    def __init__(self, cui, denumire="", nrRegCom="", adresa="", oras="", judet="", telefon="", codPostal="", platitorTVA=False):
+        self.cui = cui
+        self.denumire = denumire
+        self.nrRegCom = nrRegCom
+        self.adresa = adresa
+        self.oras = intern(oras) if type(oras) is str else oras
+        self.judet = intern(judet) if type(judet) is str else judet
+        self.telefon = telefon
+        self.codPostal = codPostal
+        self.platitorTVA = platitorTVA
+        self._json = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Company":
+        return cls(**{field: data[field] for field in COMPANY_FIELDS if field in data})
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in COMPANY_FIELDS}
+
+    def to_json(self) -> str:
+        """JSON-ul compact al înregistrării, calculat la prima cerere"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        return self._json
+
+    def __eq__(self, other):
+        return isinstance(other, Company) and all(getattr(self, field) == getattr(other, field) for field in COMPANY_FIELDS)
+
+    def __repr__(self):
+        return f"Company(cui={self.cui!r}, denumire={self.denumire!r})"
+
+
+def map_anaf_company(company: dict, fallback_cui: str) -> Company:
+    date_generale = company.get("date_generale") or _EMPTY
+    adresa_sediu = company.get("adresa_sediu_social") or _EMPTY
+    localitate = adresa_sediu.get("sdenumire_Localitate", "")
+    judet = adresa_sediu.get("sdenumire_Judet", "")
+
+    # Construiește adresa completă
+    adresa_parts = []
+    if adresa_sediu.get("sdenumire_Strada"):
+        adresa_parts.append(adresa_sediu["sdenumire_Strada"])
+    if adresa_sediu.get("snumar_Strada"):
+        adresa_parts.append(f"Nr. {adresa_sediu['snumar_Strada']}")
+    if localitate:
+        adresa_parts.append(localitate)
+    if judet:
+        adresa_parts.append(judet)
+
+    return Company(
+        date_generale.get("cui", fallback_cui),
+        date_generale.get("denumire", ""),
+        date_generale.get("nrRegCom", ""),
+        ", ".join(adresa_parts) if adresa_parts else date_generale.get("adresa", ""),
+        localitate,
+        judet,
+        date_generale.get("telefon", ""),
+        date_generale.get("codPostal", ""),
+        (company.get("inregistrare_scop_Tva") or _EMPTY).get("scpTVA", False),
+    )
+
+
+def company_response_json(company: Company, stale: bool = False) -> str:
+    """Corpul răspunsului {"success": true, "data": ...} pentru o firmă, fără a o serializa din nou"""
+    return '{"success":true,"data":' + company.to_json() + (',"stale":true}' if stale else "}")
@@ -0,0 +1,379 @@
+"""
+Server local care imită endpoint-ul ANAF PlatitorTvaRest v9, pentru teste de încărcare și benchmark-uri fără rețea.
+
+Răspunsurile vin din fixture-uri înregistrate (JSON lines, câte o intrare
+{"cui", "data", "found"} sau {"cui", "data", "notFound": true} pe linie),
+compuse în payload-uri cu mai multe intrări `found`/`notFound`, exact ca la
+ANAF. Un CUI fără fixture primește o firmă sintetică deterministă (sau
+`notFound`, pentru o fracțiune fixă a CUI-urilor); cu `--strict` e mereu
+`notFound`.
+
+Se pot injecta latență (fixă, uniformă sau lognormală, plus un cost per
+intrare), erori HTTP, conexiuni resetate, apeluri care nu răspund niciodată
+și limita de ritm a ANAF (429 cu Retry-After). Cu `--record URL`, cererile
+sunt trimise mai departe la ANAF-ul real, iar fiecare intrare din răspuns e
+adăugată în fișierul de fixture-uri, pentru rulări ulterioare offline.
+
+    python anaf_mock.py --port 8099 --latency lognormal:120:0.4 --error-rate 0.02
+    ANAF_URL=http://127.0.0.1:8099/api/PlatitorTvaRest/v9/tva python app.py
+
+`GET /__stats` întoarce numărul de cereri, intrări și rezultate injectate.
+"""
+import argparse
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+ANAF_V9_PATH = "/api/PlatitorTvaRest/v9/tva"
+ANAF_V9_URL = "https://webservicesp.anaf.ro" + ANAF_V9_PATH
+MAX_ENTRIES = 100
+
+COUNTIES = (("MUNICIPIUL BUCUREŞTI", "40", "B"), ("CLUJ", "12", "CJ"), ("TIMIŞ", "35", "TM"), ("IAŞI", "22", "IS"), ("CONSTANŢA", "13", "CT"))
+
+
+def parse_latency(spec: str):
+    """
+    Distribuția latenței, în milisecunde: "fixed:50", "uniform:20:200" sau "lognormal:MEDIANĂ:SIGMA";
+    întoarce o funcție care dă o latență în secunde
+    """
+    kind, *params = spec.split(":")
+    values = [float(param) for param in params]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(*values) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"distribuție de latență necunoscută: {spec}")
+
+
+def synthetic_company(cui: int, day: str) -> dict:
+    """O firmă plătitoare de TVA inventată, cu toate secțiunile răspunsului v9, aceeași pentru același CUI"""
+    county, county_code, county_auto = COUNTIES[cui % len(COUNTIES)]
+    locality = "Sector 1" if county_auto == "B" else county.title()
+    street, number = f"Str. Test {cui % 97}", str(cui % 50 + 1)
+    registered = date(2000 + cui % 20, cui % 12 + 1, cui % 28 + 1).isoformat()
+    address = {
+        "sdenumire_Strada": street, "snumar_Strada": number, "sdenumire_Localitate": locality,
+        "scod_Localitate": str(cui % 400), "sdenumire_Judet": county, "scod_Judet": county_code,
+        "scod_JudetAuto": county_auto, "stara": "", "sdetalii_Adresa": "", "scod_Postal": "",
+    }
+    return {
+        "date_generale": {
+            "cui": cui, "data": day, "denumire": f"FIRMA TEST {cui} SRL", "adresa": f"{county}, {locality}, {street}, NR.{number}",
+            "nrRegCom": f"J{county_code}/{cui % 9000 + 1}/{registered[:4]}", "telefon": "", "fax": "", "codPostal": "",
+            "act": "", "stare_inregistrare": f"INREGISTRAT din data {registered}", "data_inregistrare": registered,
+            "cod_CAEN": "6201", "iban": "", "statusRO_e_Factura": False, "organFiscalCompetent": "",
+            "forma_de_proprietate": "", "forma_organizare": "", "forma_juridica": "",
+        },
+        "inregistrare_scop_Tva": {
+            "scpTVA": True,
+            "perioade_TVA": [{"data_inceput_ScpTVA": registered, "data_sfarsit_ScpTVA": "", "data_anul_imp_ScpTVA": "", "mesaj_ScpTVA": ""}],
+        },
+        "inregistrare_RTVAI": {"dataInceputTvaInc": "", "dataSfarsitTvaInc": "", "dataActualizareTvaInc": "", "dataPublicareTvaInc": "", "tipActTvaInc": "", "statusTvaIncasare": False},
+        "stare_inactiv": {"dataInactivare": "", "dataReactivare": "", "dataPublicare": "", "dataRadiere": "", "statusInactivi": False},
+        "inregistrare_SplitTVA": {"dataInceputSplitTVA": "", "dataAnulareSplitTVA": "", "statusSplitTVA": False},
+        "adresa_sediu_social": address,
+        "adresa_domiciliu_fiscal": {"d" + field[1:]: value for field, value in address.items()},
+    }
+
+
+class FixtureStore:
+    """Intrările înregistrate, după (cui, dată) și, pentru alte date, după cui"""
+
+    def __init__(self, path: str = None, strict: bool = False, not_found_rate: float = 0.2):
+        self.path = path
+        self.strict = strict
+        self.not_found_rate = not_found_rate
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._by_cui = {}
+        if path:
+            try:
+                with open(path, encoding="utf-8") as fixtures:
+                    for line in fixtures:
+                        if line.strip():
+                            self._add(json.loads(line))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resolve(self, cui: int, day: str):
+        """Firma de răspuns pentru (cui, dată) sau None dacă intră în "notFound" """
+        record = self._entries.get((cui, day)) or self._by_cui.get(cui)
+        if record is not None:
+            if record.get("found") is None:
+                return None
+            company = json.loads(json.dumps(record["found"]))
+            company.setdefault("date_generale", {})["data"] = day
+            return company
+        # CUI-ul e tratat ca inexistent pentru o fracțiune fixă, aceeași la fiecare rulare
+        if self.strict or (cui * 2654435761) % 1000 < self.not_found_rate * 1000:
+            return None
+        return synthetic_company(cui, day)
+
+    def record(self, entries: list, anaf_data: dict):
+        """Adaugă în fișier câte o linie pentru fiecare intrare din răspunsul real"""
+        found = {}
+        for company in anaf_data.get("found") or []:
+            general = company.get("date_generale", {})
+            found[(int(general.get("cui", 0)), general.get("data"))] = company
+        lines = []
+        with self._lock:
+            for entry in entries:
+                cui, day = int(entry["cui"]), entry["data"]
+                company = found.get((cui, day))
+                record = {"cui": cui, "data": day, "found": company} if company else {"cui": cui, "data": day, "notFound": True}
+                self._add(record)
+                lines.append(json.dumps(record, ensure_ascii=False))
+            if self.path and lines:
+                with open(self.path, "a", encoding="utf-8") as fixtures:
+                    fixtures.write("\n".join(lines) + "\n")
+
+    def _add(self, record: dict):
+        key = (int(record["cui"]), record["data"])
+        self._entries[key] = record
+        self._by_cui[key[0]] = record
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        per_entry_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_statuses: tuple = (502, 503, 504),
+        reset_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_seconds: float = 30.0,
+        rate_limit: float = 0.0,
+        rate_burst: int = 1,
+        record_url: str = None,
+        seed: int = None,
+    ):
+        self.latency = parse_latency(latency)
+        self.per_entry = per_entry_ms / 1000
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.reset_rate = reset_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.rate_interval = 1 / rate_limit if rate_limit > 0 else 0.0
+        self.rate_burst = max(rate_burst, 1)
+        self.record_url = record_url
+        self.rng = random.Random(seed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ANAFMock/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/__stats":
+            return self._send(404, {"cod": 404, "message": "Not Found"})
+        self._send(200, self.server.mock.stats())
+
+    def do_HEAD(self):
+        # Clienții își deschid conexiunile în avans cu HEAD către rădăcină (vezi anaf_warmup)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            entries = json.loads(body)
+            if not isinstance(entries, list):
+                raise ValueError
+            entries = [{"cui": int(entry["cui"]), "data": str(entry["data"])} for entry in entries]
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, {"cod": 400, "message": "Cererea nu este un JSON valid"})
+        outcome, extra = mock.admit(len(entries))
+        if outcome == "rate_limited":
+            return self._send(429, {"cod": 429, "message": "Limita de cereri a fost depasita"}, {"Retry-After": str(math.ceil(extra))})
+        if outcome == "reset":
+            # SO_LINGER 0: închiderea trimite RST, ca o conexiune resetată de un load balancer
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+            return
+        if outcome == "timeout":
+            time.sleep(extra)
+            self.close_connection = True
+            return
+        time.sleep(extra)
+        if outcome == "error":
+            return self._send(mock.config.rng.choice(mock.config.error_statuses), {"cod": 503, "message": "Serviciu indisponibil"})
+        if len(entries) > MAX_ENTRIES:
+            return self._send(400, {"cod": 400, "message": f"Lista nu poate contine mai mult de {MAX_ENTRIES} de CUI-uri"})
+        try:
+            payload = mock.answer(entries)
+        except OSError as exc:
+            return self._send(502, {"cod": 502, "message": f"Inregistrarea a esuat: {exc}"})
+        self._send(200, payload)
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clientul a renunțat între timp (timeout sau cerere dublată câștigată de cealaltă)
+            self.close_connection = True
+
+
+class MockANAF:
+    """Serverul mock; `start()` îl pornește pe un thread (pentru benchmark-uri), `serve_forever()` în prim-plan"""
+
+    def __init__(self, fixtures: FixtureStore, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures
+        self.config = config or MockConfig()
+        self._lock = threading.Lock()
+        self._tat = 0.0
+        self.counts = {"requests": 0, "entries": 0, "found": 0, "notFound": 0, "errors": 0, "resets": 0, "timeouts": 0, "rateLimited": 0}
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{ANAF_V9_PATH}"
+
+    def start(self) -> "MockANAF":
+        threading.Thread(target=self.server.serve_forever, name="anaf-mock", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def admit(self, entries: int) -> tuple:
+        """Ce se întâmplă cu cererea: ("ok" | "error", latența), ("reset", None), ("timeout", secunde) sau ("rate_limited", retry_after)"""
+        config = self.config
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["entries"] += entries
+            if config.rate_interval:
+                now = time.monotonic()
+                tat = max(self._tat, now)
+                if tat - now > (config.rate_burst - 1) * config.rate_interval:
+                    self.counts["rateLimited"] += 1
+                    return "rate_limited", tat - now
+                self._tat = tat + config.rate_interval
+            roll = config.rng.random()
+            latency = config.latency(config.rng) + config.per_entry * entries
+            if roll < config.reset_rate:
+                self.counts["resets"] += 1
+                return "reset", None
+            roll -= config.reset_rate
+            if roll < config.timeout_rate:
+                self.counts["timeouts"] += 1
+                return "timeout", config.timeout_seconds
+            roll -= config.timeout_rate
+            if roll < config.error_rate:
+                self.counts["errors"] += 1
+                return "error", latency
+        return "ok", latency
+
+    def answer(self, entries: list) -> dict:
+        if self.config.record_url:
+            return self._forward(entries)
+        found, not_found = [], []
+        for entry in entries:
+            company = self.fixtures.resolve(entry["cui"], entry["data"])
+            if company is None:
+                not_found.append(entry["cui"])
+            else:
+                found.append(company)
+        with self._lock:
+            self.counts["found"] += len(found)
+            self.counts["notFound"] += len(not_found)
+        return {"cod": 200, "message": "SUCCESS", "found": found, "notFound": not_found}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "fixtures": len(self.fixtures)}
+
+    def _forward(self, entries: list) -> dict:
+        request = Request(
+            self.config.record_url,
+            data=json.dumps(entries).encode("utf-8"),
+            headers={"Content-Type": "application/json", "User-Agent": "Mozilla/5.0"},
+            method="POST",
+        )
+        with urlopen(request, timeout=30) as response:
+            anaf_data = json.loads(response.read())
+        self.fixtures.record(entries, anaf_data)
+        with self._lock:
+            self.counts["found"] += len(anaf_data.get("found") or [])
+            self.counts["notFound"] += len(anaf_data.get("notFound") or [])
+        return anaf_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server local care imită ANAF PlatitorTvaRest v9")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fixtures", default="anaf_mock_fixtures.jsonl", help="fișierul JSON lines cu intrările înregistrate")
+    parser.add_argument("--strict", action="store_true", help="CUI-urile fără fixture sunt mereu notFound")
+    parser.add_argument("--not-found-rate", type=float, default=0.2, help="fracțiunea CUI-urilor fără fixture tratate ca notFound")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:MS, uniform:MIN:MAX sau lognormal:MEDIANĂ:SIGMA")
+    parser.add_argument("--per-entry-ms", type=float, default=0.0, help="latență adăugată pentru fiecare intrare din cerere")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracțiunea cererilor cu răspuns de eroare")
+    parser.add_argument("--error-statuses", default="502,503,504", help="statusurile HTTP folosite pentru erori")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="fracțiunea cererilor cu conexiunea resetată")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fracțiunea cererilor fără răspuns")
+    parser.add_argument("--timeout-seconds", type=float, default=30.0, help="cât ține deschisă o cerere fără răspuns")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="cereri pe secundă acceptate (0 = fără limită)")
+    parser.add_argument("--rate-burst", type=int, default=1)
+    parser.add_argument("--record", nargs="?", const=ANAF_V9_URL, default=None, metavar="URL",
+                        help="trimite cererile la ANAF (implicit v9 real) și adaugă răspunsurile în fixture-uri")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        per_entry_ms=args.per_entry_ms,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(status) for status in args.error_statuses.split(",")),
+        reset_rate=args.reset_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+        record_url=args.record,
+        seed=args.seed,
+    )
+    mock = MockANAF(FixtureStore(args.fixtures, args.strict, args.not_found_rate), config, args.host, args.port)
+    mode = f"record -> {args.record}" if args.record else f"replay ({len(mock.fixtures)} fixtures)"
+    print(f"ANAF mock pe {mock.url} - {mode}")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
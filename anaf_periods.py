@@ -0,0 +1,96 @@
+"""
+Intervalele de date în care răspunsul ANAF pentru o firmă nu se schimbă.
+
+Răspunsul v9 conține istoricul perioadelor de TVA și datele la care s-au
+schimbat celelalte stări (TVA la încasare, split TVA, inactivare, radiere).
+Între două astfel de date consecutive, răspunsul pentru oricare zi e același
+cu cel pentru ziua cerută, așa că aceeași înregistrare din cache poate servi
+orice dată din interval. Intervalul nu trece de ziua în care s-a făcut
+cererea: ce urmează după ea ANAF nu avea de unde să știe.
+
+Tot aici sunt ordinea în care se cer datele pentru cronologia TVA a unui CUI
+și construirea cronologiei din rezultate.
+"""
+import math
+from datetime import date, timedelta
+
+# Zilele de la care se poate schimba starea firmei
+START_FIELDS = (
+    ("date_generale", "data_inregistrare"),
+    ("inregistrare_RTVAI", "dataInceputTvaInc"),
+    ("inregistrare_SplitTVA", "dataInceputSplitTVA"),
+    ("stare_inactiv", "dataInactivare"),
+    ("stare_inactiv", "dataReactivare"),
+    ("stare_inactiv", "dataRadiere"),
+)
+# Ultimele zile ale unei stări (nu e sigur dacă ziua însăși mai face parte din perioadă)
+END_FIELDS = (
+    ("inregistrare_RTVAI", "dataSfarsitTvaInc"),
+    ("inregistrare_SplitTVA", "dataAnulareSplitTVA"),
+)
+
+
+def _parse_day(value):
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
+
+
+def change_days(company: dict) -> set:
+    """Zilele din care răspunsul poate fi diferit de cel din ziua precedentă"""
+    days = set()
+    for period in (company.get("inregistrare_scop_Tva") or {}).get("perioade_TVA") or []:
+        days.add(_parse_day(period.get("data_inceput_ScpTVA")))
+        for field in ("data_sfarsit_ScpTVA", "data_anul_imp_ScpTVA"):
+            end = _parse_day(period.get(field))
+            if end:
+                days.update((end, end + timedelta(days=1)))
+    for section, field in START_FIELDS:
+        days.add(_parse_day((company.get(section) or {}).get(field)))
+    for section, field in END_FIELDS:
+        end = _parse_day((company.get(section) or {}).get(field))
+        if end:
+            days.update((end, end + timedelta(days=1)))
+    days.discard(None)
+    return days
+
+
+def stable_interval(company: dict, day: str, today: date = None):
+    """(prima zi, ultima zi) în format ISO în care răspunsul e același ca pentru `day`, sau None"""
+    queried = _parse_day(day)
+    if queried is None:
+        return None
+    today = today or date.today()
+    days = change_days(company)
+    # Fără o schimbare cunoscută înainte de ziua cerută nu știm de când e valabilă starea
+    start = max((changed for changed in days if changed <= queried), default=queried)
+    end = min((changed for changed in days if changed > queried), default=None)
+    end = min(end - timedelta(days=1), max(today, queried)) if end else max(today, queried)
+    return start.isoformat(), end.isoformat()
+
+
+def spread_days(days: list, batch_size: int) -> list:
+    """
+    Ordinea în care se cer datele unui CUI: primul lot are date răspândite uniform pe tot intervalul,
+    așa că intervalele din răspunsul lui acoperă de obicei și restul datelor, fără alte apeluri
+    """
+    days = sorted(days)
+    stride = max(math.ceil(len(days) / batch_size), 1)
+    return days[::stride] + [day for position, day in enumerate(days) if position % stride]
+
+
+def build_timeline(results: list) -> tuple:
+    """(datele firmei la cea mai recentă dată găsită, starea TVA pe fiecare dată) din rezultatele unui lot"""
+    company, timeline = None, []
+    for result in sorted(results, key=lambda result: result["date"]):
+        point = {"date": result["date"], "status": result["status"]}
+        if result["status"] == "found":
+            company = result["data"]
+            point["platitorTVA"] = result["data"].get("platitorTVA", False)
+        elif result["status"] == "error":
+            point["error"] = result["error"]
+        if result.get("stale"):
+            point["stale"] = True
+        timeline.append(point)
+    return company, timeline
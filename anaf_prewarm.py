@@ -0,0 +1,216 @@
+"""
+Preîncălzirea cache-ului ANAF pentru CUI-urile cele mai căutate.
+
+Câteva CUI-uri (furnizori mari, marketplace-uri, utilități) fac majoritatea
+căutărilor. `PopularitySketch` le numără aproximativ, în memorie constantă: un
+count-min sketch dă frecvența estimată a oricărui CUI, iar lângă el se țin
+doar cele mai căutate `capacity` CUI-uri. Contoarele se înjumătățesc la
+fiecare trecere, așa că popularitatea urmează traficul recent.
+
+`CachePrewarmer` (thread, Flask) și `AsyncCachePrewarmer` (asyncio, FastAPI)
+reîmprospătează periodic intrările de azi ale celor mai căutate CUI-uri care
+ar expira înainte de trecerea următoare. Apelurile ANAF pleacă pline: un lot
+început se completează cu următoarele CUI-uri populare cele mai aproape de
+expirare, până la 100.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import date
+
+from anaf_batching import ANAF_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+ANAF_PREWARM_TOP_N = int(os.environ.get("ANAF_PREWARM_TOP_N", 200))
+ANAF_PREWARM_INTERVAL_SECONDS = float(os.environ.get("ANAF_PREWARM_INTERVAL_SECONDS", 60))
+ANAF_PREWARM_MIN_HITS = int(os.environ.get("ANAF_PREWARM_MIN_HITS", 3))
+
+
+class PopularitySketch:
+    """Count-min sketch (`depth` rânduri a câte `width` contoare) plus cele mai căutate `capacity` chei"""
+
+    def __init__(self, capacity: int = 2 * ANAF_PREWARM_TOP_N, width: int = 4096, depth: int = 4):
+        self.capacity = capacity
+        self._width = width
+        self._rows = [array("L", [0]) * width for _ in range(depth)]
+        self._top = {}
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, key):
+        with self._lock:
+            self.recorded += 1
+            estimate = None
+            for seed, row in enumerate(self._rows):
+                index = hash((seed, key)) % self._width
+                row[index] += 1
+                estimate = row[index] if estimate is None else min(estimate, row[index])
+            if key in self._top or len(self._top) < self.capacity:
+                self._top[key] = estimate
+            elif self._top and estimate > self._floor:
+                # Cheia nouă o înlocuiește pe cea mai rece dintre cele urmărite
+                coldest = min(self._top, key=self._top.get)
+                if estimate > self._top[coldest]:
+                    del self._top[coldest]
+                    self._top[key] = estimate
+                self._floor = min(self._top.values())
+
+    def estimate(self, key) -> int:
+        with self._lock:
+            return min(row[hash((seed, key)) % self._width] for seed, row in enumerate(self._rows))
+
+    def top(self, n: int, min_count: int = 1) -> list:
+        """Cele mai căutate `n` chei, descrescător după frecvența estimată"""
+        with self._lock:
+            ranked = sorted(self._top.items(), key=lambda item: item[1], reverse=True)
+        return [key for key, count in ranked[:n] if count >= min_count]
+
+    def decay(self):
+        with self._lock:
+            for row in self._rows:
+                for index, count in enumerate(row):
+                    if count:
+                        row[index] = count >> 1
+            self._top = {key: count >> 1 for key, count in self._top.items() if count > 1}
+            self._floor = min(self._top.values(), default=0)
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "tracked": len(self._top), "capacity": self.capacity}
+
+
+class _PrewarmPlan:
+    """Alege cheile de reîmprospătat la o trecere; comun variantei cu thread și celei asyncio"""
+
+    def __init__(self, sketch: PopularitySketch, cache, top_n: int, interval: float, min_hits: int):
+        self.sketch = sketch
+        self._cache = cache
+        self._top_n = top_n
+        self._interval = interval
+        self._min_hits = min_hits
+        self.passes = 0
+        self.batches = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def batches_due(self) -> list:
+        """Loturi de până la ANAF_BATCH_SIZE chei (cui, azi); lista e goală dacă nicio cheie nu expiră curând"""
+        self.passes += 1
+        today = date.today().isoformat()
+        candidates = [(cui, today) for cui in self.sketch.top(self._top_n, self._min_hits)]
+        self.sketch.decay()
+        if not candidates:
+            return []
+        fresh_for = {key: self._cache.fresh_for(key) for key in candidates}
+        # Expiră înainte de trecerea următoare (cu o marjă pentru durata apelului ANAF)
+        due = sum(1 for seconds in fresh_for.values() if seconds < self._interval * 1.5)
+        if not due:
+            return []
+        candidates.sort(key=fresh_for.get)
+        # Loturile începute se completează cu cheile populare cele mai aproape de expirare
+        selected = candidates[:math.ceil(due / ANAF_BATCH_SIZE) * ANAF_BATCH_SIZE]
+        return [selected[start:start + ANAF_BATCH_SIZE] for start in range(0, len(selected), ANAF_BATCH_SIZE)]
+
+    def done(self, keys: list, results: dict):
+        self.batches += 1
+        failed = sum(1 for result in results.values() if result.get("status") == "error")
+        self.failures += failed
+        self.refreshed += len(keys) - failed
+
+    def stats(self) -> dict:
+        return {
+            **self.sketch.stats(),
+            "topN": self._top_n,
+            "passes": self.passes,
+            "batches": self.batches,
+            "refreshed": self.refreshed,
+            "failures": self.failures,
+        }
+
+
+class CachePrewarmer(_PrewarmPlan):
+    """Thread de preîncălzire; `refresh_batch(keys)` face un apel ANAF blocant, pune rezultatele în cache și le întoarce"""
+
+    def __init__(
+        self,
+        sketch: PopularitySketch,
+        cache,
+        refresh_batch,
+        top_n: int = ANAF_PREWARM_TOP_N,
+        interval: float = ANAF_PREWARM_INTERVAL_SECONDS,
+        min_hits: int = ANAF_PREWARM_MIN_HITS,
+    ):
+        super().__init__(sketch, cache, top_n, interval, min_hits)
+        self._refresh_batch = refresh_batch
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def record(self, cui: str):
+        self.sketch.record(cui)
+        self.start()
+
+    def start(self):
+        """Pornește thread-ul la prima folosire din fiecare proces (thread-urile nu supraviețuiesc unui fork)"""
+        if self._pid == os.getpid() or self._top_n <= 0:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, name="anaf-prewarm", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                for keys in self.batches_due():
+                    self.done(keys, self._refresh_batch(keys))
+            except Exception as exc:
+                logger.warning(f"ANAF cache prewarm failed: {exc}")
+
+
+class AsyncCachePrewarmer(_PrewarmPlan):
+    """Varianta asyncio: `refresh_batch` este o corutină; pornit și oprit din lifespan"""
+
+    def __init__(
+        self,
+        sketch: PopularitySketch,
+        cache,
+        refresh_batch,
+        top_n: int = ANAF_PREWARM_TOP_N,
+        interval: float = ANAF_PREWARM_INTERVAL_SECONDS,
+        min_hits: int = ANAF_PREWARM_MIN_HITS,
+    ):
+        super().__init__(sketch, cache, top_n, interval, min_hits)
+        self._refresh_batch = refresh_batch
+        self._task = None
+
+    def record(self, cui: str):
+        self.sketch.record(cui)
+
+    def start(self):
+        if self._top_n > 0:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                # Vârsta intrărilor se citește și din cache-ul comun (SQLite): pe un thread, nu pe bucla de evenimente
+                for keys in await asyncio.to_thread(self.batches_due):
+                    self.done(keys, await self._refresh_batch(keys))
+            except Exception as exc:
+                logger.warning(f"ANAF cache prewarm failed: {exc}")
@@ -0,0 +1,182 @@
+"""
+Limitare a ritmului apelurilor către ANAF (token bucket, varianta GCRA).
+
+Fiecare apel își rezervă un slot și primește cât trebuie să aștepte până la
+el; dacă s-ar forma o coadă mai lungă de `max_queue` apeluri, rezervarea e
+refuzată cu `RateLimitExceeded` (aplicațiile răspund 429 cu Retry-After).
+Starea găleții e un singur moment de timp (TAT), așa că poate fi ținută
+într-un fișier SQLite comun tuturor worker-ilor de pe mașină; în FastAPI
+rezervările din fișierul comun (`reserve_async`, `try_reserve_async`) rulează
+pe un thread, pentru că pot aștepta lock-ul SQLite.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ANAF_RATE_LIMIT_PER_SECOND = float(os.environ.get("ANAF_RATE_LIMIT_PER_SECOND", 1))
+ANAF_RATE_LIMIT_BURST = int(os.environ.get("ANAF_RATE_LIMIT_BURST", 2))
+ANAF_RATE_LIMIT_MAX_QUEUE = int(os.environ.get("ANAF_RATE_LIMIT_MAX_QUEUE", 10))
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("anaf_rate_limited")
+        self.retry_after = retry_after
+
+
+class LocalStore:
+    """Starea găleții în proces"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tat = 0.0
+
+    def update(self, fn):
+        with self._lock:
+            self._tat, result = fn(self._tat, time.time())
+            return result
+
+
+class SQLiteStore:
+    """Starea găleții într-un fișier SQLite, actualizată atomic (BEGIN IMMEDIATE) de toate procesele"""
+
+    def __init__(self, path: str, name: str = "anaf"):
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limit (name TEXT PRIMARY KEY, tat REAL NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def update(self, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM rate_limit WHERE name = ?", (self.name,)).fetchone()
+            tat, result = fn(row[0] if row else 0.0, time.time())
+            conn.execute("INSERT OR REPLACE INTO rate_limit (name, tat) VALUES (?, ?)", (self.name, tat))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float = ANAF_RATE_LIMIT_PER_SECOND,
+        burst: int = ANAF_RATE_LIMIT_BURST,
+        max_queue: int = ANAF_RATE_LIMIT_MAX_QUEUE,
+        store=None,
+    ):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.burst = max(burst, 1)
+        self.max_queue = max_queue
+        self._store = store or LocalStore()
+        self._fallback = None
+        self.reserved = 0
+        self.rejected = 0
+        self.waited = 0.0
+
+    def reserve(self, max_wait: float = None):
+        """
+        Rezervă un slot și întoarce câte secunde trebuie așteptat; ridică RateLimitExceeded dacă coada e plină.
+        Cu `max_wait`, slotul nu e luat dacă ar trebui așteptat cel puțin atât (de ex. până la termenul clientului): întoarce None
+        """
+        if not self.interval:
+            return 0.0
+
+        def take(tat, now):
+            return self._take(tat, now, max_wait)
+
+        try:
+            wait = self._store.update(take)
+        except RateLimitExceeded:
+            self.rejected += 1
+            raise
+        except sqlite3.Error as exc:
+            # Dacă fișierul comun nu e disponibil, limităm măcar procesul curent
+            logger.warning(f"ANAF rate limit store unavailable, using per-process limit: {exc}")
+            if self._fallback is None:
+                self._fallback = LocalStore()
+            wait = self._fallback.update(take)
+        if wait is None:
+            return None
+        self.reserved += 1
+        self.waited += wait
+        return wait
+
+    def try_reserve(self) -> bool:
+        """Rezervă un slot doar dacă e liber imediat, pentru apeluri opționale (de ex. dublurile unui apel lent)"""
+        if not self.interval:
+            return True
+        try:
+            taken = self._store.update(self._take_now)
+        except sqlite3.Error:
+            return False
+        if taken:
+            self.reserved += 1
+        return taken
+
+    async def reserve_async(self, max_wait: float = None):
+        """Ca `reserve`; cu fișierul comun (BEGIN IMMEDIATE, până la 1 s la lock) rezervarea nu blochează bucla de evenimente"""
+        if isinstance(self._store, SQLiteStore):
+            return await asyncio.to_thread(self.reserve, max_wait)
+        return self.reserve(max_wait)
+
+    async def try_reserve_async(self) -> bool:
+        """Ca `try_reserve`, pentru asyncio"""
+        if isinstance(self._store, SQLiteStore):
+            return await asyncio.to_thread(self.try_reserve)
+        return self.try_reserve()
+
+    def _take_now(self, tat: float, now: float) -> tuple:
+        tat = max(tat, now)
+        if tat - now - (self.burst - 1) * self.interval > 0:
+            return tat, False
+        return tat + self.interval, True
+
+    def _take(self, tat: float, now: float, max_wait: float = None) -> tuple:
+        tat = max(tat, now)
+        wait = max(tat - now - (self.burst - 1) * self.interval, 0.0)
+        if wait > self.max_queue * self.interval:
+            raise RateLimitExceeded(retry_after=wait - self.max_queue * self.interval)
+        if max_wait is not None and wait >= max_wait:
+            return tat, None
+        return tat + self.interval, wait
+
+    def stats(self) -> dict:
+        return {
+            "ratePerSecond": round(1 / self.interval, 3) if self.interval else None,
+            "burst": self.burst,
+            "maxQueue": self.max_queue,
+            "reserved": self.reserved,
+            "rejected": self.rejected,
+            "averageWait": round(self.waited / self.reserved, 4) if self.reserved else 0.0,
+            "shared": isinstance(self._store, SQLiteStore) and self._fallback is None,
+        }
+
+
+def build_bucket(shared_path: str = None) -> TokenBucket:
+    """Găleata comună worker-ilor dacă fișierul SQLite poate fi deschis, altfel una per proces"""
+    store = None
+    if shared_path:
+        try:
+            store = SQLiteStore(shared_path)
+        except sqlite3.Error as exc:
+            logger.warning(f"ANAF rate limit shared store disabled ({shared_path}): {exc}")
+    return TokenBucket(store=store)
@@ -0,0 +1,412 @@
+"""
+Registrul local al firmelor, construit din fișierele CSV publicate ca date deschise.
+
+Importul citește unul sau mai multe CSV-uri (separator detectat automat:
+^ ; , sau tab) care au cel puțin o coloană CUI și scrie un fișier SQLite cu
+cheia primară pe CUI. Fișierul e construit alături și înlocuit atomic, așa
+că worker-ii care îl citesc nu văd niciodată un import parțial; la următoarea
+verificare își redeschid conexiunea.
+
+Registrul nu conține starea TVA: pentru ea aplicațiile merg în continuare la ANAF.
+
+Pentru autocompletarea după denumire, importul salvează și un index sortat al
+denumirilor normalizate (fără diacritice și fără forma juridică). Worker-ii îl
+încarcă în memorie ca un singur bloc de octeți plus două `array`-uri
+(offset-uri și CUI-uri) și caută prefixul cu `bisect`.
+
+Căutarea tolerantă la greșeli folosește un index invers de trigrame peste
+aceleași denumiri: pentru fiecare trigramă, pozițiile (sortate, `array('I')`)
+denumirilor care o conțin. Se numără întâi listele cele mai scurte, până la un
+buget de poziții, iar doar primii candidați după numărul de trigrame comune
+sunt punctați exact; pentru interogări formate numai din trigrame foarte
+frecvente rezultatul e deci aproximativ.
+
+    python anaf_registry.py --db registry.sqlite3 od_firme.csv od_caen.csv
+"""
+import argparse
+import csv
+import heapq
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from anaf_cif import clean_cif
+
+logger = logging.getLogger(__name__)
+
+ANAF_REGISTRY_PATH = os.environ.get("ANAF_REGISTRY_PATH", "")
+
+# Coloana din registru -> denumirile acceptate în CSV (fără diferență între majuscule și minuscule)
+COLUMN_ALIASES = {
+    "cui": ("cui", "cod_fiscal", "cif", "cod_unic_inregistrare"),
+    "denumire": ("denumire", "nume", "denumire_firma"),
+    "nr_reg_com": ("cod_inmatriculare", "nr_reg_com", "nrregcom", "numar_inmatriculare"),
+    "adresa": ("adresa", "adresa_completa"),
+    "strada": ("adr_den_strada", "strada"),
+    "numar": ("adr_nr_strada", "numar_strada"),
+    "oras": ("adr_localitate", "localitate", "oras"),
+    "judet": ("adr_judet", "judet"),
+    "cod_postal": ("adr_cod_postal", "cod_postal"),
+    "caen": ("caen", "cod_caen", "caen_principal"),
+}
+REGISTRY_COLUMNS = ("denumire", "nr_reg_com", "adresa", "oras", "judet", "cod_postal", "caen")
+IMPORT_CHUNK_SIZE = 10000
+LEGAL_FORMS = {"srl", "sa", "srld", "snc", "scs", "sca", "pfa", "ii", "if", "ra"}
+SUGGEST_SCAN_LIMIT = 200
+FUZZY_MIN_SIMILARITY = 0.5
+FUZZY_VERIFY_LIMIT = 300
+FUZZY_MAX_POSTINGS = 50000
+
+
+def normalize_company_name(name: str) -> str:
+    """Minuscule ASCII, fără punctuație, fără "SC" în față și fără forma juridică (SRL, SA...) la final"""
+    folded = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower().replace(".", "")
+    words = re.sub(r"[^a-z0-9]+", " ", folded).split()
+    if len(words) > 1 and words[0] == "sc":
+        words = words[1:]
+    while len(words) > 1 and words[-1] in LEGAL_FORMS:
+        words.pop()
+    return " ".join(words)
+
+
+class _SortedKeys:
+    """Secvența cheilor sortate, citite direct din bloc (pentru bisect), fără câte un obiect str per firmă"""
+
+    def __init__(self, blob: bytes, offsets: array):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> bytes:
+        return self.blob[self.offsets[position]:self.offsets[position + 1]]
+
+
+def name_trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def _build_suggest_index(conn: sqlite3.Connection):
+    entries = sorted(
+        (normalize_company_name(name).encode("ascii"), cui)
+        for cui, name in conn.execute("SELECT cui, denumire FROM companies WHERE denumire <> ''")
+    )
+    offsets, cuis, position = array("I", [0]), array("q"), 0
+    postings = {}
+    for key, cui in entries:
+        # Pozițiile se adaugă crescător, deci fiecare listă rămâne sortată
+        for trigram in name_trigrams(key.decode("ascii")):
+            postings.setdefault(trigram, array("I")).append(len(cuis))
+        position += len(key)
+        offsets.append(position)
+        cuis.append(cui)
+    conn.executemany(
+        "INSERT INTO suggest_index (name, data) VALUES (?, ?)",
+        [("keys", b"".join(key for key, _ in entries)), ("offsets", offsets.tobytes()), ("cuis", cuis.tobytes())],
+    )
+    conn.executemany(
+        "INSERT INTO trigram_index (trigram, postings) VALUES (?, ?)",
+        ((trigram, positions.tobytes()) for trigram, positions in postings.items()),
+    )
+
+
+def _resolve_columns(header: list) -> dict:
+    normalized = {name.strip().lower(): position for position, name in enumerate(header)}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[column] = normalized[alias]
+                break
+    return columns
+
+
+def _compose_address(values: dict) -> str:
+    # Aceeași ordine ca adresa construită din răspunsul ANAF
+    parts = []
+    if values.get("strada"):
+        parts.append(values["strada"])
+    if values.get("numar"):
+        parts.append(f"Nr. {values['numar']}")
+    if values.get("oras"):
+        parts.append(values["oras"])
+    if values.get("judet"):
+        parts.append(values["judet"])
+    return ", ".join(parts)
+
+
+def _read_csv(path: str):
+    """Generează rânduri (cui, denumire, nr_reg_com, adresa, oras, judet, cod_postal, caen); rândurile fără CUI valid sunt sărite"""
+    with open(path, encoding="utf-8-sig", errors="replace", newline="") as handle:
+        sample = handle.read(64 * 1024)
+        handle.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters="^;,\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(handle, dialect)
+        columns = _resolve_columns(next(reader, []))
+        if "cui" not in columns:
+            raise ValueError(f"{path}: missing CUI column")
+        skipped = 0
+        for row in reader:
+            values = {column: row[position].strip() for column, position in columns.items() if position < len(row)}
+            try:
+                cui = int(clean_cif(values.get("cui", "")))
+            except ValueError:
+                skipped += 1
+                continue
+            if not values.get("adresa"):
+                values["adresa"] = _compose_address(values)
+            yield (cui, *(values.get(column, "") for column in REGISTRY_COLUMNS))
+        if skipped:
+            logger.warning(f"{path}: skipped {skipped} rows without a valid CUI")
+
+
+def import_registry(db_path: str, csv_paths: list) -> int:
+    """Reconstruiește registrul din CSV-uri; pentru același CUI, valorile nevide din fișierele următoare le completează pe cele anterioare"""
+    building_path = f"{db_path}.building"
+    if os.path.exists(building_path):
+        os.remove(building_path)
+    conn = sqlite3.connect(building_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE companies (cui INTEGER PRIMARY KEY, denumire TEXT, nr_reg_com TEXT, adresa TEXT, "
+            "oras TEXT, judet TEXT, cod_postal TEXT, caen TEXT)"
+        )
+        conn.execute("CREATE TABLE registry_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE suggest_index (name TEXT PRIMARY KEY, data BLOB)")
+        conn.execute("CREATE TABLE trigram_index (trigram TEXT PRIMARY KEY, postings BLOB)")
+        updates = ", ".join(f"{column} = COALESCE(NULLIF(excluded.{column}, ''), {column})" for column in REGISTRY_COLUMNS)
+        insert = (
+            f"INSERT INTO companies (cui, {', '.join(REGISTRY_COLUMNS)}) VALUES (?, {', '.join('?' for _ in REGISTRY_COLUMNS)}) "
+            f"ON CONFLICT(cui) DO UPDATE SET {updates}"
+        )
+        conn.execute("BEGIN")
+        for csv_path in csv_paths:
+            chunk = []
+            for row in _read_csv(csv_path):
+                chunk.append(row)
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    conn.executemany(insert, chunk)
+                    chunk = []
+            conn.executemany(insert, chunk)
+        _build_suggest_index(conn)
+        count = conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO registry_meta (key, value) VALUES (?, ?)",
+            [("imported_at", str(time.time())), ("companies", str(count)), ("sources", ",".join(os.path.basename(p) for p in csv_paths))],
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    os.replace(building_path, db_path)
+    return count
+
+
+class CompanyRegistry:
+    """Citiri din registrul local; dacă fișierul lipsește, orice căutare întoarce None"""
+
+    RELOAD_CHECK_SECONDS = 30
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._checked_at = 0.0
+        self._signature = None
+        self._index_lock = threading.Lock()
+        self._index = None
+        self._index_signature = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _connect(self):
+        # Verifică periodic dacă un import nou a înlocuit fișierul
+        now = time.monotonic()
+        if now - self._checked_at >= self.RELOAD_CHECK_SECONDS:
+            self._checked_at = now
+            self._signature = self._file_signature()
+        if self._signature is None:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid() or self._local.signature != self._signature:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.signature = self._signature
+        return conn
+
+    def get(self, cui: str):
+        """Compania în formatul răspunsului /api/anaf/company, fără platitorTVA, sau None"""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT cui, {', '.join(REGISTRY_COLUMNS)} FROM companies WHERE cui = ?", (int(cui),)
+            ).fetchone() if conn is not None else None
+        except sqlite3.Error as exc:
+            self.errors += 1
+            logger.warning(f"Company registry read failed: {exc}")
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            "cui": row[0],
+            "denumire": row[1] or "",
+            "nrRegCom": row[2] or "",
+            "adresa": row[3] or "",
+            "oras": row[4] or "",
+            "judet": row[5] or "",
+            "codPostal": row[6] or "",
+            "caen": row[7] or "",
+        }
+
+    def _suggest_index(self):
+        conn = self._connect()
+        if conn is None:
+            return None
+        if self._index_signature != self._signature:
+            with self._index_lock:
+                if self._index_signature != self._signature:
+                    data = dict(conn.execute("SELECT name, data FROM suggest_index").fetchall())
+                    offsets, cuis = array("I"), array("q")
+                    offsets.frombytes(data["offsets"])
+                    cuis.frombytes(data["cuis"])
+                    trigrams = {}
+                    for trigram, blob in conn.execute("SELECT trigram, postings FROM trigram_index"):
+                        trigrams[trigram] = array("I")
+                        trigrams[trigram].frombytes(blob)
+                    self._index = (_SortedKeys(data["keys"], offsets), cuis, trigrams)
+                    self._index_signature = self._signature
+        return self._index
+
+    def _index_or_none(self):
+        try:
+            return self._suggest_index()
+        except (sqlite3.Error, KeyError) as exc:
+            self.errors += 1
+            logger.warning(f"Company registry name index unavailable: {exc}")
+            return None
+
+    def _summaries(self, cuis: list, extra: dict = None) -> list:
+        if not cuis:
+            return []
+        rows = self._connect().execute(
+            f"SELECT cui, denumire, judet FROM companies WHERE cui IN ({', '.join('?' for _ in cuis)})", cuis
+        ).fetchall()
+        by_cui = {row[0]: {"cui": row[0], "denumire": row[1] or "", "judet": row[2] or ""} for row in rows}
+        for cui, values in (extra or {}).items():
+            if cui in by_cui:
+                by_cui[cui].update(values)
+        return [by_cui[cui] for cui in cuis if cui in by_cui]
+
+    def suggest(self, query: str, limit: int = 10):
+        """Primele `limit` firme al căror nume normalizat începe cu interogarea, sau None dacă indexul lipsește"""
+        index = self._index_or_none()
+        if index is None:
+            return None
+        prefix = normalize_company_name(query).encode("ascii")
+        if not prefix:
+            return []
+        keys, cuis, _ = index
+        candidates = []
+        position = bisect_left(keys, prefix)
+        while position < len(keys) and len(candidates) < SUGGEST_SCAN_LIMIT:
+            key = keys[position]
+            if not key.startswith(prefix):
+                break
+            candidates.append((key != prefix, len(key), key, cuis[position]))
+            position += 1
+        # Potrivirea exactă întâi, apoi numele mai scurte (cele mai apropiate de ce s-a tastat)
+        return self._summaries([candidate[3] for candidate in sorted(candidates)[:limit]])
+
+    def search(self, query: str, limit: int = 10, min_similarity: float = FUZZY_MIN_SIMILARITY):
+        """Firmele cu denumirea cea mai apropiată de interogare (toleră greșeli de tastare), sau None dacă indexul lipsește"""
+        index = self._index_or_none()
+        if index is None:
+            return None
+        key = normalize_company_name(query)
+        if len(key) < 3:
+            # Sub trei caractere trigramele nu deosebesc denumirile; prefixul e mai util
+            return self.suggest(query, limit)
+        keys, cuis, trigrams = index
+        query_trigrams = name_trigrams(key)
+        needed = max(1, math.ceil(min_similarity * len(query_trigrams)))
+        # Listele cele mai rare selectează candidații; cele frecvente contează doar la punctajul exact
+        postings = sorted((trigrams[trigram] for trigram in query_trigrams if trigram in trigrams), key=len)
+        counts, budget, counted = Counter(), FUZZY_MAX_POSTINGS, 0
+        for positions in postings:
+            if counted and len(positions) > budget:
+                break
+            counts.update(positions[:budget])
+            budget -= len(positions)
+            counted += 1
+        minimum = max(1, needed - (len(query_trigrams) - counted))
+        candidates = heapq.nlargest(
+            FUZZY_VERIFY_LIMIT, (position for position, count in counts.items() if count >= minimum), key=counts.__getitem__
+        )
+        scored = []
+        for position in candidates:
+            candidate_trigrams = name_trigrams(keys[position].decode("ascii"))
+            common = len(query_trigrams & candidate_trigrams)
+            # Cât din interogare se regăsește în denumire, și cât de apropiate sunt ca lungime
+            containment = common / len(query_trigrams)
+            if containment < min_similarity:
+                continue
+            score = (containment + common / len(query_trigrams | candidate_trigrams)) / 2
+            scored.append((-score, len(candidate_trigrams), position))
+        top = sorted(scored)[:limit]
+        scores = {}
+        for score, _, position in top:
+            scores.setdefault(cuis[position], {"score": round(-score, 3)})
+        return self._summaries(list(scores), scores)
+
+    def stats(self) -> dict:
+        stats = {"path": self.path, "loaded": False, "hits": self.hits, "misses": self.misses, "errors": self.errors}
+        try:
+            conn = self._connect()
+            if conn is not None:
+                meta = dict(conn.execute("SELECT key, value FROM registry_meta").fetchall())
+                stats.update(loaded=True, companies=int(meta.get("companies", 0)), importedAt=float(meta.get("imported_at", 0)))
+        except sqlite3.Error as exc:
+            stats["error"] = str(exc)
+        return stats
+
+
+def build_registry(path: str = ANAF_REGISTRY_PATH):
+    """Registrul local sau None dacă nu e configurat"""
+    return CompanyRegistry(path) if path else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importă registrul firmelor din fișiere CSV")
+    parser.add_argument("csv_paths", nargs="+", help="fișiere CSV cu o coloană CUI")
+    parser.add_argument("--db", default=ANAF_REGISTRY_PATH or "registry.sqlite3", help="fișierul SQLite rezultat")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    started = time.time()
+    imported = import_registry(args.db, args.csv_paths)
+    logger.info(f"Imported {imported} companies into {args.db} in {time.time() - started:.1f}s")
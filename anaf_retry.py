@@ -0,0 +1,171 @@
+"""
+Reîncercarea apelurilor ANAF eșuate din motive trecătoare.
+
+Se reîncearcă doar erorile după care apelul sigur poate fi repetat: conexiune
+refuzată sau resetată și răspunsurile 502/503/504 ale gateway-ului ANAF.
+Timeout-urile de citire nu se reîncearcă (apelul lent primește deja o
+dublură, vezi anaf_timeouts), ca să nu dublăm încărcarea unui ANAF supraîncărcat.
+
+Pauza dintre încercări e aleasă uniform între 0 și `base * 2^n`, plafonată la
+`max_delay` (backoff exponențial cu full jitter). `RetryBudget` ține
+reîncercările la cel mult `ratio` din apeluri (10% implicit, plus o rezervă
+mică), așa că o cădere a ANAF nu e amplificată. Fiecare reîncercare își
+rezervă slotul ei la limitator, nu pornește cât breaker-ul e deschis și nu
+trece de termenul clientului; altfel se ridică eroarea inițială. Slotul e
+luat doar dacă vine înaintea termenului, ca o reîncercare abandonată să nu
+consume din ritmul ANAF.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+from anaf_breaker import CircuitOpenError
+from anaf_ratelimit import RateLimitExceeded
+from anaf_timeouts import DeadlineExceeded, remaining
+
+ANAF_RETRY_MAX_ATTEMPTS = int(os.environ.get("ANAF_RETRY_MAX_ATTEMPTS", 3))
+ANAF_RETRY_BASE_DELAY_MS = float(os.environ.get("ANAF_RETRY_BASE_DELAY_MS", 100))
+ANAF_RETRY_MAX_DELAY_MS = float(os.environ.get("ANAF_RETRY_MAX_DELAY_MS", 2000))
+ANAF_RETRY_BUDGET_RATIO = float(os.environ.get("ANAF_RETRY_BUDGET_RATIO", 0.1))
+ANAF_RETRY_BUDGET_RESERVE = float(os.environ.get("ANAF_RETRY_BUDGET_RESERVE", 10))
+
+# Statusurile HTTP ale ANAF care arată o problemă trecătoare a gateway-ului
+RETRY_STATUSES = (502, 503, 504)
+
+
+class RetryBudget:
+    """Fiecare apel nou depune `ratio` jetoane (până la `reserve`), fiecare reîncercare consumă unul"""
+
+    def __init__(self, ratio: float = ANAF_RETRY_BUDGET_RATIO, reserve: float = ANAF_RETRY_BUDGET_RESERVE):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._balance = reserve
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.reserve)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self) -> float:
+        return self._balance
+
+
+class RetryPolicy:
+    """
+    `retryable(exc)` spune dacă eroarea e trecătoare; `limiter` și `breaker` sunt cele ale aplicației.
+    `call` e pentru Flask (pauza blochează thread-ul), `call_async` pentru FastAPI.
+    """
+
+    def __init__(
+        self,
+        retryable,
+        limiter=None,
+        breaker=None,
+        budget: RetryBudget = None,
+        max_attempts: int = ANAF_RETRY_MAX_ATTEMPTS,
+        base_delay_ms: float = ANAF_RETRY_BASE_DELAY_MS,
+        max_delay_ms: float = ANAF_RETRY_MAX_DELAY_MS,
+    ):
+        self._retryable = retryable
+        self._limiter = limiter
+        self._breaker = breaker
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max(max_attempts, 1)
+        self._base_delay = base_delay_ms / 1000
+        self._max_delay = max_delay_ms / 1000
+        self.calls = 0
+        self.retries = 0
+        self.recovered = 0
+        self.budget_exhausted = 0
+        self.gave_up = 0
+
+    def call(self, attempt, deadline=None):
+        self._start()
+        for number in range(1, self.max_attempts + 1):
+            try:
+                result = attempt()
+            except Exception as exc:
+                delay = self._next_delay(exc, number, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.recovered += number > 1
+            return result
+
+    async def call_async(self, attempt, deadline=None):
+        """Ca `call`; `attempt` e o funcție care întoarce o corutină"""
+        self._start()
+        for number in range(1, self.max_attempts + 1):
+            try:
+                result = await attempt()
+            except Exception as exc:
+                # Slotul reîncercării poate fi rezervat în fișierul SQLite comun: decizia rulează pe un thread
+                if self._limiter is not None:
+                    delay = await asyncio.to_thread(self._next_delay, exc, number, deadline)
+                else:
+                    delay = self._next_delay(exc, number, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.recovered += number > 1
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "recovered": self.recovered,
+            "budgetExhausted": self.budget_exhausted,
+            "gaveUp": self.gave_up,
+            "budget": round(self.budget.balance, 2),
+        }
+
+    def _start(self):
+        self.calls += 1
+        self.budget.deposit()
+
+    def _next_delay(self, exc: Exception, number: int, deadline):
+        """Pauza până la încercarea următoare sau None dacă eroarea trebuie ridicată acum"""
+        if number >= self.max_attempts or not self._retryable(exc):
+            return None
+        delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (number - 1)))
+        try:
+            left = remaining(deadline)
+        except DeadlineExceeded:
+            left = 0
+        if left is not None and delay >= left:
+            self.gave_up += 1
+            return None
+        if self._breaker is not None:
+            try:
+                self._breaker.check()
+            except CircuitOpenError:
+                self.gave_up += 1
+                return None
+        if not self.budget.withdraw():
+            self.budget_exhausted += 1
+            return None
+        if self._limiter is not None:
+            # Reîncercarea e un apel ANAF ca oricare altul: își așteaptă rândul la limitator
+            try:
+                wait = self._limiter.reserve(max_wait=left)
+            except RateLimitExceeded:
+                wait = None
+            if wait is None:
+                self.gave_up += 1
+                return None
+            delay = max(delay, wait)
+        self.retries += 1
+        return delay
@@ -0,0 +1,96 @@
+"""
+Deduplicare (single-flight) a căutărilor ANAF identice aflate în curs.
+
+Primul apelant pentru o cheie (cui, dată) face apelul upstream; apelanții
+concurenți cu aceeași cheie așteaptă același rezultat (sau aceeași excepție).
+`SingleFlight` e pentru aplicația Flask (thread-uri), `AsyncSingleFlight`
+pentru FastAPI (asyncio).
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from datetime import date
+
+
+def clean_lookup_date(day) -> str:
+    """Data în format ISO (YYYY-MM-DD); altfel ValueError("invalid_date")"""
+    try:
+        return date.fromisoformat(str(day).strip()).isoformat()
+    except ValueError:
+        raise ValueError("invalid_date")
+
+
+def normalize_lookup_key(cui: str, day: str) -> tuple:
+    """CUI fără zerouri în față și dată ISO (YYYY-MM-DD); o dată care nu poate fi interpretată e ValueError("invalid_date")"""
+    return cui.lstrip("0") or cui, clean_lookup_date(day)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, timeout: float = None):
+        """
+        Fără `timeout`, primul apelant execută `fn` pe thread-ul lui. Cu `timeout`, apelul comun rulează pe
+        un thread separat și fiecare apelant își așteaptă rezultatul cel mult `timeout` secunde (apoi
+        concurrent.futures.TimeoutError); apelul continuă pentru ceilalți, indiferent de termenul cuiva.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if leader:
+            if timeout is None:
+                self._run(key, fn, future)
+            else:
+                threading.Thread(target=self._run, args=(key, fn, future), name="anaf-flight", daemon=True).start()
+        return future.result(timeout)
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "shared": self.shared, "inFlight": len(self._calls)}
+
+    def _run(self, key, fn, future):
+        try:
+            future.set_result(fn())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """`fn` este o funcție care întoarce o corutină; anularea unui apelant nu îi anulează pe ceilalți"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "shared": self.shared, "inFlight": len(self._calls)}
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marchează excepția ca preluată dacă toți apelanții au fost anulați între timp
+            task.exception()
@@ -0,0 +1,185 @@
+"""
+Timeout-uri adaptive, cereri dublate (hedging) și termenul-limită al clientului pentru apelurile ANAF.
+
+`LatencyTracker` ține duratele ultimelor răspunsuri ANAF (și cele cu eroare);
+un apel expirat intră cu timeout-ul atins, ca valoare minimă a duratei lui,
+așa că atunci când ANAF încetinește percentilele cresc și timeout-ul crește
+odată cu ele. Timeout-ul de citire se derivă din p99 (între `min_timeout` și
+ANAF_READ_TIMEOUT), iar un
+apel care depășește p95 primește o dublură, dacă limitatorul are un slot liber
+imediat; câștigă primul răspuns reușit. `call_hedged` e pentru Flask
+(thread-uri), `call_hedged_async` pentru FastAPI.
+
+Clientul poate trimite `X-Deadline-Ms` (cât e dispus să aștepte, în
+milisecunde): termenul devine un moment pe ceasul monoton și limitează
+așteptarea la limitator, timeout-ul apelului și așteptarea rezultatului.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+ANAF_LATENCY_WINDOW = int(os.environ.get("ANAF_LATENCY_WINDOW", 200))
+ANAF_LATENCY_MIN_SAMPLES = int(os.environ.get("ANAF_LATENCY_MIN_SAMPLES", 20))
+ANAF_TIMEOUT_MIN_SECONDS = float(os.environ.get("ANAF_TIMEOUT_MIN_SECONDS", 2))
+ANAF_TIMEOUT_P99_FACTOR = float(os.environ.get("ANAF_TIMEOUT_P99_FACTOR", 2))
+ANAF_HEDGE_PERCENTILE = float(os.environ.get("ANAF_HEDGE_PERCENTILE", 0.95))
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("anaf_deadline_exceeded")
+
+
+def parse_deadline(value):
+    """Momentul (time.monotonic) până la care clientul așteaptă, din valoarea antetului X-Deadline-Ms, sau None"""
+    try:
+        milliseconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return time.monotonic() + milliseconds / 1000 if milliseconds > 0 else None
+
+
+def remaining(deadline):
+    """Secundele rămase până la termen (None fără termen); ridică DeadlineExceeded dacă a trecut"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+async def wait_until(awaitable, deadline):
+    """Așteaptă `awaitable` cel mult până la termen; după termen îl anulează și ridică DeadlineExceeded"""
+    try:
+        return await asyncio.wait_for(awaitable, remaining(deadline))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+class LatencyTracker:
+    def __init__(
+        self,
+        max_timeout: float,
+        min_timeout: float = ANAF_TIMEOUT_MIN_SECONDS,
+        window: int = ANAF_LATENCY_WINDOW,
+        min_samples: int = ANAF_LATENCY_MIN_SAMPLES,
+        p99_factor: float = ANAF_TIMEOUT_P99_FACTOR,
+        hedge_percentile: float = ANAF_HEDGE_PERCENTILE,
+    ):
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.min_samples = min_samples
+        self.p99_factor = p99_factor
+        self.hedge_percentile = hedge_percentile
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def record(self, duration: float):
+        with self._lock:
+            self._samples.append(duration)
+            self._sorted = None
+
+    def record_timeout(self, timeout: float):
+        """Apelul n-a răspuns în `timeout` secunde: durata lui reală e cel puțin atât"""
+        self.timeouts += 1
+        self.record(timeout)
+
+    def percentile(self, q: float):
+        """Percentila `q` (0..1) a duratelor recente sau None dacă sunt prea puține"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def timeout(self, deadline=None) -> float:
+        """Timeout-ul de citire: p99 * factor între min_timeout și max_timeout, dar nu după termenul clientului"""
+        p99 = self.percentile(0.99)
+        timeout = self.max_timeout if p99 is None else max(self.min_timeout, min(p99 * self.p99_factor, self.max_timeout))
+        left = remaining(deadline)
+        return timeout if left is None else min(timeout, left)
+
+    def hedge_after(self):
+        """După câte secunde fără răspuns merită o dublură (p95), sau None"""
+        return self.percentile(self.hedge_percentile) if self.hedge_percentile > 0 else None
+
+    def stats(self) -> dict:
+        p50, p95, p99 = self.percentile(0.5), self.percentile(0.95), self.percentile(0.99)
+        return {
+            "samples": len(self._samples),
+            "p50": round(p50, 4) if p50 is not None else None,
+            "p95": round(p95, 4) if p95 is not None else None,
+            "p99": round(p99, 4) if p99 is not None else None,
+            "readTimeout": round(self.timeout(), 3),
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "timeouts": self.timeouts,
+        }
+
+
+def call_hedged(attempt, tracker: LatencyTracker, allow_hedge, executor, deadline=None):
+    """
+    `attempt()` face un apel blocant. Dacă nu răspunde în p95 și `allow_hedge()` permite, pornește
+    pe `executor` o dublură; întoarce primul rezultat reușit sau ridică ultima eroare
+    """
+    hedge_after = tracker.hedge_after()
+    if hedge_after is None:
+        return attempt()
+    first = executor.submit(attempt)
+    done, _ = wait((first,), timeout=min(hedge_after, remaining(deadline) or hedge_after))
+    if done:
+        return first.result()
+    pending = {first}
+    if allow_hedge():
+        tracker.hedges += 1
+        pending.add(executor.submit(attempt))
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded()
+        for future in done:
+            if future.exception() is None:
+                tracker.hedge_wins += future is not first
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def call_hedged_async(attempt, tracker: LatencyTracker, allow_hedge, deadline=None):
+    """Varianta asyncio: `attempt` și `allow_hedge` sunt funcții care întorc corutine; apelul rămas e anulat"""
+    hedge_after = tracker.hedge_after()
+    if hedge_after is None:
+        return await wait_until(attempt(), deadline)
+    first = asyncio.ensure_future(attempt())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=min(hedge_after, remaining(deadline) or hedge_after))
+        if not done and await allow_hedge():
+            tracker.hedges += 1
+            pending.add(asyncio.ensure_future(attempt()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=remaining(deadline), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded()
+            for task in done:
+                if task.exception() is None:
+                    tracker.hedge_wins += task is not first
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
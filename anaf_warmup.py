@@ -0,0 +1,197 @@
+"""
+Preîncălzirea conexiunilor către ANAF la pornirea worker-ului.
+
+Primele căutări după un deploy sau după reciclarea unui worker plăteau
+rezolvarea DNS, conectarea TCP și handshake-ul TLS. La pornire numele
+serverului ANAF e rezolvat o dată, apoi se deschid `connections` conexiuni
+în pool-ul clientului HTTP, prin cereri HEAD concurente către rădăcina
+serverului (nu către API, ca să nu consume din limita de cereri ANAF).
+Dacă worker-ul n-a mai vorbit cu ANAF de `refresh` secunde, conexiunile se
+redeschid/reîmprospătează, ca să nu fie închise ca inactive între două valuri
+de trafic; după `idle_max` secunde fără niciun apel ANAF reîmprospătarea se
+oprește până la următorul apel (`refresh` 0 o dezactivează complet). Erorile
+sunt doar logate: preîncălzirea nu oprește pornirea.
+
+`ConnectionWarmer` (thread, Flask) și `AsyncConnectionWarmer` (asyncio, FastAPI).
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+ANAF_WARM_CONNECTIONS = int(os.environ.get("ANAF_WARM_CONNECTIONS", 4))
+ANAF_WARM_REFRESH_SECONDS = float(os.environ.get("ANAF_WARM_REFRESH_SECONDS", 30))
+ANAF_WARM_IDLE_MAX_SECONDS = float(os.environ.get("ANAF_WARM_IDLE_MAX_SECONDS", 600))
+
+
+class _WarmPlan:
+    """Starea comună variantei cu thread și celei asyncio"""
+
+    def __init__(self, url: str, open_connection, connections: int, refresh: float, idle_max: float):
+        parts = urlsplit(url)
+        self.origin = f"{parts.scheme}://{parts.netloc}/"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.connections = connections
+        self.refresh = refresh
+        self.idle_max = idle_max
+        self._open_connection = open_connection
+        # Pornirea worker-ului contează ca folosire: fereastra `idle_max` începe de aici
+        self._last_used = time.monotonic()
+        self._warmed_at = 0.0
+        self.addresses = 0
+        self.dns_seconds = None
+        self.warmups = 0
+        self.opened = 0
+        self.failures = 0
+
+    def touch(self):
+        """Un apel ANAF tocmai a folosit pool-ul: conexiunile lui sunt calde"""
+        self._last_used = time.monotonic()
+
+    def due(self) -> bool:
+        """Conexiunile n-au mai fost folosite de `refresh` secunde, dar ANAF a fost apelat în ultimele `idle_max`"""
+        now = time.monotonic()
+        return now - max(self._last_used, self._warmed_at) >= self.refresh and now - self._last_used < self.idle_max
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "addresses": self.addresses,
+            "dnsSeconds": round(self.dns_seconds, 4) if self.dns_seconds is not None else None,
+            "warmups": self.warmups,
+            "opened": self.opened,
+            "failures": self.failures,
+        }
+
+    def _resolved(self, infos: list, started: float):
+        self.dns_seconds = time.monotonic() - started
+        self.addresses = len({info[4][0] for info in infos})
+
+    def _warmed(self, results: list):
+        self.warmups += 1
+        for result in results:
+            if isinstance(result, Exception):
+                self.failures += 1
+                logger.warning(f"ANAF connection warmup failed: {result}")
+            else:
+                self.opened += 1
+        self._warmed_at = time.monotonic()
+
+
+class ConnectionWarmer(_WarmPlan):
+    """`open_connection(origin)` face o cerere HEAD blocantă prin sesiunea procesului"""
+
+    def __init__(
+        self,
+        url: str,
+        open_connection,
+        connections: int = ANAF_WARM_CONNECTIONS,
+        refresh: float = ANAF_WARM_REFRESH_SECONDS,
+        idle_max: float = ANAF_WARM_IDLE_MAX_SECONDS,
+    ):
+        super().__init__(url, open_connection, connections, refresh, idle_max)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """
+        Pornește thread-ul o dată în fiecare proces (thread-urile și socket-urile nu supraviețuiesc unui fork).
+        Se apelează la prima cerere a worker-ului, nu la import, ca scripturile care importă aplicația să nu contacteze ANAF
+        """
+        if self._pid == os.getpid() or self.connections <= 0:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, name="anaf-warmup", daemon=True).start()
+
+    def warm(self):
+        results = [None] * self.connections
+
+        def open_one(position):
+            try:
+                self._open_connection(self.origin)
+                results[position] = True
+            except Exception as exc:
+                results[position] = exc
+
+        # Cererile pleacă simultan, ca fiecare să ocupe (și apoi să lase în pool) o conexiune proprie
+        threads = [threading.Thread(target=open_one, args=(position,), daemon=True) for position in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._warmed(results)
+
+    def _loop(self):
+        try:
+            started = time.monotonic()
+            self._resolved(socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM), started)
+            self.warm()
+        except Exception as exc:
+            logger.warning(f"ANAF connection warmup failed: {exc}")
+        while self.refresh > 0:
+            time.sleep(self.refresh)
+            if self.due():
+                try:
+                    self.warm()
+                except Exception as exc:
+                    logger.warning(f"ANAF connection warmup failed: {exc}")
+
+
+class AsyncConnectionWarmer(_WarmPlan):
+    """Varianta asyncio: `open_connection(origin)` e o corutină; `start` e așteptat din lifespan"""
+
+    def __init__(
+        self,
+        url: str,
+        open_connection,
+        connections: int = ANAF_WARM_CONNECTIONS,
+        refresh: float = ANAF_WARM_REFRESH_SECONDS,
+        idle_max: float = ANAF_WARM_IDLE_MAX_SECONDS,
+    ):
+        super().__init__(url, open_connection, connections, refresh, idle_max)
+        self._task = None
+
+    async def start(self, timeout: float = None):
+        """Rezolvă DNS și deschide conexiunile (cel mult `timeout` secunde), apoi pornește reîmprospătarea"""
+        if self.connections <= 0:
+            return
+        try:
+            started = time.monotonic()
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM), timeout
+            )
+            self._resolved(infos, started)
+            await asyncio.wait_for(self.warm(), timeout)
+        except Exception as exc:
+            logger.warning(f"ANAF connection warmup failed: {exc!r}")
+        if self.refresh > 0:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def warm(self):
+        self._warmed(await asyncio.gather(*(self._open_connection(self.origin) for _ in range(self.connections)), return_exceptions=True))
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh)
+            if self.due():
+                try:
+                    await self.warm()
+                except Exception as exc:
+                    logger.warning(f"ANAF connection warmup failed: {exc!r}")
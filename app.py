@@ -1,13 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import date, datetime, timedelta
-from flask import Flask, jsonify, request
+from http.cookiejar import DefaultCookiePolicy
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from requests.adapters import HTTPAdapter
 import base64
+import json
+import math
 import os
 import random
 import re
 import string
+import tempfile
+import threading
+import time
 import requests
 
+from anaf_breaker import CircuitBreaker, CircuitOpenError
+from anaf_cif import clean_cif, parse_cif
+from anaf_cache import EXPIRED, FRESH, STALE, BackgroundRefresher, CachePolicy, build_cache
+from anaf_batching import ANAF_BATCH_SIZE, LookupCoalescer, find_company, index_anaf_found
+from anaf_jobs import ANAF_JOB_MAX_CUIS, JobInputError, JobRunner, build_job_store, iter_results_csv, job_entries, parse_job_csv
+from anaf_mapper import company_response_json, map_anaf_company
+from anaf_periods import build_timeline, spread_days, stable_interval
+from anaf_prewarm import CachePrewarmer, PopularitySketch
+from anaf_ratelimit import RateLimitExceeded, build_bucket
+from anaf_registry import build_registry
+from anaf_retry import RETRY_STATUSES, RetryPolicy
+from anaf_singleflight import SingleFlight, clean_lookup_date, normalize_lookup_key
+from anaf_timeouts import DEADLINE_HEADER, DeadlineExceeded, LatencyTracker, call_hedged, parse_deadline, remaining
+from anaf_warmup import ConnectionWarmer
+
 
 # Create Flask app
 app = Flask(__name__)
@@ -23,7 +46,7 @@ CORS(app,
          r"/api/*": {
              "origins": allowed_origins,
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-             "allow_headers": ["Content-Type", "Authorization", "Accept-Language"],
+             "allow_headers": ["Content-Type", "Authorization", "Accept-Language", "X-Deadline-Ms"],
              "supports_credentials": True,
              "max_age": 3600
          }
@@ -36,7 +59,7 @@ def add_cors_headers(response):
     if origin in allowed_origins:
         response.headers['Access-Control-Allow-Origin'] = origin
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept-Language'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept-Language, X-Deadline-Ms'
         response.headers['Access-Control-Max-Age'] = '3600'
         if request.method == 'OPTIONS':
             response.status_code = 204
@@ -55,6 +78,31 @@ TOOLS_METADATA = [
 SYMBOLS = "!@#$%^&*()-_=+[]{};:,.<>/?"
 COUNTY_CODES = {"01": "Alba", "02": "Arad", "03": "Argeș", "04": "Bacău", "05": "Bihor", "06": "Bistrița-Năsăud", "07": "Botoșani", "08": "Brașov", "09": "Brăila", "10": "Buzău", "11": "Caraș-Severin", "12": "Cluj", "13": "Constanța", "14": "Covasna", "15": "Dâmbovița", "16": "Dolj", "17": "Galați", "18": "Gorj", "19": "Harghita", "20": "Hunedoara", "21": "Ialomița", "22": "Iași", "23": "Ilfov", "24": "Maramureș", "25": "Mehedinți", "26": "Mureș", "27": "Neamț", "28": "Olt", "29": "Prahova", "30": "Satu Mare", "31": "Sălaj", "32": "Sibiu", "33": "Suceava", "34": "Teleorman", "35": "Timiș", "36": "Tulcea", "37": "Vaslui", "38": "Vâlcea", "39": "Vrancea", "40": "București", "41": "București - Sector 1", "42": "București - Sector 2", "43": "București - Sector 3", "44": "București - Sector 4", "45": "București - Sector 5", "46": "București - Sector 6", "51": "Călărași", "52": "Giurgiu"}
 WEIGHTS = [2, 7, 9, 1, 4, 6, 3, 5, 8, 2, 7, 9]
+CIF_ERROR_MESSAGES = {
+    "invalid_cif_format": "Codul fiscal poate conține doar cifre, opțional precedate de RO",
+    "invalid_cif_length": "Codul fiscal trebuie să aibă între 2 și 10 cifre",
+    "invalid_cif_checksum": "Cifra de control a codului fiscal nu este validă"
+}
+LOOKUP_ERROR_MESSAGES = {**CIF_ERROR_MESSAGES, "invalid_date": "Data trebuie să fie în formatul YYYY-MM-DD"}
+CIF_VALIDATOR_MAX_ITEMS = 10000
+NDJSON_MIMETYPE = "application/x-ndjson"
+ANAF_URL = os.environ.get('ANAF_URL', 'https://webservicesp.anaf.ro/api/PlatitorTvaRest/v9/tva')
+ANAF_BATCH_MAX_CUIS = int(os.environ.get('ANAF_BATCH_MAX_CUIS', 1000))
+ANAF_TIMELINE_MAX_DATES = int(os.environ.get('ANAF_TIMELINE_MAX_DATES', 1000))
+ANAF_CONNECT_TIMEOUT = float(os.environ.get('ANAF_CONNECT_TIMEOUT', 3))
+ANAF_READ_TIMEOUT = float(os.environ.get('ANAF_READ_TIMEOUT', 10))
+ANAF_POOL_MAX_CONNECTIONS = int(os.environ.get('ANAF_POOL_MAX_CONNECTIONS', 50))
+ANAF_COALESCE_WINDOW_MS = float(os.environ.get('ANAF_COALESCE_WINDOW_MS', 25))
+ANAF_COALESCE_MAX_BATCH = int(os.environ.get('ANAF_COALESCE_MAX_BATCH', ANAF_BATCH_SIZE))
+ANAF_CACHE_MAXSIZE = int(os.environ.get('ANAF_CACHE_MAXSIZE', 10000))
+ANAF_CACHE_TTL_SECONDS = float(os.environ.get('ANAF_CACHE_TTL_SECONDS', 3600))
+ANAF_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get('ANAF_CACHE_NEGATIVE_TTL_SECONDS', 300))
+ANAF_CACHE_STALE_SECONDS = float(os.environ.get('ANAF_CACHE_STALE_SECONDS', 3600))
+ANAF_CACHE_STALE_IF_ERROR_SECONDS = float(os.environ.get('ANAF_CACHE_STALE_IF_ERROR_SECONDS', 86400))
+ANAF_SHARED_CACHE_PATH = os.environ.get('ANAF_SHARED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'normalro_anaf_cache.sqlite3'))
+ANAF_RATE_LIMIT_PATH = os.environ.get('ANAF_RATE_LIMIT_PATH', os.path.join(tempfile.gettempdir(), 'normalro_anaf_ratelimit.sqlite3'))
+ANAF_REGISTRY_PATH = os.environ.get('ANAF_REGISTRY_PATH', '')
+ANAF_JOBS_PATH = os.environ.get('ANAF_JOBS_PATH', os.path.join(tempfile.gettempdir(), 'normalro_anaf_jobs.sqlite3'))
 
 
 # Helper functions
@@ -159,6 +207,291 @@ def parse_cnp(cnp_value: str) -> dict:
     return {"cnp": candidate, "details": {"gender": gender_label, "birthDate": birth_date.isoformat(), "countyCode": county_code, "countyName": COUNTY_CODES[county_code], "serial": serial, "controlDigit": control_digit}}
 
 
+# ANAF helpers
+_anaf_session = None
+_anaf_session_pid = None
+_anaf_session_lock = threading.Lock()
+_anaf_executor = None
+_anaf_executor_pid = None
+
+
+def get_anaf_session() -> requests.Session:
+    """Sesiunea HTTP a procesului: conexiuni keep-alive către ANAF refolosite între cereri (și între invocări Vercel "calde")"""
+    global _anaf_session, _anaf_session_pid
+    # Recreată după fork, ca worker-ii gunicorn să nu împartă socket-urile părintelui
+    if _anaf_session is None or _anaf_session_pid != os.getpid():
+        with _anaf_session_lock:
+            if _anaf_session is None or _anaf_session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ANAF_POOL_MAX_CONNECTIONS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+                # Fără cookie-uri: sesiunea e folosită concurent din mai multe thread-uri
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _anaf_session, _anaf_session_pid = session, os.getpid()
+    return _anaf_session
+
+
+def get_anaf_executor() -> ThreadPoolExecutor:
+    """Thread-urile pe care pleacă apelurile ANAF dublate (hedging); recreate după fork, ca sesiunea"""
+    global _anaf_executor, _anaf_executor_pid
+    if _anaf_executor is None or _anaf_executor_pid != os.getpid():
+        with _anaf_session_lock:
+            if _anaf_executor is None or _anaf_executor_pid != os.getpid():
+                _anaf_executor = ThreadPoolExecutor(max_workers=ANAF_POOL_MAX_CONNECTIONS, thread_name_prefix="anaf-call")
+                _anaf_executor_pid = os.getpid()
+    return _anaf_executor
+
+
+def _open_anaf_connection(origin: str):
+    # HEAD către rădăcina serverului: deschide conexiunea (DNS, TCP, TLS) fără să consume din limita API-ului
+    get_anaf_session().head(origin, timeout=(ANAF_CONNECT_TIMEOUT, ANAF_CONNECT_TIMEOUT))
+
+
+def _anaf_retryable(exc: Exception) -> bool:
+    """Conexiune refuzată sau resetată (inclusiv timeout la conectare) și 502/503/504; nu și timeout-ul de citire"""
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, requests.ConnectionError)
+
+
+def _post_anaf(entries: list[dict], deadline: float = None) -> dict:
+    # Erorile trecătoare se reîncearcă, cu backoff și în limita bugetului de reîncercări
+    return anaf_retries.call(lambda: _post_anaf_once(entries, deadline), deadline)
+
+
+def _post_anaf_once(entries: list[dict], deadline: float = None) -> dict:
+    # Cât timp ANAF e căzut, circuit breaker-ul respinge imediat apelul (CircuitOpenError);
+    # termenul depășit al clientului nu e o eroare a ANAF
+    with anaf_breaker.guard(ignore=(DeadlineExceeded,)):
+        # Timeout-ul urmează latența recentă a ANAF, fără să treacă de termenul clientului
+        read_timeout = anaf_latency.timeout(deadline)
+        
+        def attempt():
+            started = time.monotonic()
+            anaf_warmer.touch()
+            try:
+                anaf_response = get_anaf_session().post(
+                    ANAF_URL,
+                    json=entries,
+                    timeout=(min(ANAF_CONNECT_TIMEOUT, read_timeout), read_timeout)
+                )
+            except requests.Timeout:
+                remaining(deadline)
+                # Timeout-ul ANAF (nu termenul clientului) intră în percentile, ca timeout-ul să poată crește
+                anaf_latency.record_timeout(read_timeout)
+                raise
+            anaf_latency.record(time.monotonic() - started)
+            if anaf_response.status_code != 200:
+                raise requests.HTTPError(f"ANAF status {anaf_response.status_code}", response=anaf_response)
+            return anaf_response.json()
+        
+        # Un apel mai lent decât p95 primește o dublură, dacă limitatorul are un slot liber imediat
+        return call_hedged(attempt, anaf_latency, anaf_limiter.try_reserve, get_anaf_executor(), deadline)
+
+
+def fetch_anaf(entries: list[dict], deadline: float = None) -> dict:
+    """Un singur apel ANAF pentru cel mult ANAF_BATCH_SIZE intrări {"cui", "data"}, în ritmul permis de ANAF"""
+    anaf_breaker.check()
+    # Așteaptă slotul rezervat în găleată; RateLimitExceeded dacă coada e deja plină. Un slot care ar veni
+    # după termenul clientului nu e rezervat deloc
+    wait = anaf_limiter.reserve(max_wait=remaining(deadline))
+    if wait is None:
+        raise DeadlineExceeded()
+    if wait > 0:
+        time.sleep(wait)
+    return _post_anaf(entries, deadline)
+
+
+def _anaf_error_message(exc: Exception) -> str:
+    if isinstance(exc, CircuitOpenError): return "Serviciul ANAF este temporar indisponibil. Încercați din nou mai târziu."
+    if isinstance(exc, RateLimitExceeded): return "Prea multe cereri către ANAF. Încercați din nou în câteva secunde."
+    if isinstance(exc, DeadlineExceeded): return "Serviciul ANAF nu a răspuns în timpul cerut"
+    if isinstance(exc, requests.HTTPError): return "Serviciul ANAF este temporar indisponibil"
+    if isinstance(exc, requests.Timeout): return "Serviciul ANAF nu răspunde. Încercați din nou mai târziu."
+    if isinstance(exc, requests.RequestException): return "Eroare de conexiune la serviciul ANAF"
+    return "A apărut o eroare la procesarea cererii"
+
+
+def _batch_result(key: tuple, company_data, stale: bool = False) -> dict:
+    cui, day = key
+    if company_data:
+        result = {"cui": cui, "date": day, "status": "found", "data": company_data.to_dict()}
+    else:
+        result = {"cui": cui, "date": day, "status": "notFound", "error": f"Nu s-a găsit o companie cu codul fiscal {cui} în registrul ANAF"}
+    if stale:
+        result["stale"] = True
+    return result
+
+
+def _validated_key(raw_cui, day: str) -> tuple:
+    try:
+        return normalize_lookup_key(clean_cif(raw_cui), day), None
+    except ValueError as exc:
+        return None, str(exc)
+
+
+def _resolve_anaf_chunk(chunk: list, expired: dict = None, deadline: float = None) -> dict:
+    """Un apel ANAF pentru până la ANAF_BATCH_SIZE chei; la eroare se folosesc datele expirate, dacă există"""
+    resolved = {}
+    try:
+        index = index_anaf_found(fetch_anaf([{"cui": int(cui), "data": day} for cui, day in chunk], deadline))
+    except Exception as exc:
+        error = _anaf_error_message(exc)
+        for key in chunk:
+            if expired and key in expired:
+                anaf_cache.stale_on_error += 1
+                resolved[key] = _batch_result(key, expired[key], stale=True)
+            else:
+                resolved[key] = {"cui": key[0], "date": key[1], "status": "error", "error": error}
+        return resolved
+    for key in chunk:
+        company = find_company(index, *key)
+        company_data = map_anaf_company(company, key[0]) if company else None
+        anaf_cache.set(key, company_data, interval=stable_interval(company, key[1]) if company else None)
+        resolved[key] = _batch_result(key, company_data)
+    return resolved
+
+
+def iter_anaf_batch(entries: list[tuple[str, str]], deadline: float = None):
+    """
+    Generează (poziție, rezultat) pentru perechi (cui, dată) pe măsură ce sunt disponibile:
+    întâi cele invalide și cele din cache, apoi câte un lot de ANAF_BATCH_SIZE după fiecare apel ANAF
+    """
+    positions, missing, expired = {}, [], {}
+    for position, (raw_cui, day) in enumerate(entries):
+        # CUI-urile invalide (format, lungime, cifră de control) nu ajung la ANAF
+        key, error = _validated_key(raw_cui, day)
+        if key:
+            anaf_prewarmer.record(key[0])
+            positions.setdefault(key, []).append(position)
+        else:
+            yield position, {"cui": str(raw_cui).strip(), "date": day, "status": "invalid", "error": LOOKUP_ERROR_MESSAGES[error]}
+    for key, key_positions in positions.items():
+        state, cached = anaf_cache.lookup(key)
+        if state == FRESH:
+            result = _batch_result(key, cached)
+        elif state == STALE:
+            anaf_refresher.schedule(key)
+            result = _batch_result(key, cached, stale=True)
+        else:
+            if state == EXPIRED:
+                expired[key] = cached
+            missing.append(key)
+            continue
+        for position in key_positions:
+            yield position, result
+    while missing:
+        chunk, missing = missing[:ANAF_BATCH_SIZE], missing[ANAF_BATCH_SIZE:]
+        resolved = _resolve_anaf_chunk(chunk, expired, deadline)
+        for key, result in resolved.items():
+            for position in positions[key]:
+                yield position, result
+        # Intervalele din răspuns pot acoperi alte date cerute pentru aceleași CUI-uri
+        found = {key[0] for key, result in resolved.items() if result["status"] == "found"}
+        rest = []
+        for key in missing:
+            if key[0] in found:
+                state, cached = anaf_cache.lookup(key)
+                if state == FRESH:
+                    for position in positions[key]:
+                        yield position, _batch_result(key, cached)
+                    continue
+            rest.append(key)
+        missing = rest
+
+
+def lookup_anaf_batch(entries: list[tuple[str, str]], deadline: float = None) -> list[dict]:
+    """Ca iter_anaf_batch, dar așteaptă toate loturile; rezultatele păstrează ordinea intrărilor"""
+    results = [None] * len(entries)
+    for position, result in iter_anaf_batch(entries, deadline):
+        results[position] = result
+    return results
+
+
+def _fetch_company(key: tuple):
+    company = anaf_coalescer.lookup(*key)
+    company_data = map_anaf_company(company, key[0]) if company else None
+    anaf_cache.set(key, company_data, interval=stable_interval(company, key[1]) if company else None)
+    return company_data
+
+
+def _refresh_company(key: tuple, deadline: float = None):
+    try:
+        # Apelul comun nu are termenul niciunui apelant; fiecare își limitează doar propria așteptare
+        return anaf_flights.do(key, lambda: _fetch_company(key), timeout=remaining(deadline))
+    except FuturesTimeoutError:
+        # Apelul continuă pentru ceilalți apelanți și rezultatul lui ajunge în cache; doar acesta nu mai așteaptă
+        raise DeadlineExceeded()
+
+
+def lookup_company(cui: str, search_date: str, deadline: float = None) -> tuple:
+    """
+    Întoarce (date companie sau None dacă ANAF nu o găsește, stale). Intrările vechi din cache se servesc
+    imediat și se reîmprospătează în fundal; dacă ANAF cade, se servește ultima valoare cunoscută.
+    O dată care nu e YYYY-MM-DD e ValueError("invalid_date"), înainte de cache, coalescer și single-flight.
+    """
+    key = normalize_lookup_key(cui, search_date)
+    anaf_prewarmer.record(key[0])
+    state, company_data = anaf_cache.lookup(key)
+    if state == FRESH:
+        return company_data, False
+    if state == STALE:
+        anaf_refresher.schedule(key)
+        return company_data, True
+    try:
+        # Apel către ANAF (deduplicat și grupat cu alte căutări concurente)
+        return _refresh_company(key, deadline), False
+    except (requests.RequestException, CircuitOpenError, RateLimitExceeded, DeadlineExceeded):
+        if state != EXPIRED:
+            raise
+        anaf_cache.stale_on_error += 1
+        return company_data, True
+
+
+# Oprește temporar apelurile către ANAF când acesta răspunde cu erori sau foarte lent
+anaf_breaker = CircuitBreaker()
+# Ritmul apelurilor către ANAF (găleată comună worker-ilor, printr-un fișier SQLite)
+anaf_limiter = build_bucket(ANAF_RATE_LIMIT_PATH)
+# Latența recentă a ANAF: din ea se derivă timeout-ul de citire și momentul dublării unui apel lent
+anaf_latency = LatencyTracker(ANAF_READ_TIMEOUT)
+# Conexiunile către ANAF sunt deschise la pornirea fiecărui worker și ținute calde între valurile de trafic
+anaf_warmer = ConnectionWarmer(ANAF_URL, _open_anaf_connection)
+# Reîncercările erorilor trecătoare: cel mult ~10% apeluri în plus, fiecare cu slotul ei la limitator
+anaf_retries = RetryPolicy(_anaf_retryable, limiter=anaf_limiter, breaker=anaf_breaker)
+# Rezultatele mapate (inclusiv "notFound") sunt păstrate în cache pe (cui, dată): în proces și,
+# printr-un fișier SQLite, comun tuturor worker-ilor de pe mașină
+anaf_cache = build_cache(
+    ANAF_CACHE_MAXSIZE,
+    CachePolicy(ANAF_CACHE_TTL_SECONDS, ANAF_CACHE_NEGATIVE_TTL_SECONDS, ANAF_CACHE_STALE_SECONDS, ANAF_CACHE_STALE_IF_ERROR_SECONDS),
+    ANAF_SHARED_CACHE_PATH
+)
+anaf_refresher = BackgroundRefresher(_refresh_company)
+# Cele mai căutate CUI-uri sunt numărate aproximativ; intrările lor de azi se reîmprospătează
+# în fundal, în loturi pline de câte 100, înainte să expire
+anaf_prewarmer = CachePrewarmer(PopularitySketch(), anaf_cache, _resolve_anaf_chunk)
+# Căutările individuale concurente sunt grupate într-un singur apel ANAF; cât un lot își așteaptă
+# rândul la limitator, se umple cu căutările care sosesc între timp
+anaf_coalescer = LookupCoalescer(_post_anaf, window_ms=ANAF_COALESCE_WINDOW_MS, max_batch=ANAF_COALESCE_MAX_BATCH, limiter=anaf_limiter)
+# Căutările identice aflate în curs (același cui și aceeași dată) împart un singur apel
+anaf_flights = SingleFlight()
+# Registrul local al firmelor (din datele deschise), consultat înaintea ANAF când nu se cere starea TVA
+anaf_registry = build_registry(ANAF_REGISTRY_PATH)
+# Job-urile de verificare în masă: salvate în SQLite și procesate în fundal, în loturi de 100 CUI-uri
+anaf_jobs = build_job_store(ANAF_JOBS_PATH)
+anaf_job_runner = JobRunner(anaf_jobs, lookup_anaf_batch) if anaf_jobs is not None else None
+
+
+@app.before_request
+def start_anaf_background():
+    # Pornite la prima cerere din fiecare worker (după fork), nu la importul modulului; runner-ul reia
+    # și job-urile rămase neterminate după o repornire, fără să aștepte ca cineva să le interogheze
+    anaf_warmer.start()
+    if anaf_job_runner is not None:
+        anaf_job_runner.start()
+
+
 # Routes
 @app.route('/')
 def home():
@@ -252,6 +585,51 @@ def tool_cnp_validator():
         return jsonify({"error": "invalid_cnp"}), 400
 
 
+def _wants_ndjson() -> bool:
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _ndjson(item) -> str:
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+@app.route('/api/tools/cif-validator', methods=['POST'])
+def tool_cif_validator():
+    data = request.get_json(silent=True) or {}
+    if "cifs" not in data:
+        cif_value = data.get("cif", "")
+        if not cif_value: return jsonify({"error": "cif_required"}), 400
+        try:
+            return jsonify(parse_cif(cif_value))
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+    items = data.get("cifs")
+    if not isinstance(items, list) or not items: return jsonify({"error": "cifs_required"}), 400
+    if len(items) > CIF_VALIDATOR_MAX_ITEMS: return jsonify({"error": "too_many_cifs"}), 400
+    if _wants_ndjson():
+        return Response(map(_ndjson, _stream_cif_results(items)), mimetype=NDJSON_MIMETYPE)
+    results = list(_iter_cif_results(items))
+    valid = sum(1 for result in results if result["valid"])
+    return jsonify({"results": results, "summary": {"total": len(results), "valid": valid, "invalid": len(results) - valid}})
+
+
+def _iter_cif_results(items: list):
+    for item in items:
+        try:
+            yield {"input": item, "valid": True, **parse_cif(item)}
+        except ValueError as exc:
+            yield {"input": item, "valid": False, "error": str(exc)}
+
+
+def _stream_cif_results(items: list):
+    """Câte un rezultat pe linie, iar la final o linie {"summary": ...}"""
+    valid = 0
+    for result in _iter_cif_results(items):
+        valid += result["valid"]
+        yield result
+    yield {"summary": {"total": len(items), "valid": valid, "invalid": len(items) - valid}}
+
+
 @app.route('/api/anaf/company', methods=['POST', 'OPTIONS'])
 def anaf_company_search():
     if request.method == 'OPTIONS':
@@ -259,79 +637,249 @@ def anaf_company_search():
     """Proxy pentru API ANAF - căutare date companie după CUI"""
     data = request.get_json(silent=True) or {}
     cui = data.get("cui", "")
-    search_date = data.get("date") or datetime.now().strftime("%Y-%m-%d")
     
     if not cui:
         return jsonify({"success": False, "error": "Codul fiscal (CUI) este obligatoriu"}), 400
     
-    # Curăță CUI-ul
-    clean_cui = re.sub(r'[^0-9]', '', str(cui))
+    # Validează CUI-ul local (prefix RO, lungime, cifră de control) înainte de apelul ANAF
+    try:
+        clean_cui = clean_cif(cui)
+    except ValueError as exc:
+        return jsonify({"success": False, "error": CIF_ERROR_MESSAGES[str(exc)]}), 400
+    # La fel data: una neinterpretabilă nu ajunge în lotul comun ANAF și nici în cheile cache-ului
+    try:
+        search_date = clean_lookup_date(data["date"]) if data.get("date") else datetime.now().strftime("%Y-%m-%d")
+    except ValueError:
+        return jsonify({"success": False, "error": f"Data {data['date']} nu este în formatul YYYY-MM-DD"}), 400
     
-    if not clean_cui:
-        return jsonify({"success": False, "error": "Cod fiscal invalid"}), 400
+    # Fără starea TVA ("vat": false), firmele din registrul local nu mai ajung la ANAF
+    if data.get("vat") is False and anaf_registry is not None:
+        company_data = anaf_registry.get(clean_cui)
+        if company_data:
+            return jsonify({"success": True, "data": company_data, "source": "registry"})
     
     try:
-        # Apel către ANAF
-        anaf_url = "https://webservicesp.anaf.ro/api/PlatitorTvaRest/v9/tva"
-        anaf_response = requests.post(
-            anaf_url,
-            json=[{"cui": int(clean_cui), "data": search_date}],
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            },
-            timeout=10
-        )
-        
-        if anaf_response.status_code != 200:
-            return jsonify({"success": False, "error": "Serviciul ANAF este temporar indisponibil"}), 500
+        company_data, stale = lookup_company(clean_cui, search_date, parse_deadline(request.headers.get(DEADLINE_HEADER)))
         
-        anaf_data = anaf_response.json()
-        
-        # Verifică dacă compania a fost găsită
-        if anaf_data.get("found") and len(anaf_data["found"]) > 0:
-            company = anaf_data["found"][0]
-            date_generale = company.get("date_generale", {})
-            adresa_sediu = company.get("adresa_sediu_social", {})
-            
-            # Construiește adresa completă
-            adresa_parts = []
-            if adresa_sediu.get("sdenumire_Strada"):
-                adresa_parts.append(adresa_sediu["sdenumire_Strada"])
-            if adresa_sediu.get("snumar_Strada"):
-                adresa_parts.append(f"Nr. {adresa_sediu['snumar_Strada']}")
-            if adresa_sediu.get("sdenumire_Localitate"):
-                adresa_parts.append(adresa_sediu["sdenumire_Localitate"])
-            if adresa_sediu.get("sdenumire_Judet"):
-                adresa_parts.append(adresa_sediu["sdenumire_Judet"])
-            
-            adresa_completa = ", ".join(adresa_parts) if adresa_parts else date_generale.get("adresa", "")
-            
-            return jsonify({
-                "success": True,
-                "data": {
-                    "cui": date_generale.get("cui", clean_cui),
-                    "denumire": date_generale.get("denumire", ""),
-                    "nrRegCom": date_generale.get("nrRegCom", ""),
-                    "adresa": adresa_completa,
-                    "oras": adresa_sediu.get("sdenumire_Localitate", ""),
-                    "judet": adresa_sediu.get("sdenumire_Judet", ""),
-                    "telefon": date_generale.get("telefon", ""),
-                    "codPostal": date_generale.get("codPostal", ""),
-                    "platitorTVA": company.get("inregistrare_scop_Tva", {}).get("scpTVA", False)
-                }
-            })
-        else:
-            return jsonify({"success": False, "error": f"Nu s-a găsit o companie cu codul fiscal {clean_cui} în registrul ANAF"}), 404
+        # Verifică dacă compania a fost găsită; JSON-ul firmei din cache e serializat o singură dată
+        if company_data:
+            return Response(company_response_json(company_data, stale), mimetype="application/json")
+        result = {"success": False, "error": f"Nu s-a găsit o companie cu codul fiscal {clean_cui} în registrul ANAF"}
+        # Date servite din cache fără confirmare recentă de la ANAF
+        if stale:
+            result["stale"] = True
+        return jsonify(result), 404
             
             
+    except CircuitOpenError as e:
+        return jsonify({"success": False, "error": _anaf_error_message(e)}), 503, {"Retry-After": str(math.ceil(e.retry_after))}
+    except RateLimitExceeded as e:
+        return jsonify({"success": False, "error": _anaf_error_message(e)}), 429, {"Retry-After": str(math.ceil(e.retry_after))}
+    except requests.HTTPError:
+        return jsonify({"success": False, "error": "Serviciul ANAF este temporar indisponibil"}), 500
     except requests.Timeout:
         return jsonify({"success": False, "error": "Serviciul ANAF nu răspunde. Încercați din nou mai târziu."}), 504
+    except DeadlineExceeded as e:
+        return jsonify({"success": False, "error": _anaf_error_message(e)}), 504
     except requests.RequestException as e:
         return jsonify({"success": False, "error": "Eroare de conexiune la serviciul ANAF"}), 500
     except Exception as e:
         return jsonify({"success": False, "error": "A apărut o eroare la procesarea cererii"}), 500
 
 
+@app.route('/api/anaf/company/timeline', methods=['POST', 'OPTIONS'])
+def anaf_company_timeline():
+    if request.method == 'OPTIONS':
+        return '', 204
+    """Starea TVA a unui CUI la mai multe date (de ex. datele facturilor), în cât mai puține apeluri ANAF"""
+    data = request.get_json(silent=True) or {}
+    dates = data.get("dates")
+    
+    if not data.get("cui"):
+        return jsonify({"success": False, "error": "Codul fiscal (CUI) este obligatoriu"}), 400
+    try:
+        clean_cui = clean_cif(data["cui"])
+    except ValueError as exc:
+        return jsonify({"success": False, "error": CIF_ERROR_MESSAGES[str(exc)]}), 400
+    if not isinstance(dates, list) or not dates:
+        return jsonify({"success": False, "error": "Lista de date (dates) este obligatorie"}), 400
+    days = set()
+    for day in dates:
+        try:
+            days.add(date.fromisoformat(str(day).strip()).isoformat())
+        except ValueError:
+            return jsonify({"success": False, "error": f"Data {day} nu este în formatul YYYY-MM-DD"}), 400
+    if len(days) > ANAF_TIMELINE_MAX_DATES:
+        return jsonify({"success": False, "error": f"Se pot verifica cel mult {ANAF_TIMELINE_MAX_DATES} date per cerere"}), 400
+    
+    # Aceeași firmă la date diferite: până la 100 de date într-un apel ANAF
+    entries = [(clean_cui, day) for day in spread_days(days, ANAF_BATCH_SIZE)]
+    company, timeline = build_timeline(lookup_anaf_batch(entries, parse_deadline(request.headers.get(DEADLINE_HEADER))))
+    return jsonify({"success": True, "cui": clean_cui, "data": company, "timeline": timeline})
+
+
+@app.route('/api/anaf/companies', methods=['POST', 'OPTIONS'])
+def anaf_companies_search():
+    if request.method == 'OPTIONS':
+        return '', 204
+    """Proxy pentru API ANAF - căutare în lot (până la 100 CUI-uri per apel ANAF)"""
+    data = request.get_json(silent=True) or {}
+    items = data.get("cuis")
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "error": "Lista de coduri fiscale (cuis) este obligatorie"}), 400
+    if len(items) > ANAF_BATCH_MAX_CUIS:
+        return jsonify({"success": False, "error": f"Se pot verifica cel mult {ANAF_BATCH_MAX_CUIS} coduri fiscale per cerere"}), 400
+    try:
+        default_date = clean_lookup_date(data["date"]) if data.get("date") else datetime.now().strftime("%Y-%m-%d")
+    except ValueError:
+        return jsonify({"success": False, "error": f"Data {data['date']} nu este în formatul YYYY-MM-DD"}), 400
+    
+    entries = []
+    for item in items:
+        raw_cui, item_date = (item.get("cui", ""), item.get("date")) if isinstance(item, dict) else (item, None)
+        entries.append((raw_cui, item_date or default_date))
+    
+    # Loturile rămase după termenul clientului (X-Deadline-Ms) primesc status "error"
+    deadline = parse_deadline(request.headers.get(DEADLINE_HEADER))
+    # Cu Accept: application/x-ndjson fiecare rezultat pleacă imediat ce lotul lui ANAF a răspuns
+    if _wants_ndjson():
+        return Response(map(_ndjson, _stream_anaf_batch(entries, deadline)), mimetype=NDJSON_MIMETYPE)
+    results = lookup_anaf_batch(entries, deadline)
+    summary = {"total": len(results), "found": 0, "notFound": 0, "invalid": 0, "error": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return jsonify({"success": True, "results": results, "summary": summary})
+
+
+def _stream_anaf_batch(entries: list, deadline: float = None):
+    """Rezultatele în ordinea sosirii, fiecare cu poziția ("index") din cerere; ultima linie e {"summary": ...}"""
+    summary = {"total": len(entries), "found": 0, "notFound": 0, "invalid": 0, "error": 0}
+    for position, result in iter_anaf_batch(entries, deadline):
+        summary[result["status"]] += 1
+        yield {"index": position, **result}
+    yield {"summary": summary}
+
+
+JOB_INPUT_ERRORS = {
+    "csv_cui_column_missing": "Fișierul CSV trebuie să aibă o coloană cui (sau cif / cod_fiscal)",
+    "invalid_date": "Datele trebuie să fie în formatul YYYY-MM-DD"
+}
+
+
+def _job_entries(default_date: str) -> list:
+    """Intrările (cui, dată) dintr-un fișier CSV încărcat, un corp text/csv sau JSON {"cuis": [...]}"""
+    upload = request.files.get("file")
+    if upload is not None:
+        entries = parse_job_csv(upload.read().decode("utf-8-sig", errors="replace"))
+    elif request.mimetype in ("text/csv", "text/plain"):
+        entries = parse_job_csv(request.get_data(as_text=True))
+    else:
+        data = request.get_json(silent=True) or {}
+        items = data.get("cuis")
+        if not isinstance(items, list):
+            return []
+        default_date = data.get("date") or default_date
+        entries = [(item.get("cui", ""), item.get("date")) if isinstance(item, dict) else (item, None) for item in items]
+    return job_entries(entries, default_date)
+
+
+@app.route('/api/anaf/jobs', methods=['POST', 'OPTIONS'])
+def anaf_job_create():
+    if request.method == 'OPTIONS':
+        return '', 204
+    """Job de verificare în masă: se primește imediat un jobId, rezultatele se citesc pe măsură ce sunt procesate"""
+    if anaf_jobs is None:
+        return jsonify({"success": False, "error": "Verificarea în masă nu este disponibilă"}), 503
+    try:
+        entries = _job_entries(request.args.get("date") or datetime.now().strftime("%Y-%m-%d"))
+    except JobInputError as exc:
+        return jsonify({"success": False, "error": JOB_INPUT_ERRORS[str(exc)]}), 400
+    if not entries:
+        return jsonify({"success": False, "error": "Lista de coduri fiscale (cuis sau fișier CSV) este obligatorie"}), 400
+    if len(entries) > ANAF_JOB_MAX_CUIS:
+        return jsonify({"success": False, "error": f"Un job poate conține cel mult {ANAF_JOB_MAX_CUIS} coduri fiscale"}), 400
+    job_id = anaf_jobs.create(entries)
+    anaf_job_runner.wake()
+    return jsonify({"success": True, **anaf_jobs.get(job_id)}), 202, {"Location": f"/api/anaf/jobs/{job_id}"}
+
+
+@app.route('/api/anaf/jobs/<job_id>')
+def anaf_job_status(job_id):
+    if anaf_jobs is None:
+        return jsonify({"success": False, "error": "Verificarea în masă nu este disponibilă"}), 503
+    job = anaf_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job inexistent"}), 404
+    return jsonify({"success": True, **job})
+
+
+@app.route('/api/anaf/jobs/<job_id>/results')
+def anaf_job_results(job_id):
+    if anaf_jobs is None:
+        return jsonify({"success": False, "error": "Verificarea în masă nu este disponibilă"}), 503
+    if anaf_jobs.get(job_id) is None:
+        return jsonify({"success": False, "error": "Job inexistent"}), 404
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = max(1, min(int(request.args.get("limit", 100)), 1000))
+    except ValueError:
+        return jsonify({"success": False, "error": "Parametrii offset și limit trebuie să fie numere"}), 400
+    if _wants_ndjson():
+        # Rezultatele procesate de la offset, fără limită, citite din SQLite pe măsură ce sunt trimise
+        return Response(map(_ndjson, anaf_jobs.iter_results(job_id, offset=offset)), mimetype=NDJSON_MIMETYPE)
+    return jsonify({"success": True, "jobId": job_id, "offset": offset, "limit": limit, "results": anaf_jobs.results(job_id, offset, limit)})
+
+
+@app.route('/api/anaf/jobs/<job_id>/results.csv')
+def anaf_job_results_csv(job_id):
+    if anaf_jobs is None:
+        return jsonify({"success": False, "error": "Verificarea în masă nu este disponibilă"}), 503
+    if anaf_jobs.get(job_id) is None:
+        return jsonify({"success": False, "error": "Job inexistent"}), 404
+    return Response(
+        iter_results_csv(anaf_jobs.iter_results(job_id)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="anaf-{job_id}.csv"'}
+    )
+
+
+@app.route('/api/companies/suggest')
+def companies_suggest():
+    """Autocompletare după denumire, din registrul local (fără apel ANAF)"""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"success": False, "error": "Parametrul q este obligatoriu"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 10)), 50))
+    except ValueError:
+        return jsonify({"success": False, "error": "Parametrul limit trebuie să fie un număr"}), 400
+    results = anaf_registry.suggest(query, limit) if anaf_registry is not None else None
+    if results is None:
+        return jsonify({"success": False, "error": "Registrul local al firmelor nu este disponibil"}), 503
+    return jsonify({"success": True, "query": query, "results": results})
+
+
+@app.route('/api/companies/search')
+def companies_search():
+    """Căutare tolerantă la greșeli de tastare după denumire, din registrul local"""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"success": False, "error": "Parametrul q este obligatoriu"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 10)), 50))
+    except ValueError:
+        return jsonify({"success": False, "error": "Parametrul limit trebuie să fie un număr"}), 400
+    results = anaf_registry.search(query, limit) if anaf_registry is not None else None
+    if results is None:
+        return jsonify({"success": False, "error": "Registrul local al firmelor nu este disponibil"}), 503
+    return jsonify({"success": True, "query": query, "results": results})
+
+
+@app.route('/api/anaf/status')
+def anaf_status():
+    return jsonify({"breaker": anaf_breaker.stats(), "rateLimit": anaf_limiter.stats(), "latency": anaf_latency.stats(), "retries": anaf_retries.stats(), "warmup": anaf_warmer.stats(), "cache": anaf_cache.stats(), "coalescer": anaf_coalescer.stats(), "singleFlight": anaf_flights.stats(), "refresher": anaf_refresher.stats(), "prewarm": anaf_prewarmer.stats(), "registry": anaf_registry.stats() if anaf_registry else None, "jobs": anaf_job_runner.stats() if anaf_job_runner else None})
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
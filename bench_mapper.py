@@ -0,0 +1,115 @@
+"""
+Microbenchmark pentru maparea răspunsurilor ANAF (anaf_mapper).
+
+Compară maparea veche (dict construit cu lanțuri de .get(), serializat la
+fiecare răspuns) cu înregistrarea `Company`: timpul de mapare pentru un lot
+de 100 de firme, memoria ocupată de înregistrările din cache și costul
+serializării unui răspuns servit din cache.
+
+    python bench_mapper.py --companies 10000 --repeat 200
+"""
+import argparse
+import json
+import random
+import timeit
+import tracemalloc
+
+from anaf_mapper import company_response_json, map_anaf_company
+
+COUNTIES = ["MUNICIPIUL BUCUREŞTI", "CLUJ", "TIMIŞ", "IAŞI", "CONSTANŢA", "BRAŞOV", "PRAHOVA", "DOLJ", "BIHOR", "ARGEŞ"]
+LOCALITIES = ["Sector 1", "Sector 2", "Sector 3", "Cluj-Napoca", "Timişoara", "Iaşi", "Constanţa", "Braşov", "Ploieşti", "Craiova"]
+
+
+def legacy_map_anaf_company(company: dict, fallback_cui: str) -> dict:
+    """Maparea de dinainte de anaf_mapper, păstrată doar pentru comparație"""
+    date_generale = company.get("date_generale", {})
+    adresa_sediu = company.get("adresa_sediu_social", {})
+    adresa_parts = []
+    if adresa_sediu.get("sdenumire_Strada"):
+        adresa_parts.append(adresa_sediu["sdenumire_Strada"])
+    if adresa_sediu.get("snumar_Strada"):
+        adresa_parts.append(f"Nr. {adresa_sediu['snumar_Strada']}")
+    if adresa_sediu.get("sdenumire_Localitate"):
+        adresa_parts.append(adresa_sediu["sdenumire_Localitate"])
+    if adresa_sediu.get("sdenumire_Judet"):
+        adresa_parts.append(adresa_sediu["sdenumire_Judet"])
+    adresa_completa = ", ".join(adresa_parts) if adresa_parts else date_generale.get("adresa", "")
+    return {
+        "cui": date_generale.get("cui", fallback_cui),
+        "denumire": date_generale.get("denumire", ""),
+        "nrRegCom": date_generale.get("nrRegCom", ""),
+        "adresa": adresa_completa,
+        "oras": adresa_sediu.get("sdenumire_Localitate", ""),
+        "judet": adresa_sediu.get("sdenumire_Judet", ""),
+        "telefon": date_generale.get("telefon", ""),
+        "codPostal": date_generale.get("codPostal", ""),
+        "platitorTVA": company.get("inregistrare_scop_Tva", {}).get("scpTVA", False),
+    }
+
+
+def sample_found(count: int, seed: int = 42) -> list:
+    """Firme în formatul "found" din ANAF v9; județele și localitățile vin ca șiruri noi, ca după json.loads"""
+    rng = random.Random(seed)
+    found = []
+    for index in range(count):
+        position = rng.randrange(len(COUNTIES))
+        found.append(json.loads(json.dumps({
+            "date_generale": {
+                "cui": 1000000 + index,
+                "data": "2024-01-01",
+                "denumire": f"FIRMA {index} SRL",
+                "nrRegCom": f"J40/{index}/2010",
+                "adresa": "",
+                "telefon": "0210000000",
+                "codPostal": "010101",
+            },
+            "adresa_sediu_social": {
+                "sdenumire_Strada": f"Str. Exemplu {index % 300}",
+                "snumar_Strada": str(index % 90 + 1),
+                "sdenumire_Localitate": LOCALITIES[position],
+                "sdenumire_Judet": COUNTIES[position],
+            },
+            "inregistrare_scop_Tva": {"scpTVA": index % 3 != 0, "perioade_TVA": []},
+        })))
+    return found
+
+
+def retained_bytes(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    records = build()
+    size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark pentru maparea firmelor din răspunsurile ANAF")
+    parser.add_argument("--companies", type=int, default=10000, help="firme ținute în cache la măsurarea memoriei")
+    parser.add_argument("--repeat", type=int, default=200, help="repetări pentru fiecare măsurătoare de timp")
+    args = parser.parse_args()
+
+    batch = sample_found(100)
+    legacy_record, record = legacy_map_anaf_company(batch[0], "1"), map_anaf_company(batch[0], "1")
+    assert record.to_dict() == legacy_record, "maparea nouă trebuie să dea aceleași câmpuri"
+
+    rows = [
+        ("map lot 100 (legacy dict)", lambda: [legacy_map_anaf_company(company, "1") for company in batch], 100),
+        ("map lot 100 (Company)", lambda: [map_anaf_company(company, "1") for company in batch], 100),
+        ("răspuns din cache (json.dumps dict)", lambda: json.dumps({"success": True, "data": legacy_record}, ensure_ascii=False), 1),
+        ("răspuns din cache (Company)", lambda: company_response_json(record), 1),
+    ]
+    print(f"{'măsurătoare':<40}{'µs/apel':>12}{'µs/firmă':>12}")
+    for name, fn, per in rows:
+        seconds = min(timeit.repeat(fn, number=args.repeat, repeat=5)) / args.repeat
+        print(f"{name:<40}{seconds * 1e6:>12.2f}{seconds * 1e6 / per:>12.3f}")
+
+    found = sample_found(args.companies)
+    legacy_size = retained_bytes(lambda: [legacy_map_anaf_company(company, "1") for company in found])
+    size = retained_bytes(lambda: [map_anaf_company(company, "1") for company in found])
+    print(f"memorie {args.companies} firme în cache: legacy {legacy_size / args.companies:.0f} B/firmă, Company {size / args.companies:.0f} B/firmă")
+
+
+if __name__ == "__main__":
+    main()
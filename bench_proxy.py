@@ -0,0 +1,259 @@
+"""
+Benchmark de încărcare pentru proxy-ul ANAF: Flask (app.py) și FastAPI (anaf_api.py), unul lângă altul.
+
+Fiecare aplicație pornește ca server separat (gunicorn sau serverul Flask
+pentru app.py, uvicorn pentru anaf_api.py), cu cache-urile într-un director
+temporar nou și cu ANAF_URL către un `anaf_mock.MockANAF` pornit în proces,
+așa că nu e nevoie de rețea. Ambele aplicații primesc exact aceeași secvență
+de cereri, generată din `--seed`: CUI-uri alese după o distribuție Zipf (câteva
+CUI-uri foarte căutate, multe rare), trimise de `--concurrency` clienți
+simultani către /api/anaf/company sau /api/anaf/companies.
+
+Se raportează throughput-ul, percentilele latenței, erorile, apelurile și
+intrările trimise către ANAF (din /__stats al mock-ului) și rata de hit a
+cache-ului (din /api/anaf/status; cu mai mulți worker-i, doar pentru cel care
+răspunde la cererea de status).
+
+    python bench_proxy.py --scenario company --requests 5000 --concurrency 32 --latency lognormal:150:0.4
+    python bench_proxy.py --scenario batch --batch-size 50 --targets flask --env ANAF_RATE_LIMIT_PER_SECOND=1
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+import requests
+
+from anaf_cif import compute_cif_control_digit
+from anaf_mock import FixtureStore, MockANAF, MockConfig
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(target: str, port: int, workers: int, threads: int) -> tuple:
+    """(comanda, descrierea) cu care pornește aplicația, ca în producție când serverul e instalat"""
+    bind = f"127.0.0.1:{port}"
+    if target == "fastapi":
+        return [sys.executable, "-m", "uvicorn", "anaf_api:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning"], f"uvicorn x{workers}"
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [sys.executable, "-m", "gunicorn", "app:app", "--bind", bind, "--workers", str(workers),
+                "--threads", str(threads), "--log-level", "warning"], f"gunicorn x{workers}, {threads} thread-uri"
+    # Fără gunicorn: serverul Flask cu un thread per cerere (un singur proces)
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    return [sys.executable, "-c", code], "werkzeug threaded"
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serverul s-a oprit la pornire (cod {process.returncode})")
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("serverul nu a pornit la timp")
+
+
+def build_workload(args) -> list:
+    """Secvența de cereri (cale, corp JSON), aceeași pentru toate aplicațiile"""
+    rng = random.Random(args.seed)
+    cuis = []
+    for base in range(3000000, 3000000 + args.cuis):
+        cuis.append(f"{base}{compute_cif_control_digit(str(base))}")
+    cum_weights = list(accumulate(1 / rank ** args.zipf for rank in range(1, len(cuis) + 1)))
+    workload = []
+    for _ in range(args.warmup + args.requests):
+        scenario = args.scenario if args.scenario != "mixed" else rng.choice(("company", "company", "company", "batch"))
+        if scenario == "company":
+            workload.append(("/api/anaf/company", {"cui": rng.choices(cuis, cum_weights=cum_weights)[0], "date": args.date}))
+        else:
+            batch = rng.choices(cuis, cum_weights=cum_weights, k=args.batch_size)
+            workload.append(("/api/anaf/companies", {"cuis": batch, "date": args.date}))
+    return workload
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def drive(base_url: str, workload: list, concurrency: int) -> dict:
+    """Trimite cererile cu `concurrency` clienți (câte o sesiune keep-alive fiecare) și măsoară fiecare cerere"""
+    local = threading.local()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def send(item):
+        path, body = item
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = session.post(base_url + path, json=body, timeout=60).status_code
+        except requests.RequestException:
+            status = "exception"
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, workload))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    # 404 e răspunsul Flask pentru un CUI care nu există la ANAF, nu o eroare
+    errors = sum(count for status, count in statuses.items() if status == "exception" or status >= 500 or status == 429)
+    return {
+        "requests": len(workload),
+        "seconds": round(wall, 3),
+        "throughput": round(len(workload) / wall, 1) if wall else None,
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else None,
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+
+def _tail(log, size: int = 2000) -> str:
+    log.flush()
+    log.seek(max(log.seek(0, os.SEEK_END) - size, 0))
+    return log.read().decode(errors="replace")
+
+
+def run_target(target: str, args, workload: list) -> dict:
+    mock = MockANAF(
+        FixtureStore(args.fixtures),
+        MockConfig(latency=args.latency, per_entry_ms=args.per_entry_ms, error_rate=args.error_rate,
+                   rate_limit=args.anaf_rate_limit, rate_burst=args.anaf_rate_burst, seed=args.seed),
+    ).start()
+    workdir = tempfile.mkdtemp(prefix=f"bench_{target}_")
+    env = {
+        **os.environ,
+        "ANAF_URL": mock.url,
+        "ANAF_SHARED_CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "ANAF_RATE_LIMIT_PATH": os.path.join(workdir, "ratelimit.sqlite3"),
+        "ANAF_JOBS_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "ANAF_RATE_LIMIT_PER_SECOND": "0",
+        "ANAF_RATE_LIMIT_MAX_QUEUE": "1000",
+    }
+    env.update(item.split("=", 1) for item in args.env)
+    port = free_port()
+    command, server = server_command(target, port, args.workers, args.threads)
+    # Jurnalul serverului merge într-un fișier: un pipe necitit s-ar umple și ar bloca serverul
+    log = open(os.path.join(workdir, "server.log"), "w+b")
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, process)
+        drive(base_url, workload[:args.warmup], args.concurrency)
+        upstream_before = requests.get(mock.url.split("/api/")[0] + "/__stats").json()
+        cache_before = requests.get(f"{base_url}/api/anaf/status").json()["cache"]
+        result = drive(base_url, workload[args.warmup:], args.concurrency)
+        upstream = requests.get(mock.url.split("/api/")[0] + "/__stats").json()
+        cache = requests.get(f"{base_url}/api/anaf/status").json()["cache"]
+    except Exception as exc:
+        return {"target": target, "server": server, "error": str(exc) or exc.__class__.__name__,
+                "log": _tail(log)}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        mock.stop()
+        log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    hits = cache["hits"] + cache["staleHits"] - cache_before["hits"] - cache_before["staleHits"]
+    misses = cache["misses"] - cache_before["misses"]
+    return {
+        "target": target,
+        "server": server,
+        **result,
+        "upstreamCalls": upstream["requests"] - upstream_before["requests"],
+        "upstreamEntries": upstream["entries"] - upstream_before["entries"],
+        "cacheHitRate": round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+def print_table(results: list):
+    rows = [
+        ("server", lambda r: r["server"]),
+        ("cereri", lambda r: r["requests"]),
+        ("throughput (req/s)", lambda r: r["throughput"]),
+        ("p50 (ms)", lambda r: f"{r['p50'] * 1000:.1f}"),
+        ("p90 (ms)", lambda r: f"{r['p90'] * 1000:.1f}"),
+        ("p99 (ms)", lambda r: f"{r['p99'] * 1000:.1f}"),
+        ("max (ms)", lambda r: f"{r['max'] * 1000:.1f}"),
+        ("erori", lambda r: r["errors"]),
+        ("apeluri ANAF", lambda r: r["upstreamCalls"]),
+        ("intrări ANAF", lambda r: r["upstreamEntries"]),
+        ("cache hit rate", lambda r: r["cacheHitRate"]),
+    ]
+    print(f"{'':<22}" + "".join(f"{r['target']:>28}" for r in results))
+    for name, value in rows:
+        cells = "".join(f"{'-' if 'error' in r else str(value(r)):>28}" for r in results)
+        print(f"{name:<22}{cells}")
+    for r in results:
+        if "error" in r:
+            print(f"\n{r['target']} ({r['server']}): {r['error']}\n{r['log']}".rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de încărcare Flask vs FastAPI pentru proxy-ul ANAF, cu ANAF simulat local")
+    parser.add_argument("--targets", default="flask,fastapi", help="aplicațiile măsurate, separate prin virgulă")
+    parser.add_argument("--scenario", choices=("company", "batch", "mixed"), default="company")
+    parser.add_argument("--requests", type=int, default=2000, help="cereri măsurate per aplicație")
+    parser.add_argument("--warmup", type=int, default=200, help="cereri trimise înainte de măsurare")
+    parser.add_argument("--concurrency", type=int, default=16, help="clienți simultani")
+    parser.add_argument("--cuis", type=int, default=2000, help="CUI-uri distincte din care se aleg cererile")
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponentul distribuției popularității CUI-urilor")
+    parser.add_argument("--batch-size", type=int, default=50, help="CUI-uri per cerere în scenariul batch")
+    parser.add_argument("--date", default="2024-06-03", help="data cerută pentru toate CUI-urile")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="procese worker per aplicație")
+    parser.add_argument("--threads", type=int, default=32, help="thread-uri per worker gunicorn (Flask)")
+    parser.add_argument("--latency", default="lognormal:150:0.4", help="latența ANAF simulat (vezi anaf_mock.py)")
+    parser.add_argument("--per-entry-ms", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--anaf-rate-limit", type=float, default=0.0, help="limita de ritm a ANAF simulat (0 = fără)")
+    parser.add_argument("--anaf-rate-burst", type=int, default=1)
+    parser.add_argument("--fixtures", default=os.path.join(HERE, "anaf_mock_fixtures.jsonl"))
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="variabile de mediu pentru aplicații")
+    parser.add_argument("--json", dest="json_path", help="salvează rezultatele și parametrii în acest fișier")
+    args = parser.parse_args()
+
+    workload = build_workload(args)
+    results = [run_target(target.strip(), args, workload) for target in args.targets.split(",") if target.strip()]
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as out:
+            json.dump({"params": vars(args), "results": results}, out, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Verificări offline pentru proxy-ul ANAF, pe serverul mock local (anaf_mock.py)
+Rulează: python test_anaf_mock.py
+"""
+import os
+import sys
+
+from anaf_mock import MockANAF, MockConfig, FixtureStore
+
+# Cache-urile, limitatorul și job-urile rămân în proces, ca verificările să nu depindă de rulările anterioare
+mock = MockANAF(FixtureStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "anaf_mock_fixtures.jsonl"), strict=True), MockConfig()).start()
+os.environ.update(
+    ANAF_URL=mock.url,
+    ANAF_SHARED_CACHE_PATH="",
+    ANAF_RATE_LIMIT_PATH="",
+    ANAF_JOBS_PATH="",
+    ANAF_PREWARM_TOP_N="0",
+    ANAF_WARM_CONNECTIONS="0",
+)
+
+# Firma 10000083 e înregistrată din 2010: ANAF o întoarce în "notFound" la 2001-01-01 și în "found" după
+TIMELINE_REQUEST = {"cui": "10000083", "dates": ["2001-01-01", "2024-01-01", "2024-06-03"]}
+TIMELINE_EXPECTED = {"2001-01-01": ("notFound", None), "2024-01-01": ("found", True), "2024-06-03": ("found", True)}
+
+
+def print_success(msg):
+    print(f"✓ {msg}")
+
+
+def print_error(msg):
+    print(f"✗ {msg}")
+
+
+def check_timeline(name, timeline):
+    actual = {point["date"]: (point["status"], point.get("platitorTVA")) for point in timeline}
+    if actual == TIMELINE_EXPECTED:
+        print_success(f"{name}: timeline OK")
+        return True
+    print_error(f"{name}: timeline {actual}, expected {TIMELINE_EXPECTED}")
+    return False
+
+
+def test_flask_timeline():
+    """Datele negăsite rămân notFound, și din ANAF, și din cache"""
+    import app
+
+    client = app.app.test_client()
+    results = []
+    for attempt in ("flask (ANAF)", "flask (cache)"):
+        response = client.post("/api/anaf/company/timeline", json=TIMELINE_REQUEST)
+        results.append(response.status_code == 200 and check_timeline(attempt, response.get_json()["timeline"]))
+    return all(results)
+
+
+def test_fastapi_timeline():
+    try:
+        from fastapi.testclient import TestClient
+    except ImportError:
+        print("- fastapi: not installed, skipped")
+        return True
+    import anaf_api
+
+    results = []
+    with TestClient(anaf_api.app) as client:
+        for attempt in ("fastapi (ANAF)", "fastapi (cache)"):
+            response = client.post("/api/anaf/company/timeline", json=TIMELINE_REQUEST)
+            results.append(response.status_code == 200 and check_timeline(attempt, response.json()["timeline"]))
+    return all(results)
+
+
+if __name__ == "__main__":
+    try:
+        passed = [test_flask_timeline(), test_fastapi_timeline()]
+    finally:
+        mock.stop()
+    sys.exit(0 if all(passed) else 1)
@@ -0,0 +1,92 @@
+"""
+Verificări offline pentru registrul local al firmelor (anaf_registry.py), pe anaf_registry_fixtures.csv
+Rulează: python test_anaf_registry.py
+"""
+import os
+import sys
+import tempfile
+
+from anaf_registry import CompanyRegistry, import_registry
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "anaf_registry_fixtures.csv")
+REGISTRY_PATH = os.path.join(tempfile.mkdtemp(), "registry.sqlite3")
+
+# ANAF indisponibil: o căutare care ar ajunge totuși la ANAF ar eșua
+os.environ.update(
+    ANAF_REGISTRY_PATH=REGISTRY_PATH,
+    ANAF_URL="http://127.0.0.1:9/api/PlatitorTvaRest/v9/tva",
+    ANAF_SHARED_CACHE_PATH="",
+    ANAF_RATE_LIMIT_PATH="",
+    ANAF_JOBS_PATH="",
+    ANAF_PREWARM_TOP_N="0",
+    ANAF_WARM_CONNECTIONS="0",
+)
+
+
+def print_success(msg):
+    print(f"✓ {msg}")
+
+
+def print_error(msg):
+    print(f"✗ {msg}")
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print_success(name)
+        return True
+    print_error(f"{name}: {actual!r}, expected {expected!r}")
+    return False
+
+
+def test_import():
+    """Rândul cu cifra de control greșită e sărit"""
+    return check("import", import_registry(REGISTRY_PATH, [FIXTURES_PATH]), 7)
+
+
+def test_lookup():
+    registry = CompanyRegistry(REGISTRY_PATH)
+    company = registry.get("10000016")
+    return all([
+        check("lookup: name", company and company["denumire"], "FIRMA TEST PLATITOR TVA SRL"),
+        check("lookup: address", company and company["adresa"], "Str. Test 92, Nr. 17, Cluj, CLUJ"),
+        check("lookup: CAEN", company and company["caen"], "6201"),
+        check("lookup: RO prefix in CSV", (registry.get("10000024") or {}).get("nrRegCom"), "J13/1025/2004"),
+        check("lookup: missing CUI", registry.get("10000067"), None),
+    ])
+
+
+def test_suggest():
+    registry = CompanyRegistry(REGISTRY_PATH)
+    return all([
+        check("suggest: prefix", [company["cui"] for company in registry.suggest("Firma test TVA")], [10000024, 10000032]),
+        check("suggest: diacritics", [company["cui"] for company in registry.suggest("intreprinderea")], [10000059]),
+        check("suggest: SC and S.A.", [company["cui"] for company in registry.suggest("firma test split tva sa")], [10000040]),
+    ])
+
+
+def test_search():
+    registry = CompanyRegistry(REGISTRY_PATH)
+    return all([
+        check("search: typo", [company["cui"] for company in registry.search("frima test platitor")][:1], [10000016]),
+        check("search: missing letter", [company["cui"] for company in registry.search("brutaria de cartir")][:1], [10000091]),
+    ])
+
+
+def test_flask_company():
+    """Cu "vat": false firma vine din registru, fără ANAF; cu starea TVA cererea merge în continuare la ANAF"""
+    import app
+
+    client = app.app.test_client()
+    local = client.post("/api/anaf/company", json={"cui": "RO10000016", "vat": False}).get_json()
+    upstream = client.post("/api/anaf/company", json={"cui": "10000016"})
+    return all([
+        check("flask: registry answer", (local.get("source"), local["data"]["denumire"]), ("registry", "FIRMA TEST PLATITOR TVA SRL")),
+        check("flask: VAT lookup goes to ANAF", upstream.status_code >= 500, True),
+        check("flask: suggest endpoint", [company["cui"] for company in client.get("/api/companies/suggest?q=brutaria").get_json()["results"]], [10000091]),
+    ])
+
+
+if __name__ == "__main__":
+    passed = [test_import(), test_lookup(), test_suggest(), test_search(), test_flask_company()]
+    sys.exit(0 if all(passed) else 1)